@@ -0,0 +1,174 @@
+import os
+import pathlib
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+
+from dotfiles.manifest import PackageRecord
+from dotfiles.path import DotFiles
+
+SHELLS = ("sh", "zsh")
+# Completion commands run once at install time; a hung binary must not hang the install
+COMPLETION_TIMEOUT = 10
+# The activation script each completion shell of a manifest is loaded from
+_COMPLETION_SHELLS = {"bash": "sh", "zsh": "zsh"}
+_MAN_PAGE = re.compile(r"\.([1-9n])[a-z]*(\.gz)?$")
+_HEADER = "# Generated by dotfiles from the installed packages. Do not edit, it is rewritten on every install.\n"
+
+
+def package_files(record: PackageRecord) -> list[str]:
+    """Return the files of a package that its ``completions`` and ``man`` manifest entries refer to.
+
+    They are extracted along with the binaries when the manifest only asks for these.
+    """
+    return [path for path in record.completions.values() if isinstance(path, str)] + list(record.man)
+
+
+class ActivationScripts:
+    """Static shell scripts setting up the environment of the installed packages.
+
+    The profile block written by ``dotfiles --install`` sources
+    ``apps/activate.sh`` from ``~/.bashrc`` and ``apps/activate.zsh`` from
+    ``~/.zshrc``, so a new shell reads one small file and runs no program.
+    Package manifests contribute to them with three optional keys:
+
+    - ``env``: variables to export, where ``{dir}`` in a value is replaced
+      with the package directory;
+    - ``completions``: per shell (``bash``, ``zsh``), either the path of a
+      completion script in the package, or a command printing one, e.g.
+      ``["fzf", "--bash"]``, which is run once at install time;
+    - ``man``: paths of man pages in the package, linked into ``apps/.man``,
+      which is added to ``MANPATH``.
+
+    Each installed package has one fragment per script in ``apps/.activate``.
+    Installs and uninstalls only regenerate the fragments of their packages,
+    and :meth:`write` then concatenates all of them.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None):
+        self.path = DotFiles.get_activate_dir() if path is None else path
+
+    def update(self, name: str, record: PackageRecord) -> None:
+        """Regenerate the fragments of an installed package from its manifest record.
+
+        Entries referring to missing files or failing commands are skipped with a warning.
+        """
+        self.remove(name)
+        package_dir = DotFiles.get_app_dir() / name
+        lines: dict[str, list[str]] = {shell: [] for shell in SHELLS}
+        for variable, value in record.env.items():
+            line = f"export {variable}={shlex.quote(value.replace('{dir}', str(package_dir)))}"
+            for shell in SHELLS:
+                lines[shell].append(line)
+        for shell, completion in record.completions.items():
+            script = self._completion_script(name, shell, completion, package_dir)
+            if script is None:
+                continue
+            if shell == "bash":
+                lines["sh"].append(f'if [ -n "${{BASH_VERSION:-}}" ]; then . {shlex.quote(str(script))}; fi')
+            else:
+                lines["zsh"].extend(self._zsh_completion(name, script))
+        for page in record.man:
+            self._link_man_page(name, package_dir / page)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        for shell, shell_lines in lines.items():
+            if shell_lines:
+                (self.path / f"{name}.{shell}").write_text(f"# {name}\n" + "\n".join(shell_lines) + "\n")
+
+    def remove(self, name: str) -> None:
+        """Remove the fragments, generated completions and man page links of a package."""
+        for shell in SHELLS:
+            (self.path / f"{name}.{shell}").unlink(missing_ok=True)
+        for shell in _COMPLETION_SHELLS:
+            (self.path / f"{name}.{shell}-completion").unlink(missing_ok=True)
+        shutil.rmtree(self.path / f"{name}.zsh-functions", ignore_errors=True)
+        man_dir = DotFiles.get_man_dir()
+        package_dir = f"{DotFiles.get_app_dir() / name}{os.sep}"
+        if man_dir.is_dir():
+            for section in man_dir.iterdir():
+                for link in section.iterdir():
+                    if link.is_symlink() and os.readlink(link).startswith(package_dir):
+                        link.unlink()
+
+    def write(self) -> None:
+        """Write ``activate.sh`` and ``activate.zsh`` from the fragments of the installed packages."""
+        man_dir = DotFiles.get_man_dir()
+        manpath = []
+        if man_dir.is_dir() and any(any(section.iterdir()) for section in man_dir.iterdir()):
+            # The empty entry left when MANPATH was unset keeps man's default search path
+            manpath = [f'case ":${{MANPATH:-}}:" in *:{shlex.quote(str(man_dir))}:*) ;; '
+                       f'*) export MANPATH={shlex.quote(str(man_dir))}:"${{MANPATH:-}}" ;; esac\n']
+        for shell in SHELLS:
+            fragments = [path.read_text() for path in sorted(self.path.glob(f"*.{shell}"))] \
+                if self.path.is_dir() else []
+            script = DotFiles.get_activate_script(shell)
+            temp_file = script.with_name(f"{script.name}.{os.getpid()}.tmp")
+            temp_file.write_text(_HEADER + "".join(manpath + fragments))
+            os.replace(temp_file, script)
+
+    def _completion_script(self, name: str, shell: str, completion: str | tuple[str, ...],
+                           package_dir: pathlib.Path) -> pathlib.Path | None:
+        if isinstance(completion, str):
+            script = package_dir / completion
+            if not script.is_file():
+                _warn(name, f"{shell} completion script {completion} not found")
+                return None
+            return script
+        command = list(completion)
+        for candidate in (DotFiles.get_bin_dir() / command[0], package_dir / command[0]):
+            if candidate.is_file():
+                command[0] = str(candidate)
+                break
+        try:
+            output = subprocess.run(command, cwd=package_dir, capture_output=True, check=True,
+                                    timeout=COMPLETION_TIMEOUT).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            _warn(name, f"cannot generate {shell} completions: {e}")
+            return None
+        script = self.path / f"{name}.{shell}-completion"
+        self.path.mkdir(parents=True, exist_ok=True)
+        script.write_bytes(output)
+        return script
+
+    def _zsh_completion(self, name: str, script: pathlib.Path) -> list[str]:
+        """Return the lines loading a zsh completion script.
+
+        A completion function, i.e. a file starting with a ``#compdef`` line,
+        is linked as ``_<command>`` into ``<name>.zsh-functions``, which is
+        added to ``fpath`` for a ``compinit`` run later in the profile; when
+        ``compinit`` has already run, the function is registered directly.
+        Any other script is sourced.
+        """
+        with open(script, errors="replace") as f:
+            first = f.readline().split()
+        if first[:1] != ["#compdef"]:
+            return [f"source {shlex.quote(str(script))}"]
+        commands = [command for command in first[1:] if not command.startswith("-")]
+        function = script.name if script.name.startswith("_") else f"_{commands[0] if commands else name}"
+        functions_dir = self.path / f"{name}.zsh-functions"
+        functions_dir.mkdir(parents=True, exist_ok=True)
+        (functions_dir / function).symlink_to(script)
+        lines = [f"fpath=({shlex.quote(str(functions_dir))} $fpath)"]
+        if commands and len(commands) == len(first) - 1:
+            lines.append(f"if (( $+functions[compdef] )); then autoload -Uz {function}; "
+                         f"compdef {function} {' '.join(shlex.quote(command) for command in commands)}; fi")
+        return lines
+
+    @staticmethod
+    def _link_man_page(name: str, page: pathlib.Path) -> None:
+        match = _MAN_PAGE.search(page.name)
+        if match is None or not page.is_file():
+            _warn(name, f"man page {page.name} not found" if match else f"{page.name} is not a man page")
+            return
+        section_dir = DotFiles.get_man_dir() / f"man{match.group(1)}"
+        section_dir.mkdir(parents=True, exist_ok=True)
+        link = section_dir / page.name
+        link.unlink(missing_ok=True)
+        link.symlink_to(page)
+
+
+def _warn(name: str, message: str) -> None:
+    print(f"Package `{name}`: {message}", file=sys.stderr)
@@ -0,0 +1,190 @@
+import dataclasses
+import hashlib
+import os
+import pathlib
+import re
+import tempfile
+import time
+
+from dotfiles.path import DotFiles
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+URL_PREFIX = "url-"
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text: str) -> int:
+    """Parse a human-readable size such as ``512M`` or ``2G`` into bytes.
+
+    Raises:
+        ValueError: If the text is not a valid size
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([KMGT]?)i?B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def format_size(size: int) -> str:
+    """Format a byte count for humans, e.g. ``12.3 MiB``."""
+    value = float(size)
+    for unit in ("KiB", "MiB", "GiB"):
+        value /= 1024
+        if value < 1024:
+            break
+    return f"{size} B" if size < 1024 else f"{value:.1f} {unit}"
+
+
+def file_sha256(path: pathlib.Path) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    """An archive stored in the cache."""
+    sha256: str
+    path: pathlib.Path
+    size: int
+    last_used: float
+
+
+class ArchiveCache:
+    """Content-addressed cache of downloaded package archives.
+
+    Archives are stored as ``<sha256><ext>``, so an entry is verified on every
+    read by hashing it against its own name. Packages without a ``sha256`` in
+    their manifest are looked up through a ``url-<sha256(url)>`` symlink that
+    points at the content-addressed file. The modification time of an archive
+    records its last use, and :meth:`prune` evicts the least recently used
+    archives until the cache fits into its size limit.
+
+    The size limit defaults to 1 GiB and may be changed with the
+    ``DOTFILES_CACHE_SIZE`` environment variable (for example ``512M``).
+    """
+
+    def __init__(self, path: pathlib.Path | None = None, max_size: int | None = None):
+        self.path = DotFiles.get_cache_dir() if path is None else path
+        if max_size is None:
+            env = os.environ.get("DOTFILES_CACHE_SIZE")
+            max_size = parse_size(env) if env else DEFAULT_MAX_SIZE
+        self.max_size = max_size
+
+    def lookup(self, url: str, sha256: str | None) -> pathlib.Path | None:
+        """Find a verified archive for the given URL or checksum.
+
+        A corrupted entry is removed and reported as a miss. The entry the URL
+        points to is a miss but stays cached if its digest is not ``sha256``:
+        it is still valid for the other versions and manifests that use it.
+
+        Returns:
+            Path to the cached archive, or None if it is not cached
+        """
+        path = self._find(url, sha256)
+        if path is None:
+            return None
+        digest = path.name.split(".", 1)[0]
+        if sha256 and digest != sha256:
+            return None
+        if file_sha256(path) != digest:
+            path.unlink(missing_ok=True)
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return path
+
+    def store(self, file: pathlib.Path, url: str, sha256: str, ext: str) -> pathlib.Path:
+        """Move a verified archive into the cache.
+
+        Args:
+            file: Archive to move, preferably located inside the cache directory
+            url: URL the archive was downloaded from
+            sha256: SHA-256 digest of the archive
+            ext: File extension of the archive, including dot(s)
+
+        Returns:
+            Path to the cached archive
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self.path / f"{sha256}{ext}"
+        os.replace(file, target)
+        link = self._url_link(url)
+        tmp_link = self.path / f".{link.name}.{os.getpid()}.tmp"
+        tmp_link.unlink(missing_ok=True)
+        tmp_link.symlink_to(target.name)
+        os.replace(tmp_link, link)
+        return target
+
+    def part_file(self, url: str) -> pathlib.Path:
+        """Return the stable path of the partial download of ``url``, so that it can be resumed."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        return self.path / f".{self._url_link(url).name}.part"
+
+    def temp_file(self, suffix: str = ".part") -> tuple[int, pathlib.Path]:
+        """Create a temporary file inside the cache so :meth:`store` is a plain rename."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(prefix=".", suffix=suffix, dir=self.path)
+        return fd, pathlib.Path(name)
+
+    def entries(self) -> list[CacheEntry]:
+        """Return the cached archives, least recently used first."""
+        result = []
+        if not self.path.is_dir():
+            return result
+        for item in self.path.iterdir():
+            if item.name.startswith((".", URL_PREFIX)) or item.is_symlink() or not item.is_file():
+                continue
+            stat = item.stat()
+            result.append(CacheEntry(
+                sha256=item.name.split(".", 1)[0], path=item, size=stat.st_size, last_used=stat.st_mtime))
+        result.sort(key=lambda entry: entry.last_used)
+        return result
+
+    def prune(self, max_size: int | None = None) -> list[CacheEntry]:
+        """Evict least recently used archives until the cache fits into ``max_size`` bytes.
+
+        Returns:
+            The evicted entries
+        """
+        limit = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= limit:
+                break
+            entry.path.unlink(missing_ok=True)
+            total -= entry.size
+            removed.append(entry)
+        self._remove_dangling_links()
+        return removed
+
+    def clear(self) -> list[CacheEntry]:
+        """Remove every cached archive and partial download."""
+        if self.path.is_dir():
+            for item in self.path.glob(".*.part*"):
+                item.unlink(missing_ok=True)
+        return self.prune(0)
+
+    def _find(self, url: str, sha256: str | None) -> pathlib.Path | None:
+        if sha256:
+            for entry in self.path.glob(f"{sha256}.*"):
+                return entry
+        link = self._url_link(url)
+        if link.is_symlink() and link.exists():
+            return link.resolve()
+        return None
+
+    def _url_link(self, url: str) -> pathlib.Path:
+        return self.path / (URL_PREFIX + hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def _remove_dangling_links(self) -> None:
+        if not self.path.is_dir():
+            return
+        for item in self.path.glob(URL_PREFIX + "*"):
+            if item.is_symlink() and not item.exists():
+                item.unlink(missing_ok=True)
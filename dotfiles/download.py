@@ -0,0 +1,195 @@
+import concurrent.futures
+import http.client
+import json
+import os
+import pathlib
+import re
+import time
+import urllib.error
+
+from dotfiles import trace
+from dotfiles.transport import Transport, get_transport
+
+DEFAULT_SEGMENTS = 4
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT = 30
+CHUNK_SIZE = 256 * 1024
+
+_RETRYABLE = (ConnectionError, TimeoutError, http.client.HTTPException, urllib.error.URLError)
+
+
+class ResourceChangedError(Exception):
+    """The remote file changed while a partial download was being resumed."""
+
+
+def meta_path(part: pathlib.Path) -> pathlib.Path:
+    """Return the path of the file holding the resume state of ``part``."""
+    return part.with_name(part.name + ".json")
+
+
+def _validator(response) -> str | None:
+    """Return the value to send in ``If-Range``: a strong ETag, or else Last-Modified."""
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _content_range_start(response) -> int | None:
+    match = re.match(r"bytes\s+(\d+)-", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+class Downloader:
+    """Resumable HTTP downloader with parallel byte-range segments.
+
+    A download is written to a ``.part`` file whose resume state (URL, the
+    ``If-Range`` validator and the progress of each segment) is kept next to
+    it in ``<part>.json``. Interrupted transfers are retried and continued
+    with ``Range``/``If-Range`` requests, both within one call and across
+    invocations. If the server advertises ``Accept-Ranges: bytes`` and a
+    large enough ``Content-Length``, the file is split into up to
+    ``segments`` byte ranges fetched concurrently and written in place.
+
+    The number of segments defaults to the ``DOTFILES_SEGMENTS`` environment
+    variable, or 4. Requests go through ``transport``, by default the one
+    shared by the whole process, so segments and consecutive downloads from
+    the same host reuse its pooled connections.
+    """
+
+    def __init__(self, transport: Transport | None = None, segments: int | None = None,
+                 retries: int = DEFAULT_RETRIES, timeout: float = DEFAULT_TIMEOUT):
+        self.transport = transport or get_transport()
+        if segments is None:
+            segments = int(os.environ.get("DOTFILES_SEGMENTS", DEFAULT_SEGMENTS))
+        self.segments = max(1, segments)
+        self.retries = retries
+        self.timeout = timeout
+
+    def download(self, url: str, part: pathlib.Path) -> None:
+        """Download ``url`` into ``part``, resuming a previous partial download if possible.
+
+        On success the resume state is removed and ``part`` holds the complete
+        file. On failure both are kept so that the next call can resume.
+
+        Raises:
+            urllib.error.URLError: If the download still fails after all retries
+        """
+        with trace.span("download", url=url) as span:
+            meta = self._load_meta(url, part)
+            resumed_from = part.stat().st_size if part.exists() else 0
+            attempt = 0
+            while True:
+                try:
+                    if meta.get("segments"):
+                        self._fetch_segments(meta, part)
+                    else:
+                        self._fetch(meta, part)
+                    break
+                except urllib.error.HTTPError:
+                    raise
+                except (ResourceChangedError, *_RETRYABLE) as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    if isinstance(e, ResourceChangedError):
+                        meta = {"url": url}
+                        part.unlink(missing_ok=True)
+                    else:
+                        time.sleep(min(2 ** (attempt - 1) * 0.5, 8))
+                finally:
+                    meta_path(part).write_text(json.dumps(meta))
+            meta_path(part).unlink(missing_ok=True)
+            span.set(segments=len(meta.get("segments") or ()) or 1, retries=attempt)
+            span.add("downloaded_bytes", part.stat().st_size - resumed_from)
+
+    @staticmethod
+    def discard(part: pathlib.Path) -> None:
+        """Remove a partial download together with its resume state."""
+        part.unlink(missing_ok=True)
+        meta_path(part).unlink(missing_ok=True)
+
+    def _load_meta(self, url: str, part: pathlib.Path) -> dict:
+        try:
+            meta = json.loads(meta_path(part).read_text())
+        except (OSError, ValueError):
+            meta = None
+        if not isinstance(meta, dict) or meta.get("url") != url or not meta.get("validator") or not part.exists():
+            part.unlink(missing_ok=True)
+            return {"url": url}
+        return meta
+
+    def _open(self, url: str, headers: dict[str, str]):
+        return self.transport.open(url, headers, timeout=self.timeout)
+
+    def _fetch(self, meta: dict, part: pathlib.Path) -> None:
+        """Download with a single stream, continuing from the end of ``part``."""
+        offset = part.stat().st_size if part.exists() else 0
+        if offset and offset == meta.get("length"):
+            return
+        headers = {}
+        if offset:
+            headers = {"Range": f"bytes={offset}-", "If-Range": meta["validator"]}
+        with self._open(meta.get("final_url", meta["url"]), headers) as response:
+            if response.status == 206 and _content_range_start(response) != offset:
+                raise ResourceChangedError(meta["url"])
+            if response.status != 206:
+                offset = 0
+                length = response.headers.get("Content-Length")
+                meta.update(final_url=response.geturl(), validator=_validator(response),
+                            length=int(length) if length else None)
+                count = min(self.segments, (meta["length"] or 0) // MIN_SEGMENT_SIZE)
+                if count > 1 and meta["validator"] and response.headers.get("Accept-Ranges") == "bytes":
+                    size = -(-meta["length"] // count)
+                    meta["segments"] = [[start, min(start + size, meta["length"]), start]
+                                        for start in range(0, meta["length"], size)]
+                    with open(part, "wb") as f:
+                        f.truncate(meta["length"])
+                    self._fetch_segments(meta, part, response)
+                    return
+
+            with open(part, "ab" if offset else "wb") as f:
+                for data in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(data)
+        if meta.get("length") is not None and part.stat().st_size != meta["length"]:
+            raise ConnectionError(f"Connection closed before the end of {meta['url']}")
+
+    def _fetch_segments(self, meta: dict, part: pathlib.Path, response=None) -> None:
+        """Fetch every unfinished segment concurrently, the first one optionally from ``response``."""
+        pending = [segment for segment in meta["segments"] if segment[2] < segment[1]]
+        fd = os.open(part, os.O_WRONLY)
+        try:
+            fetch_range = trace.wrap(self._fetch_range)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+                futures = [
+                    executor.submit(fetch_range, meta, segment, fd,
+                                    response if segment[0] == 0 and segment[2] == 0 else None)
+                    for segment in pending
+                ]
+                for future in futures:
+                    future.exception()
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+
+    def _fetch_range(self, meta: dict, segment: list[int], fd: int, response=None) -> None:
+        """Fetch ``segment`` (``[start, end, position]``) and write it at its offset in ``fd``."""
+        if response is None:
+            headers = {"Range": f"bytes={segment[2]}-{segment[1] - 1}", "If-Range": meta["validator"]}
+            with self._open(meta["final_url"], headers) as ranged:
+                if ranged.status != 206 or _content_range_start(ranged) != segment[2]:
+                    raise ResourceChangedError(meta["url"])
+                self._copy_range(ranged, segment, fd)
+        else:
+            self._copy_range(response, segment, fd)
+
+    @staticmethod
+    def _copy_range(response, segment: list[int], fd: int) -> None:
+        while segment[2] < segment[1]:
+            data = response.read(min(CHUNK_SIZE, segment[1] - segment[2]))
+            if not data:
+                raise ConnectionError("Connection closed before the end of the requested range")
+            os.pwrite(fd, data, segment[2])
+            segment[2] += len(data)
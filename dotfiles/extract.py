@@ -0,0 +1,252 @@
+import concurrent.futures
+import os
+import pathlib
+import shutil
+import tarfile
+import threading
+import zipfile
+from collections.abc import Callable
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Decoded member data waiting for a writer is capped, so a fast decoder cannot buffer a whole archive
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+# Members larger than this are written by the decoding thread, streaming, instead of buffered for a writer
+LARGE_MEMBER_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def _default_workers() -> int:
+    return max(1, int(os.environ.get("DOTFILES_EXTRACT_JOBS", DEFAULT_WORKERS)))
+
+
+def extract_archive(file: str, out: pathlib.Path, select: Callable[[str], bool] | None = None,
+                    workers: int | None = None) -> None:
+    """Extract a ``.tar.gz``, ``.tar.xz`` or ``.zip`` archive into an existing directory.
+
+    Args:
+        file: Path to the archive
+        out: Output directory path
+        select: Predicate on member names; unselected members are skipped without being written
+        workers: Number of writer threads, ``$DOTFILES_EXTRACT_JOBS`` or the CPU count (at most 8) by default
+    """
+    if file.endswith(('.tar.gz', '.tgz')):
+        with tarfile.open(file, 'r|gz') as tar:
+            extract_tar(tar, out, select, workers)
+    elif file.endswith(('.tar.xz', '.txz')):
+        with tarfile.open(file, 'r|xz') as tar:
+            extract_tar(tar, out, select, workers)
+    elif file.endswith('.zip'):
+        extract_zip(file, out, select, workers)
+
+
+def extract_tar(tar: tarfile.TarFile, out: pathlib.Path, select: Callable[[str], bool] | None = None,
+                workers: int | None = None) -> None:
+    """Extract a tar archive, decoding on this thread while a pool of threads writes the files.
+
+    Members are read in archive order, so ``tar`` may be a stream (mode
+    ``r|*``). Every member goes through :func:`tarfile.data_filter`, which
+    rejects absolute paths, paths escaping ``out``, links pointing outside of
+    it and device files, and the result is the same tree as
+    ``tar.extractall(out, filter="data")``: file contents, modes and
+    modification times, symlinks and hard links. Links are created in archive
+    order once every earlier file has been written, and directory attributes
+    are applied last, deepest first.
+
+    Raises:
+        tarfile.FilterError: If a member is unsafe
+    """
+    workers = _default_workers() if workers is None else workers
+    members = tar if select is None else (member for member in tar if select(member.name))
+    if workers <= 1:
+        tar.extractall(out, members=members, filter="data")
+        return
+    with _TarWriter(str(out), workers) as writer:
+        for member in members:
+            writer.extract(tar, member)
+
+
+class _TarWriter:
+    """Applies filtered tar members to the output directory, handing file writes to a thread pool."""
+
+    def __init__(self, out: str, workers: int):
+        self.out = out
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                              thread_name_prefix="extract")
+        self.pending: dict[str, concurrent.futures.Future] = {}
+        self.directories: list[tuple[str, tarfile.TarInfo]] = []
+        self.created: set[str] = {out}
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.error: BaseException | None = None
+
+    def extract(self, tar: tarfile.TarFile, member: tarfile.TarInfo) -> None:
+        self._check()
+        info = tarfile.data_filter(member, self.out)
+        if info is None:
+            return
+        target = os.path.join(self.out, info.name).rstrip("/")
+        if info.isdir():
+            self._makedirs(target)
+            self.directories.append((target, info))
+            return
+        self._makedirs(os.path.dirname(target))
+        if info.issym() or info.islnk():
+            # Links may point at files still being written, and later members may be written through them
+            self._drain()
+            self._make_link(info, target)
+            return
+        self._wait_for(target)
+        source = tar.extractfile(member)
+        if info.size > LARGE_MEMBER_SIZE:
+            with open(target, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            _set_attributes(target, info)
+            return
+        data = source.read()
+        self._reserve(len(data))
+        future = self.executor.submit(_write_file, target, data, info)
+        future.add_done_callback(lambda f, size=len(data): self._release(f, size))
+        self.pending[target] = future
+
+    def close(self) -> None:
+        self._drain()
+        self.executor.shutdown()
+        self._check()
+        self.directories.sort(key=lambda item: item[1].name, reverse=True)
+        for target, info in self.directories:
+            _set_attributes(target, info)
+
+    def __enter__(self) -> "_TarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
+
+    def _makedirs(self, path: str) -> None:
+        if path not in self.created:
+            os.makedirs(path, exist_ok=True)
+            self.created.add(path)
+
+    def _make_link(self, info: tarfile.TarInfo, target: str) -> None:
+        if os.path.lexists(target):
+            os.unlink(target)
+        if info.issym():
+            os.symlink(info.linkname, target)
+        else:
+            source = os.path.join(self.out, info.linkname)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+        _set_attributes(target, info)
+
+    def _wait_for(self, target: str) -> None:
+        """Wait for an earlier member with the same path, which this one replaces."""
+        future = self.pending.pop(target, None)
+        if future is not None:
+            future.result()
+
+    def _drain(self) -> None:
+        for future in self.pending.values():
+            future.result()
+        self.pending.clear()
+
+    def _reserve(self, size: int) -> None:
+        with self.condition:
+            while self.inflight and self.inflight + size > MAX_PENDING_BYTES and self.error is None:
+                self.condition.wait()
+            self.inflight += size
+        self._check()
+
+    def _release(self, future: concurrent.futures.Future, size: int) -> None:
+        with self.condition:
+            self.inflight -= size
+            if self.error is None and not future.cancelled() and future.exception() is not None:
+                self.error = future.exception()
+            self.condition.notify_all()
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+
+def _write_file(target: str, data: bytes, info: tarfile.TarInfo) -> None:
+    with open(target, "wb") as f:
+        f.write(data)
+    _set_attributes(target, info)
+
+
+def _set_attributes(target: str, info: tarfile.TarInfo) -> None:
+    """Set the mode and modification time of an extracted member like ``TarFile.extractall``.
+
+    As there, symlinks are left alone and failures are not fatal.
+    """
+    if info.issym():
+        return
+    if info.mode is not None:
+        try:
+            os.chmod(target, info.mode)
+        except OSError:
+            pass
+    if info.mtime is not None:
+        try:
+            os.utime(target, (info.mtime, info.mtime))
+        except OSError:
+            pass
+
+
+def extract_zip(file: str, out: pathlib.Path, select: Callable[[str], bool] | None = None,
+                workers: int | None = None) -> None:
+    """Extract a zip archive, decompressing its members concurrently.
+
+    Each member is extracted with :meth:`zipfile.ZipFile.extract`, so paths
+    are sanitized exactly as by ``extractall``. Every worker thread opens
+    its own :class:`zipfile.ZipFile`, and the directories are created
+    beforehand so that workers never race to create the same one.
+    """
+    workers = _default_workers() if workers is None else workers
+    with zipfile.ZipFile(file) as zip_file:
+        members = [info for info in zip_file.infolist() if select is None or select(info.filename)]
+        if workers <= 1 or len(members) < 2:
+            zip_file.extractall(out, members=members)
+            return
+        directories = set()
+        for info in members:
+            target = _zip_target(out, info.filename)
+            directories.add(target if info.is_dir() else os.path.dirname(target))
+        for directory in sorted(directories):
+            os.makedirs(directory, exist_ok=True)
+
+    local = threading.local()
+    archives: list[zipfile.ZipFile] = []
+    lock = threading.Lock()
+
+    def extract_member(info: zipfile.ZipInfo) -> None:
+        archive = getattr(local, "archive", None)
+        if archive is None:
+            archive = local.archive = zipfile.ZipFile(file)
+            with lock:
+                archives.append(archive)
+        archive.extract(info, out)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+            for future in [executor.submit(extract_member, info) for info in members if not info.is_dir()]:
+                future.result()
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def _zip_target(out: pathlib.Path, name: str) -> str:
+    """Return the path ``ZipFile.extract`` writes member ``name`` to."""
+    arcname = name.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    return os.path.normpath(os.path.join(out, arcname))
@@ -0,0 +1,129 @@
+import json
+import os
+import pathlib
+import sys
+
+from dotfiles import trace
+from dotfiles.manifest import ManifestError, PackageInfo, PackageRecord
+from dotfiles.path import DotFiles
+from dotfiles.search import SearchEngine, build_search_data
+
+# Bump whenever the layout of compiled records changes, to force a full rebuild.
+INDEX_VERSION = 5
+
+
+def _compile_manifest(path: pathlib.Path) -> dict:
+    """Validate a package manifest into the data cached by the index: the manifest, or the reason it is invalid."""
+    try:
+        package = PackageInfo.load(path)
+    except (OSError, ManifestError) as e:
+        return {"error": str(e)}
+    return {"manifest": package.to_manifest(update=False)}
+
+
+def _build_packages(manifests: dict[str, dict]) -> dict[str, PackageInfo]:
+    # Cached manifests were validated when they were compiled
+    return {
+        name: PackageInfo.from_manifest(name, manifests[name]["manifest"], validate=False)
+        for name in sorted(manifests)
+        if "manifest" in manifests[name]
+    }
+
+
+class PackageIndex:
+    """Compiled index of the package manifests.
+
+    The index maps every manifest to its validated data, or to the error that
+    made it invalid, together with the manifest's mtime and size, plus the
+    prebuilt search structures of :mod:`dotfiles.search`. Loading it costs a
+    single read plus one ``stat`` per manifest; only manifests whose mtime or
+    size changed are parsed and validated again, and the index file is
+    rewritten only when something changed. Invalid manifests are skipped with
+    a warning. The ``update`` blocks, which only the updater reads, are left
+    out of the index.
+    """
+
+    def __init__(self, package_dir: pathlib.Path | None = None, index_file: pathlib.Path | None = None):
+        self.package_dir = DotFiles.get_package_dir() if package_dir is None else package_dir
+        self.index_file = DotFiles.get_index_file() if index_file is None else index_file
+        self._search_data: dict | None = None
+        self._warned = False
+
+    def load(self, arch: str) -> dict[str, PackageRecord]:
+        """Return the records available for ``arch``, keyed and sorted by package name."""
+        records = {}
+        for name, compiled in sorted(self._refresh().items()):
+            manifest = compiled.get("manifest")
+            if manifest is not None and arch in manifest["architecture"]:
+                # Cached manifests were validated when they were compiled
+                records[name] = PackageRecord.from_manifest(name, manifest, arch)
+        return records
+
+    def load_all(self) -> dict[str, dict[str, PackageRecord]]:
+        """Return the records of every architecture, keyed by package name and then by architecture."""
+        return {name: package.records() for name, package in self.packages().items()}
+
+    def packages(self) -> dict[str, PackageInfo]:
+        """Return the valid package manifests, without their ``update`` block, keyed and sorted by package name."""
+        return _build_packages(self._refresh())
+
+    def search_engine(self, records: dict[str, PackageRecord]) -> SearchEngine:
+        """Return a search engine over ``records``, as returned by :meth:`load`."""
+        if self._search_data is None:
+            self._refresh()
+        return SearchEngine(self._search_data, records)
+
+    def _refresh(self) -> dict[str, dict]:
+        with trace.span("index") as span:
+            data = self._read()
+            cached = data.get("manifests", {})
+            manifests = {}
+            changed = False
+            with os.scandir(self.package_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json") or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    name = entry.name[:-len(".json")]
+                    compiled = cached.get(name)
+                    if compiled is None or compiled["mtime_ns"] != st.st_mtime_ns or compiled["size"] != st.st_size:
+                        compiled = {
+                            "mtime_ns": st.st_mtime_ns,
+                            "size": st.st_size,
+                            **_compile_manifest(pathlib.Path(entry.path)),
+                        }
+                        changed = True
+                        span.add("parsed_manifests", 1)
+                    manifests[name] = compiled
+                    if "error" in compiled and not self._warned:
+                        print(compiled["error"], file=sys.stderr)
+            self._warned = True
+            # A missing or outdated index file has no search data, even when there is no manifest to compile
+            if changed or manifests.keys() != cached.keys() or "search" not in data:
+                data = {
+                    "version": INDEX_VERSION,
+                    "manifests": manifests,
+                    "search": build_search_data(_build_packages(manifests)),
+                }
+                self._write(data)
+            self._search_data = data["search"]
+            return manifests
+
+    def _read(self) -> dict:
+        try:
+            data = json.loads(self.index_file.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return {}
+        return data
+
+    def _write(self, data: dict) -> None:
+        temp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file.write_text(json.dumps(data))
+            os.replace(temp_file, self.index_file)
+        except OSError:
+            # The index is only an accelerator, so a read-only tree still works.
+            temp_file.unlink(missing_ok=True)
@@ -0,0 +1,67 @@
+import fcntl
+import os
+import pathlib
+import sys
+
+from dotfiles import trace
+
+
+class FileLock:
+    """Exclusive advisory lock backed by ``flock(2)``.
+
+    Used to serialize every operation that modifies the ``apps`` and ``bin``
+    directories, so that concurrent ``dotfiles`` invocations cannot interleave
+    their extraction and symlink updates.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._fd: int | None = None
+
+    def acquire(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with trace.span("lock") as span:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    span.set(waited=True)
+                    print(f"Waiting for another dotfiles process to release {self.path}", file=sys.stderr)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def try_acquire(self) -> bool:
+        """Acquire the lock if no other process holds it, without waiting.
+
+        Returns:
+            True if the lock was acquired
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
@@ -0,0 +1,42 @@
+import json
+import os
+import pathlib
+
+LOCKFILE_VERSION = 1
+DEFAULT_LOCKFILE = "dotfiles-lock.json"
+
+
+def read_lockfile(path: pathlib.Path) -> dict[str, dict]:
+    """Read a lockfile written by :func:`write_lockfile`.
+
+    Returns:
+        The locked packages keyed by name, each with its ``version`` and the
+        ``url`` and ``sha256`` of its archive per ``architecture``
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If the file is not a valid lockfile
+    """
+    try:
+        data = json.loads(path.read_bytes())
+    except ValueError as e:
+        raise ValueError(f"Invalid lockfile {path}: {e}") from e
+    if not isinstance(data, dict) or data.get("version") != LOCKFILE_VERSION \
+            or not isinstance(data.get("packages"), dict):
+        raise ValueError(f"Invalid lockfile {path}: expected version {LOCKFILE_VERSION} with a packages map")
+    for name, entry in data["packages"].items():
+        architecture = entry.get("architecture") if isinstance(entry, dict) else None
+        if not isinstance(entry.get("version") if isinstance(entry, dict) else None, str) \
+                or not isinstance(architecture, dict) \
+                or not all(isinstance(info, dict) and isinstance(info.get("url"), str)
+                           for info in architecture.values()):
+            raise ValueError(f"Invalid lockfile {path}: bad entry for package `{name}`")
+    return data["packages"]
+
+
+def write_lockfile(path: pathlib.Path, packages: dict[str, dict]) -> None:
+    """Atomically write the locked ``packages``, in the format returned by :func:`read_lockfile`."""
+    temp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_file.write_text(json.dumps({"version": LOCKFILE_VERSION, "packages": packages}, indent=2, sort_keys=True)
+                         + "\n")
+    os.replace(temp_file, path)
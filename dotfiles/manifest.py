@@ -0,0 +1,342 @@
+import dataclasses
+import json
+import pathlib
+import re
+import sys
+import types
+from collections.abc import Mapping
+
+COMPLETION_SHELLS = ("bash", "zsh")
+CHECK_MODES = ("body", "redirect")
+CHECKSUM_FORMATS = ("sha256sum", "hex", "github-release")
+_SHA256 = re.compile(r"[0-9a-fA-F]{64}")
+_VARIABLE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_EMPTY: Mapping = types.MappingProxyType({})
+
+
+class ManifestError(ValueError):
+    """A package manifest does not follow the schema of :class:`PackageInfo`."""
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Archive:
+    """The archive of a package for one architecture."""
+    url: str
+    sha256: str | None = None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class UpdateCheck:
+    """Where the updater looks for the latest version: ``regex`` captures it from ``url``."""
+    url: str
+    regex: str
+    mode: str = "body"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Checksum:
+    """A checksum file published upstream, whose ``url`` is a template."""
+    url: str
+    format: str = "sha256sum"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class UpdateInfo:
+    """The ``update`` block of a manifest, read by ``ci_check_update``."""
+    check: UpdateCheck
+    # URL templates accepting ``{version}``, keyed by architecture
+    architecture: Mapping[str, str]
+    checksum: Checksum | None = None
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class PackageInfo:
+    """A package manifest, ``dotfiles/package/<name>.json``, validated once when it is loaded.
+
+    Instances are immutable: mappings are read-only views and lists are
+    tuples, so one instance can be shared by every architecture's
+    :class:`PackageRecord` and by the threads of an install.
+    """
+    name: str
+    version: str
+    architecture: Mapping[str, Archive]
+    # Names of the links in the bin directory, keyed by the path they point to in the package
+    bin: Mapping[str, str]
+    description: str | None = None
+    # "all", "bin", or a mapping with "include" and "exclude" tuples of patterns
+    extract: str | Mapping[str, tuple[str, ...]] | None = None
+    env: Mapping[str, str] = dataclasses.field(default_factory=lambda: _EMPTY)
+    # Path of a completion script, or a command printing one, keyed by shell
+    completions: Mapping[str, str | tuple[str, ...]] = dataclasses.field(default_factory=lambda: _EMPTY)
+    man: tuple[str, ...] = ()
+    update: UpdateInfo | None = None
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "PackageInfo":
+        """Read and validate the manifest at ``path``; the package is named after the file.
+
+        Raises:
+            OSError: If the file cannot be read
+            ManifestError: If the file is not a valid manifest
+        """
+        try:
+            data = json.loads(path.read_bytes())
+        except ValueError as e:
+            raise ManifestError(f"Invalid package manifest {path}: {e}") from e
+        return cls.from_manifest(path.stem, data)
+
+    @classmethod
+    def from_manifest(cls, name: str, data: object, validate: bool = True) -> "PackageInfo":
+        """Build a package from the parsed JSON of its manifest.
+
+        Args:
+            validate: Check ``data`` against the schema first; only data that
+                was validated before, e.g. by the package index, may skip it
+
+        Raises:
+            ManifestError: If ``data`` is not a valid manifest, naming the offending key
+        """
+        if validate:
+            try:
+                _validate(data)
+            except ManifestError as e:
+                raise ManifestError(f"Invalid package manifest `{name}`: {e}") from None
+        update = data.get("update")
+        if update is not None:
+            checksum = update.get("checksum")
+            update = UpdateInfo(
+                check=UpdateCheck(**update["check"]),
+                architecture=types.MappingProxyType({arch: info["url"]
+                                                     for arch, info in update["architecture"].items()}),
+                checksum=Checksum(**checksum) if checksum is not None else None,
+            )
+        architecture = {sys.intern(arch): Archive(info["url"], info.get("sha256") or None)
+                        for arch, info in data["architecture"].items()}
+        if validate:
+            # Hashes are compared with hexdigest(); data that skips validation was normalized before
+            architecture = {arch: dataclasses.replace(archive, sha256=archive.sha256.lower())
+                            if archive.sha256 else archive for arch, archive in architecture.items()}
+        return cls(
+            name=name,
+            version=data["version"],
+            architecture=types.MappingProxyType(architecture),
+            # Validated data may belong to the caller, who could change it later
+            bin=types.MappingProxyType(dict(data["bin"]) if validate else data["bin"]),
+            description=data.get("description"),
+            extract=_freeze_extract(data.get("extract")),
+            env=types.MappingProxyType(dict(data["env"]) if validate else data["env"]) if data.get("env") else _EMPTY,
+            completions=_freeze_completions(data.get("completions")),
+            man=tuple(data.get("man") or ()),
+            update=update,
+        )
+
+    def to_manifest(self, update: bool = True) -> dict:
+        """Return the JSON data of the manifest, as accepted by :meth:`from_manifest`.
+
+        Args:
+            update: Include the ``update`` block, which only the updater reads
+        """
+        data: dict = {
+            "version": self.version,
+            "architecture": {arch: {"url": archive.url, "sha256": archive.sha256}
+                             for arch, archive in self.architecture.items()},
+            "bin": dict(self.bin),
+        }
+        if self.description is not None:
+            data["description"] = self.description
+        if self.extract is not None:
+            data["extract"] = self.extract if isinstance(self.extract, str) \
+                else {key: list(patterns) for key, patterns in self.extract.items()}
+        if self.env:
+            data["env"] = dict(self.env)
+        if self.completions:
+            data["completions"] = {shell: completion if isinstance(completion, str) else list(completion)
+                                   for shell, completion in self.completions.items()}
+        if self.man:
+            data["man"] = list(self.man)
+        if update and self.update is not None:
+            data["update"] = {
+                "check": {"url": self.update.check.url, "regex": self.update.check.regex,
+                          "mode": self.update.check.mode},
+                "architecture": {arch: {"url": url} for arch, url in self.update.architecture.items()},
+            }
+            if self.update.checksum is not None:
+                data["update"]["checksum"] = {"url": self.update.checksum.url, "format": self.update.checksum.format}
+        return data
+
+    def resolve(self, arch: str) -> "PackageRecord | None":
+        """Return the record installing this package on ``arch``, or None if it has no archive for it."""
+        archive = self.architecture.get(arch)
+        if archive is None:
+            return None
+        return PackageRecord(self.name, self.version, archive.url, archive.sha256, self.bin, self.description,
+                             self.extract, self.env, self.completions, self.man)
+
+    def records(self) -> dict[str, "PackageRecord"]:
+        """Return the records of every architecture, keyed by architecture."""
+        return {arch: self.resolve(arch) for arch in self.architecture}
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class PackageRecord:
+    """A package resolved for one architecture: the archive to install and how to install it.
+
+    Records share their values with the :class:`PackageInfo` they are
+    resolved from, which they do not keep, so the archives of the other
+    architectures are not kept in memory with them. The version and archive
+    may differ from the manifest's, e.g. when installing the version pinned
+    by a lockfile; see :func:`dataclasses.replace`.
+    """
+    name: str
+    version: str
+    url: str
+    sha256: str | None
+    bin: Mapping[str, str]
+    description: str | None
+    extract: str | Mapping[str, tuple[str, ...]] | None
+    env: Mapping[str, str]
+    completions: Mapping[str, str | tuple[str, ...]]
+    man: tuple[str, ...]
+
+    @classmethod
+    def from_manifest(cls, name: str, data: dict, arch: str) -> "PackageRecord":
+        """Resolve manifest data for ``arch`` without building its :class:`PackageInfo`.
+
+        ``data`` must have been validated before, as the package index does
+        when it compiles a manifest, and must list ``arch``.
+        """
+        archive = data["architecture"][arch]
+        return cls(name, data["version"], archive["url"], archive.get("sha256"), types.MappingProxyType(data["bin"]),
+                   data.get("description"), _freeze_extract(data.get("extract")),
+                   types.MappingProxyType(data["env"]) if data.get("env") else _EMPTY,
+                   _freeze_completions(data.get("completions")), tuple(data.get("man") or ()))
+
+
+def _freeze_extract(extract: str | dict | None) -> str | Mapping[str, tuple[str, ...]] | None:
+    if isinstance(extract, dict):
+        return types.MappingProxyType({key: tuple(patterns) for key, patterns in extract.items()})
+    return extract
+
+
+def _freeze_completions(completions: dict | None) -> Mapping[str, str | tuple[str, ...]]:
+    if not completions:
+        return _EMPTY
+    return types.MappingProxyType({shell: completion if isinstance(completion, str) else tuple(completion)
+                                   for shell, completion in completions.items()})
+
+
+def _validate(data: object) -> None:
+    """Check the parsed JSON of a manifest against the schema.
+
+    Raises:
+        ManifestError: Naming the first offending key, e.g. ``architecture.x86_64.url``
+    """
+    _check_object(data, "", required=("version", "architecture", "bin"),
+                  optional=("description", "extract", "env", "completions", "man", "update"))
+    _check_string(data["version"], "version")
+    if data.get("description") is not None:
+        _check_string(data["description"], "description", allow_empty=True)
+
+    _check_object(data["architecture"], "architecture", non_empty=True)
+    for arch, info in data["architecture"].items():
+        key = f"architecture.{arch}"
+        _check_object(info, key, required=("url",), optional=("sha256",))
+        _check_string(info["url"], f"{key}.url")
+        sha256 = info.get("sha256")
+        if sha256 is not None and not (isinstance(sha256, str) and _SHA256.fullmatch(sha256)):
+            raise ManifestError(f"{key}.sha256: expected 64 hexadecimal digits, got {sha256!r}")
+
+    _check_object(data["bin"], "bin", non_empty=True)
+    for path, link in data["bin"].items():
+        _check_string(link, f"bin.{path}")
+        if "/" in link or link in (".", ".."):
+            raise ManifestError(f"bin.{path}: expected a file name, got {link!r}")
+
+    extract = data.get("extract")
+    if isinstance(extract, dict):
+        _check_object(extract, "extract", optional=("include", "exclude"))
+        for key, patterns in extract.items():
+            _check_strings(patterns, f"extract.{key}")
+    elif extract is not None and extract not in ("all", "bin"):
+        raise ManifestError(f"extract: expected \"all\", \"bin\" or an include/exclude object, got {extract!r}")
+
+    if data.get("env") is not None:
+        _check_object(data["env"], "env")
+        for variable, value in data["env"].items():
+            if not _VARIABLE.fullmatch(variable):
+                raise ManifestError(f"env: invalid environment variable name {variable!r}")
+            _check_string(value, f"env.{variable}", allow_empty=True)
+
+    if data.get("completions") is not None:
+        _check_object(data["completions"], "completions", optional=COMPLETION_SHELLS)
+        for shell, completion in data["completions"].items():
+            if isinstance(completion, list):
+                _check_strings(completion, f"completions.{shell}", non_empty=True)
+            else:
+                _check_string(completion, f"completions.{shell}")
+
+    if data.get("man") is not None:
+        _check_strings(data["man"], "man")
+
+    if data.get("update") is not None:
+        update = data["update"]
+        _check_object(update, "update", required=("check", "architecture"), optional=("checksum",))
+        _check_object(update["check"], "update.check", required=("url", "regex"), optional=("mode",))
+        _check_string(update["check"]["url"], "update.check.url")
+        _check_string(update["check"]["regex"], "update.check.regex")
+        try:
+            groups = re.compile(update["check"]["regex"]).groups
+        except re.error as e:
+            raise ManifestError(f"update.check.regex: {e}") from None
+        if groups < 1:
+            raise ManifestError("update.check.regex: expected a capture group for the version")
+        if update["check"].get("mode", "body") not in CHECK_MODES:
+            raise ManifestError(f"update.check.mode: expected one of {', '.join(CHECK_MODES)}, "
+                                f"got {update['check']['mode']!r}")
+        _check_object(update["architecture"], "update.architecture", non_empty=True)
+        for arch, info in update["architecture"].items():
+            _check_object(info, f"update.architecture.{arch}", required=("url",))
+            _check_string(info["url"], f"update.architecture.{arch}.url")
+        if update.get("checksum") is not None:
+            checksum = update["checksum"]
+            _check_object(checksum, "update.checksum", required=("url",), optional=("format",))
+            _check_string(checksum["url"], "update.checksum.url")
+            if checksum.get("format", "sha256sum") not in CHECKSUM_FORMATS:
+                raise ManifestError(f"update.checksum.format: expected one of {', '.join(CHECKSUM_FORMATS)}, "
+                                    f"got {checksum['format']!r}")
+
+
+def _check_object(value: object, key: str, required: tuple[str, ...] = (), optional: tuple[str, ...] | None = None,
+                  non_empty: bool = False) -> None:
+    """Check that ``value`` is a JSON object with the ``required`` keys and, if ``optional`` is given, no others.
+
+    ``key`` is empty for the manifest itself.
+    """
+    where = f"{key}: " if key else ""
+    if not isinstance(value, dict):
+        raise ManifestError(f"{where}expected an object, got {type(value).__name__}")
+    if non_empty and not value:
+        raise ManifestError(f"{where}expected at least one entry")
+    for name in required:
+        if name not in value:
+            raise ManifestError(f"{where}missing key {name!r}")
+    if optional is not None:
+        for name in value:
+            if name not in required and name not in optional:
+                raise ManifestError(f"{where}unknown key {name!r}")
+
+
+def _check_string(value: object, key: str, allow_empty: bool = False) -> None:
+    if not isinstance(value, str):
+        raise ManifestError(f"{key}: expected a string, got {type(value).__name__}")
+    if not value and not allow_empty:
+        raise ManifestError(f"{key}: expected a non-empty string")
+
+
+def _check_strings(value: object, key: str, non_empty: bool = False) -> None:
+    if not isinstance(value, list):
+        raise ManifestError(f"{key}: expected a list of strings, got {type(value).__name__}")
+    if non_empty and not value:
+        raise ManifestError(f"{key}: expected at least one string")
+    for i, item in enumerate(value):
+        _check_string(item, f"{key}[{i}]")
@@ -0,0 +1,185 @@
+import io
+import json
+import os
+import pathlib
+import posixpath
+import shutil
+import tarfile
+import threading
+import time
+import urllib.parse
+from typing import TYPE_CHECKING
+
+from dotfiles import trace
+from dotfiles.lockfile import LOCKFILE_VERSION
+
+if TYPE_CHECKING:
+    from dotfiles.transport import Transport
+
+BUNDLE_INDEX = "index.json"
+DEFAULT_BUNDLE = "dotfiles-bundle.tar"
+CHUNK_SIZE = 1024 * 1024
+# Seconds an HTTP mirror has to answer before archives are taken from their upstream URLs
+PROBE_TIMEOUT = 3
+
+
+def mirror_path(url: str) -> str:
+    """Return the path of the archive published at ``url`` in a mirror or bundle: its host and URL path.
+
+    Raises:
+        ValueError: If the URL path escapes the host directory
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = posixpath.normpath(f"{parts.hostname}/{urllib.parse.unquote(parts.path).lstrip('/')}")
+    if path.startswith("../") or path.startswith("/"):
+        raise ValueError(f"Cannot mirror {url}")
+    return path
+
+
+class Mirror:
+    """A local copy of package archives, tried before the upstream URLs of the manifests.
+
+    ``location`` is an HTTP(S) base URL, a directory, or a bundle written by
+    ``dotfiles bundle``. Servers and directories lay the archives out like
+    bundles do, by :func:`mirror_path`, e.g.
+    ``<location>/github.com/junegunn/fzf/releases/download/v0.66.1/fzf-0.66.1-linux_amd64.tar.gz``,
+    so an extracted bundle is a mirror directory, and serving that
+    directory with ``python -m http.server`` makes it a mirror server.
+
+    The mirror only changes where the bytes come from: archives are verified
+    and cached under their upstream URL exactly as when downloaded from it.
+    A server is asked for each archive with a single ``HEAD`` request, without
+    retries, before it is downloaded, so a missing archive or an unreachable
+    server falls back to the upstream URL at once. A server that cannot be
+    reached is not asked again by this process.
+    """
+
+    def __init__(self, location: str):
+        self.location = location
+        self._bundle: tarfile.TarFile | None = None
+        self._lock = threading.Lock()
+        self._transport: "Transport | None" = None
+        self._unreachable = False
+
+    def fetch(self, url: str, part: pathlib.Path) -> bool:
+        """Copy the archive published at ``url`` from the mirror to the ``part`` file of the archive cache.
+
+        Returns:
+            False if the mirror does not have the archive or cannot be reached
+        """
+        from dotfiles.download import Downloader, ResourceChangedError
+
+        path = mirror_path(url)
+        with trace.span("mirror", path=path) as span:
+            if self.location.startswith(("http://", "https://")):
+                mirror_url = f"{self.location.rstrip('/')}/{urllib.parse.quote(path)}"
+                if not self._probe(mirror_url):
+                    span.set(found=False)
+                    return False
+                try:
+                    Downloader().download(mirror_url, part)
+                except (OSError, ResourceChangedError):
+                    Downloader.discard(part)
+                    span.set(found=False)
+                    return False
+            elif os.path.isdir(self.location):
+                source = pathlib.Path(self.location, path)
+                if not source.is_file():
+                    span.set(found=False)
+                    return False
+                shutil.copyfile(source, part)
+            else:
+                # Members are read from a single file object, so bundle reads are serialized
+                with self._lock:
+                    bundle = self._open_bundle()
+                    try:
+                        member = bundle.getmember(path)
+                    except KeyError:
+                        span.set(found=False)
+                        return False
+                    with bundle.extractfile(member) as source, open(part, "wb") as f:
+                        shutil.copyfileobj(source, f, CHUNK_SIZE)
+            span.set(found=True)
+            return True
+
+    def _probe(self, url: str) -> bool:
+        """Return True if the mirror server has the archive at ``url``, asking it once with a short timeout."""
+        import http.client
+        import urllib.error
+
+        from dotfiles.transport import Transport
+
+        if self._unreachable:
+            return False
+        with self._lock:
+            if self._transport is None:
+                self._transport = Transport(timeout=PROBE_TIMEOUT, retries=0)
+        try:
+            with self._transport.open(url, method="HEAD"):
+                return True
+        except (urllib.error.HTTPError, http.client.HTTPException):
+            return False
+        except OSError:
+            self._unreachable = True
+            return False
+
+    def _open_bundle(self) -> tarfile.TarFile:
+        if self._bundle is None:
+            self._bundle = tarfile.open(self.location, "r:")
+        return self._bundle
+
+
+def write_bundle(path: pathlib.Path, packages: dict[str, dict], archives: dict[str, pathlib.Path]) -> None:
+    """Write a bundle: an uncompressed tar of an index followed by the archives.
+
+    The index, ``index.json``, is a lockfile (see :mod:`dotfiles.lockfile`)
+    of the bundled ``packages`` whose architecture entries also give the
+    ``path`` of their archive in the bundle.
+
+    Args:
+        path: Bundle file to write
+        packages: Bundled packages, in the lockfile format
+        archives: Archive files keyed by their :func:`mirror_path`
+    """
+    temp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with tarfile.open(temp_file, "w", format=tarfile.PAX_FORMAT) as tar:
+            index = json.dumps({"version": LOCKFILE_VERSION, "packages": packages}, indent=2, sort_keys=True).encode()
+            info = tarfile.TarInfo(BUNDLE_INDEX)
+            info.size, info.mtime, info.mode = len(index), int(time.time()), 0o644
+            tar.addfile(info, io.BytesIO(index))
+            for member, archive in sorted(archives.items()):
+                tar.add(archive, arcname=member, recursive=False, filter=_anonymize)
+        os.replace(temp_file, path)
+    except BaseException:
+        temp_file.unlink(missing_ok=True)
+        raise
+
+
+def _anonymize(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    info.mode = 0o644
+    return info
+
+
+_UNSET = object()
+_default: "Mirror | None | object" = _UNSET
+_default_lock = threading.Lock()
+
+
+def set_mirror(location: str | None) -> None:
+    """Use the mirror at ``location`` for every download of this process, or none."""
+    global _default
+    with _default_lock:
+        _default = Mirror(location) if location else None
+
+
+def get_mirror() -> Mirror | None:
+    """Return the mirror set with :func:`set_mirror`, by default from ``$DOTFILES_MIRROR``."""
+    global _default
+    with _default_lock:
+        if _default is _UNSET:
+            location = os.environ.get("DOTFILES_MIRROR")
+            _default = Mirror(location) if location else None
+        return _default
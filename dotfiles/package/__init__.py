@@ -2,121 +2,369 @@ import os
 import shutil
 import sys
 import tempfile
-import urllib.request
-import zipfile
 import tarfile
-import lzma
 import pathlib
 import hashlib
-from dataclasses import dataclass
-
+import secrets
+import fnmatch
+from collections.abc import Callable, Iterable, Mapping
+
+from dotfiles import trace
+from dotfiles.cache import ArchiveCache, file_sha256
+from dotfiles.download import Downloader
+from dotfiles.extract import extract_archive, extract_tar
+from dotfiles.manifest import PackageInfo, PackageRecord  # noqa: F401
+from dotfiles.mirror import get_mirror
 from dotfiles.path import DotFiles
-
-
-@dataclass
-class PackageInfo:
+from dotfiles.store import FileStore
+from dotfiles.transport import get_transport
+from dotfiles.trash import Trash
+from dotfiles.verify import build_manifest, write_manifest
+
+
+class _HashingReader:
+    """File-like wrapper that hashes everything read from ``source`` and copies it to ``sink``."""
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        self.size += len(data)
+        self.sha256.update(data)
+        self.sink.write(data)
+        return data
+
+    def drain(self) -> None:
+        """Consume the rest of the stream, e.g. the padding after the end of a tar archive."""
+        while self.read(1024 * 1024):
+            pass
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def _make_staging_dir(out: pathlib.Path, name: str) -> pathlib.Path:
+    """Create a private staging directory below ``out``, on the same filesystem as the target."""
+    staging_root = out / ".staging"
+    staging_root.mkdir(parents=True, exist_ok=True)
+    staging = pathlib.Path(tempfile.mkdtemp(prefix=f"{name}-", dir=staging_root))
+    # mkdtemp() creates 0700 directories, but the staging directory may become the package directory
+    staging.chmod(0o755)
+    return staging
+
+
+def _read_link(path: pathlib.Path) -> str | None:
+    return os.readlink(path) if path.is_symlink() else None
+
+
+def _replace_symlink(link: pathlib.Path, target: str | os.PathLike) -> None:
+    """Point ``link`` at ``target`` atomically, by renaming a new symlink over it."""
+    temp_link = link.with_name(f".{link.name}.{os.getpid()}.tmp")
+    temp_link.unlink(missing_ok=True)
+    temp_link.symlink_to(target)
+    try:
+        os.replace(temp_link, link)
+    except BaseException:
+        temp_link.unlink(missing_ok=True)
+        raise
+
+
+def _member_filter(extract: str | Mapping[str, Iterable[str]] | None, symbol: Mapping[str, str],
+                   extra: Iterable[str] = ()) -> Callable[[str], bool] | None:
+    """Build the predicate selecting the archive members to extract.
+
+    ``extract`` comes from the package manifest and is one of:
+
+    - ``"all"``: extract everything;
+    - ``"bin"``: extract only the entries of the ``bin`` map and the ``extra``
+      paths, e.g. completion scripts and man pages;
+    - ``{"include": [...], "exclude": [...]}``: glob patterns, ``include``
+      defaulting to everything.
+
+    Patterns are matched against the member path both with and without its
+    top-level directory, like the paths in the ``bin`` map. When ``extract``
+    is missing, a package whose only binary sits at the archive root is a
+    single-binary tool and defaults to ``"bin"``; anything else defaults to
+    ``"all"``.
+
+    Returns:
+        The predicate, or None to extract everything
+
+    Raises:
+        ValueError: If ``extract`` is not a valid filter
     """
-    The name of this application.
-    """
-    name: str
+    if extract is None:
+        extract = "bin" if len(symbol) == 1 and "/" not in next(iter(symbol)) else "all"
+    if extract == "all":
+        return None
+    if extract == "bin":
+        include, exclude = [*symbol, *extra], []
+    elif isinstance(extract, Mapping):
+        include, exclude = extract.get("include", ["*"]), extract.get("exclude", [])
+    else:
+        raise ValueError(f"Invalid extract filter: {extract!r}")
+
+    def select(name: str) -> bool:
+        name = name.removeprefix("./").strip("/")
+        candidates = [name, name.split("/", 1)[1]] if "/" in name else [name]
+        return (any(fnmatch.fnmatchcase(path, pattern) for path in candidates for pattern in include)
+                and not any(fnmatch.fnmatchcase(path, pattern) for path in candidates for pattern in exclude))
+
+    return select
+
+
+_STREAM_MODES = {
+    '.tar.gz': 'r|gz',
+    '.tgz': 'r|gz',
+    '.tar.xz': 'r|xz',
+    '.txz': 'r|xz',
+}
 
-    """
-    The list of file name installed in the bin directory.
-    """
-    bin: list[str]
 
-    """Application version."""
-    version: str
+class QuickInstallPackage:
+    supported_extensions = ['.tar.gz', '.tgz', '.tar.xz', '.txz', '.zip']
+
+    def __init__(self, url: str, name: str, sha256: str | None, symbol: dict[str, str], version: str | None = None,
+                 extract: str | Mapping[str, Iterable[str]] | None = None, files: Iterable[str] = ()):
+        self.url = url
+        self.name = name
+        self.sha256 = sha256
+        self.symbol = symbol
+        self.version = version
+        self.select = _member_filter(extract, symbol, files)
+        # A symlink to the live directory below DotFiles.get_versions_dir()
+        self.install_dir = DotFiles.get_app_dir() / name
+        # SHA-256 of the archive actually installed, set by fetch() and stream()
+        self.digest: str | None = None
+        # The version directory installed, set by commit()
+        self.version_dir: pathlib.Path | None = None
+        # Links in the bin directory of the version being replaced, which commit() removes unless this one has them
+        self.stale_links: list[str] = []
 
+    def install(self, stream: bool = False) -> None:
+        self.commit(self.stream() if stream else self.stage(self.fetch()))
 
-class PackageAPI:
-    registry = {}
+    def fetch(self) -> pathlib.Path:
+        """Return a verified archive of this package, downloading it only on a cache miss.
 
-    def __init_subclass__(cls, **kwargs):
-        super.__init_subclass__()
-        PackageAPI.registry[cls.__name__] = cls
+        An interrupted download is resumed from its ``.part`` file in the cache.
+        When a mirror is configured (see :mod:`dotfiles.mirror`), the archive
+        is taken from it first, and downloaded from its URL if the mirror does
+        not have it or has a copy that does not match the expected hash.
 
-    def __init__(self):
-        pass
+        Returns:
+            Path to the archive inside the archive cache
 
-    def info(self) -> PackageInfo:
+        Raises:
+            ValueError: If the SHA256 hash of the downloaded archive does not match
         """
-        Retrieve information about a specific package.
+        with trace.span("fetch", package=self.name) as span:
+            cache = ArchiveCache()
+            with trace.span("cache lookup"):
+                cached = cache.lookup(self.url, self.sha256)
+            if cached is not None:
+                span.set(cached=True)
+                self.digest = cached.name.split(".", 1)[0]
+                return cached
+
+            part = cache.part_file(self.url)
+            mirror = get_mirror()
+            digest = None
+            if mirror is not None and mirror.fetch(self.url, part):
+                span.set(mirror=True)
+                digest = QuickInstallPackage._hash(part)
+                if self.sha256 and digest != self.sha256:
+                    Downloader.discard(part)
+                    digest = None
+            if digest is None:
+                Downloader().download(self.url, part)
+                digest = QuickInstallPackage._hash(part)
+                if self.sha256 and digest != self.sha256:
+                    Downloader.discard(part)
+                    raise ValueError(f"SHA256 hash mismatch for {self.name}")
+            self.digest = digest
+            with trace.span("cache store"):
+                return cache.store(part, self.url, digest, self.get_extension())
 
-        Provides concise details about a package, including its name and output
-        information. Used to encapsulate and return package-related metadata.
+    def stream(self) -> pathlib.Path:
+        """Download, verify and extract the archive in a single pass.
 
-        :return: An instance containing package metadata.
-        :rtype: PackageInfo
-        """
-        return PackageInfo(
-            name="dotfiles",
-            bin=[],
-            version="",
-        )
+        The response body is hashed and copied into the archive cache while a
+        streaming tar decoder extracts it into a staging directory. If the
+        checksum does not match at end of stream, the staging directory is
+        discarded. Zip archives need random access, and archives taken from a
+        mirror are local or nearby, so both are fetched into the cache first
+        and extracted from there.
 
-    def install(self) -> None:
-        """
-        Install application. If the application is already installed, update it.
-        """
-        pass
+        Returns:
+            Path to the staging directory, to be passed to :meth:`commit`
 
-    def uninstall(self) -> None:
-        """
-        Uninstall application.
+        Raises:
+            ValueError: If the SHA256 hash of the downloaded archive does not match
         """
-        pass
+        ext = self.get_extension()
+        cache = ArchiveCache()
+        cached = cache.lookup(self.url, self.sha256)
+        if cached is not None:
+            self.digest = cached.name.split(".", 1)[0]
+            return self.stage(cached)
+        if ext not in _STREAM_MODES or get_mirror() is not None:
+            return self.stage(self.fetch())
+
+        fd, temp_path = cache.temp_file()
+        staging = _make_staging_dir(DotFiles.get_app_dir(), self.name)
+        try:
+            with trace.span("stream", package=self.name) as span, os.fdopen(fd, "wb") as temp_file, \
+                    get_transport().open(self.url) as response:
+                reader = _HashingReader(response, temp_file)
+                with tarfile.open(fileobj=reader, mode=_STREAM_MODES[ext]) as tar:
+                    extract_tar(tar, staging, self.select)
+                reader.drain()
+                span.add("downloaded_bytes", reader.size)
+
+            if self.sha256 and reader.hexdigest() != self.sha256:
+                raise ValueError(f"SHA256 hash mismatch for {self.name}")
+            self.digest = reader.hexdigest()
+            cache.store(temp_path, self.url, self.digest, ext)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            temp_path.unlink(missing_ok=True)
+        return staging
 
+    @staticmethod
+    def _hash(part: pathlib.Path) -> str:
+        with trace.span("sha256") as hashing:
+            digest = file_sha256(part)
+            hashing.add("hashed_bytes", part.stat().st_size)
+        return digest
 
-class QuickInstallPackage:
-    supported_extensions = ['.tar.gz', '.tgz', '.tar.xz', '.txz', '.zip']
+    def stage(self, archive: pathlib.Path) -> pathlib.Path:
+        """Extract an archive into a fresh staging directory inside the apps directory.
 
-    def __init__(self, url: str, name: str, sha256: str | None, symbol: dict[str, str]):
-        self.url = url
-        self.name = name
-        self.sha256 = sha256
-        self.symbol = symbol
-        self.install_dir = DotFiles.get_app_dir() / name
+        Args:
+            archive: Path to the archive returned by :meth:`fetch`, left in place
 
-    def install(self) -> None:
-        with tempfile.NamedTemporaryFile(suffix=self.get_extension()) as temp_file:
-            opener = urllib.request.build_opener()
-            if "http_proxy" in os.environ:
-                opener.add_handler(urllib.request.ProxyHandler({
-                    "http": os.environ["http_proxy"],
-                    "https": os.environ.get("https_proxy", os.environ["http_proxy"])
-                }))
-            urllib.request.install_opener(opener)
-            urllib.request.urlretrieve(self.url, temp_file.name)
-
-            if self.sha256:
-                # Calculate SHA256 hash of downloaded file
-                sha256_hash = hashlib.sha256()
-                with open(temp_file.name, "rb") as f:
-                    for byte_block in iter(lambda: f.read(4096), b""):
-                        sha256_hash.update(byte_block)
-                if sha256_hash.hexdigest() != self.sha256:
-                    raise ValueError(f"SHA256 hash mismatch for {self.name}")
+        Returns:
+            Path to the staging directory, to be passed to :meth:`commit`
+        """
+        staging = _make_staging_dir(DotFiles.get_app_dir(), self.name)
+        try:
+            with trace.span("extract", package=self.name) as span:
+                QuickInstallPackage._extract(str(archive), staging, self.select)
+                span.add("archive_bytes", archive.stat().st_size)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return staging
+
+    def commit(self, staging: pathlib.Path) -> None:
+        """Move a staged tree into a new version directory and switch the package to it.
+
+        The staged tree is renamed to a new directory below
+        ``apps/.versions/<name>/``, whose files are then deduplicated against
+        the :class:`~dotfiles.store.FileStore` and recorded in a file manifest
+        for ``verify``, and :meth:`switch` activates it. The previous version
+        is kept, so that it can be rolled back to.
+
+        Args:
+            staging: Path to the staging directory returned by :meth:`stage` or :meth:`stream`
+        """
+        version_dir = DotFiles.get_versions_dir() / self.name / f"{self.version or 'latest'}-{secrets.token_hex(4)}"
+        version_dir.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with trace.span("promote", package=self.name):
+                QuickInstallPackage._promote(staging, version_dir)
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging)
+
+        for src in self.symbol:
+            if not (version_dir / src).exists():
+                shutil.rmtree(version_dir)
+                raise FileNotFoundError(f"Source file '{self.install_dir / src}' does not exist")
+
+        digests: dict[str, str] = {}
+        with trace.span("dedupe", package=self.name) as span:
+            linked, saved = FileStore().dedupe(version_dir, digests)
+            span.add("linked_files", linked)
+            span.add("saved_bytes", saved)
+        manifest = DotFiles.get_file_manifest(self.name, version_dir.name)
+        try:
+            with trace.span("file manifest", package=self.name):
+                write_manifest(manifest, build_manifest(version_dir, digests))
+            self.switch(version_dir, stale_links=self.stale_links)
+        except BaseException:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            manifest.unlink(missing_ok=True)
+            raise
+        self.version_dir = version_dir
+
+    def switch(self, version_dir: pathlib.Path, stale_links: Iterable[str] = ()) -> None:
+        """Atomically point the package and its binaries at an extracted version.
+
+        The ``apps/<name>`` symlink and the links in the bin directory are each
+        replaced with a single rename, so running programs and new shells see
+        either the old version or the new one, never a partial tree. If
+        anything fails, the previous links are restored.
 
-            if self.install_dir.exists():
-                shutil.rmtree(self.install_dir)
+        Args:
+            version_dir: Directory below ``apps/.versions/<name>/``
+            stale_links: Links in the bin directory to remove, e.g. binaries the
+                version being switched away from had and this one has not
+        """
+        bin_dir = DotFiles.get_bin_dir()
+        previous = self.install_dir.resolve() if self.install_dir.is_symlink() else None
+        legacy = None
+        if self.install_dir.is_dir() and not self.install_dir.is_symlink():
+            # Installed by an older release as a plain directory; it cannot be replaced atomically.
+            legacy = _make_staging_dir(DotFiles.get_app_dir(), self.name)
+            self.install_dir.rename(legacy / self.name)
+        stale_links = [dst for dst in stale_links if dst not in self.symbol.values()]
+        old_links = {dst: _read_link(bin_dir / dst) for dst in [*self.symbol.values(), *stale_links]}
+        try:
+            with trace.span("link", package=self.name):
+                _replace_symlink(self.install_dir, os.path.relpath(version_dir, self.install_dir.parent))
+                for src, dst in self.symbol.items():
+                    _replace_symlink(bin_dir / dst, self.install_dir / src)
+                for dst in stale_links:
+                    (bin_dir / dst).unlink(missing_ok=True)
+        except BaseException:
+            for dst, target in old_links.items():
+                if target is None:
+                    (bin_dir / dst).unlink(missing_ok=True)
+                else:
+                    _replace_symlink(bin_dir / dst, target)
+            if previous is not None:
+                _replace_symlink(self.install_dir, os.path.relpath(previous, self.install_dir.parent))
+            elif legacy is not None:
+                self.install_dir.unlink(missing_ok=True)
+                (legacy / self.name).rename(self.install_dir)
+            raise
+        finally:
+            if legacy is not None and legacy.exists():
+                Trash().discard(legacy)
 
-            QuickInstallPackage._uncompress(temp_file.name, DotFiles.get_app_dir(), self.name)
+    def deploy(self, archive: pathlib.Path) -> None:
+        """Extract a verified archive into the apps directory and link its binaries.
 
-            bin_dir = DotFiles.get_bin_dir()
-            for src, dst in self.symbol.items():
-                src_path = self.install_dir / src
-                if not src_path.exists():
-                    raise FileNotFoundError(f"Source file '{src_path}' does not exist")
-                dst_path = bin_dir / dst
-                if dst_path.exists():
-                    dst_path.unlink()
-                dst_path.symlink_to(src_path)
+        Args:
+            archive: Path to the archive returned by :meth:`fetch`, left in place
+        """
+        self.commit(self.stage(archive))
 
     @staticmethod
     def _uncompress(file: str, out: pathlib.Path, name: str) -> None:
         """Extract compressed file to output directory with automatic subfolder detection.
 
+        The archive is extracted into a staging directory below ``out`` so the
+        final move is a rename on the same filesystem.
+
         Args:
             file: Path to compressed file
             out: Output directory path
@@ -125,44 +373,53 @@ class QuickInstallPackage:
         Raises:
             ValueError: If the compressed file is empty
         """
-        out_path = out
-        temp_dir = pathlib.Path(tempfile.mkdtemp())
-
+        staging = _make_staging_dir(out, name)
         try:
-            # Extract based on file extension
-            if file.endswith(('.tar.gz', '.tgz')):
-                with tarfile.open(file, 'r:gz') as tar:
-                    tar.extractall(temp_dir)
-            elif file.endswith(('.tar.xz', '.txz')):
-                with lzma.open(file) as xz:
-                    with tarfile.open(fileobj=xz) as tar:
-                        tar.extractall(temp_dir)
-            elif file.endswith('.zip'):
-                with zipfile.ZipFile(file) as zip_file:
-                    zip_file.extractall(temp_dir)
-
-            # Get contents of the temp directory
-            contents = list(temp_dir.iterdir())
-            if not contents:
-                raise ValueError("Compressed file is empty")
-
-            # Clear the target directory if it doesn't exist
-            target_dir = out_path / name
+            QuickInstallPackage._extract(file, staging)
+
+            # Move the previous target directory out of the way; it is deleted in the background
+            target_dir = out / name
             if target_dir.exists():
-                shutil.rmtree(target_dir)
-
-            if len(contents) == 1 and contents[0].is_dir():
-                # Single directory - rename it
-                shutil.move(str(contents[0]), target_dir)
-            else:
-                target_dir.mkdir(parents=True)
-                # Multiple items - move all to the new directory
-                for item in contents:
-                    shutil.move(str(item), target_dir)
+                Trash().discard(target_dir)
+            QuickInstallPackage._promote(staging, target_dir)
         finally:
-            # Clean up temp directory
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir)
+            # Clean up staging directory
+            if staging.exists():
+                shutil.rmtree(staging)
+
+    @staticmethod
+    def _extract(file: str, out: pathlib.Path, select: Callable[[str], bool] | None = None) -> None:
+        """Extract compressed file into an existing directory based on its extension.
+
+        Decoding and writing are pipelined across threads, see :mod:`dotfiles.extract`.
+
+        Args:
+            file: Path to compressed file
+            out: Output directory path
+            select: Predicate on member names; unselected members are skipped without being written
+        """
+        extract_archive(file, out, select)
+
+    @staticmethod
+    def _promote(staging: pathlib.Path, target_dir: pathlib.Path) -> None:
+        """Rename an extracted staging directory to ``target_dir``.
+
+        If the archive contained a single top-level directory, that directory
+        becomes ``target_dir``; otherwise the staging directory itself does.
+
+        Raises:
+            ValueError: If the staging directory is empty
+        """
+        contents = list(staging.iterdir())
+        if not contents:
+            raise ValueError("Compressed file is empty")
+
+        if len(contents) == 1 and contents[0].is_dir() and not contents[0].is_symlink():
+            # Single directory - rename it
+            contents[0].rename(target_dir)
+        else:
+            # Multiple items - the staging directory is the package directory
+            staging.rename(target_dir)
 
     def get_extension(self) -> str:
         """
@@ -188,10 +445,18 @@ class QuickUninstallPackage:
 
     def uninstall(self) -> None:
         bin_dir = DotFiles.get_bin_dir()
-        for item in self.symbol:
-            symbol_link = bin_dir / item
-            if symbol_link.exists() or symbol_link.is_symlink():
-                symbol_link.unlink()
-
-        if self.install_dir.exists():
-            shutil.rmtree(self.install_dir)
+        with trace.span("unlink"):
+            for item in self.symbol:
+                symbol_link = bin_dir / item
+                if symbol_link.exists() or symbol_link.is_symlink():
+                    symbol_link.unlink()
+
+        with trace.span("remove"):
+            if self.install_dir.is_symlink():
+                self.install_dir.unlink()
+            elif self.install_dir.exists():
+                Trash().discard(self.install_dir)
+            versions_dir = DotFiles.get_versions_dir() / self.name
+            if versions_dir.exists():
+                Trash().discard(versions_dir)
+            shutil.rmtree(DotFiles.get_verify_dir() / self.name, ignore_errors=True)
@@ -1,28 +1,33 @@
-import json
+from __future__ import annotations
+
+import dataclasses
+import os
 import pathlib
-import platform
+from typing import TYPE_CHECKING
 
-from dotfiles.package import QuickInstallPackage, QuickUninstallPackage
+from dotfiles import trace
+from dotfiles.index import PackageIndex
+from dotfiles.lock import FileLock
 from dotfiles.path import DotFiles
+from dotfiles.state import InstalledState
+from dotfiles.trash import Trash
 
+# The installer pulls in the network and archive stacks; it is imported lazily
+# so that read-only commands such as `search` stay cheap to start.
+if TYPE_CHECKING:
+    from dotfiles.manifest import PackageRecord
+    from dotfiles.package import QuickInstallPackage
+    from dotfiles.store import FileStore
 
-def _load_json_files(path: pathlib.Path, arch: str) -> dict[str, dict]:
-    result = {}
-    for json_file in path.glob("*.json"):
-        key = json_file.stem
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-            # Check if the current architecture is available
-            if ("architecture" not in data) or not isinstance(data["architecture"], dict):
-                continue
-            if arch not in data["architecture"] or not isinstance(data["architecture"][arch], dict):
-                continue
-            result[key] = data
-    return result
+DEFAULT_JOBS = min(8, (os.cpu_count() or 1) + 4)
+# Previous versions of each package kept for `rollback` after an install
+DEFAULT_KEEP_VERSIONS = 1
+NOT_FOUND = "not found"
+UP_TO_DATE = "up to date"
 
 
 def _get_arch() -> str:
-    machine = platform.machine().lower()
+    machine = os.uname().machine.lower()
     if machine in ("x86_64", "amd64"):
         return "x86_64"
     if machine in ("arm64", "aarch64"):
@@ -32,45 +37,676 @@ def _get_arch() -> str:
     raise RuntimeError(f"Unsupported architecture: {machine}")
 
 
+def _keep_versions() -> int:
+    return max(0, int(os.environ.get("DOTFILES_KEEP_VERSIONS", DEFAULT_KEEP_VERSIONS)))
+
+
+def _report(package_names: list[str], results: dict[str, str | None], action: str) -> int:
+    """Print one result line per package followed by a summary, and return the exit code."""
+    done = current = failed = 0
+    for name in dict.fromkeys(package_names):
+        error = results.get(name)
+        if error is None:
+            done += 1
+            print(f"Package `{name}` {action}")
+        elif error is UP_TO_DATE:
+            current += 1
+            print(f"Package `{name}` is up to date")
+        elif error is NOT_FOUND:
+            failed += 1
+            print(f"Package `{name}` not found")
+        else:
+            failed += 1
+            print(f"Package `{name}` failed: {error}")
+    if len(results) > 1:
+        summary = f"{done} {action}, " + (f"{current} up to date, " if current else "") + f"{failed} failed"
+        print(summary)
+    return 1 if failed else 0
+
+
 class PackageManager:
     def __init__(self):
-        package_path = DotFiles.get_root_dir() / "dotfiles" / "package"
         self.arch = _get_arch()
-        self.json_data = _load_json_files(package_path, self.arch)
-
-    def search(self, pattern: str) -> None:
-        pattern_lower = pattern.lower()
-        for name, instance in self.json_data.items():
-            if pattern_lower in name.lower():
-                print(f"{name}: {instance['version']}")
-
-    def install(self, package_name: str) -> None:
-        if package_name in self.json_data:
-            self._install_package(package_name, self.json_data[package_name])
-            print(f"Package `{package_name}` installed")
-        else:
-            print(f"Package `{package_name}` not found")
+        self.index = PackageIndex()
+        self.packages = self.index.load(self.arch)
 
-    def uninstall(self, package_name: str) -> None:
-        if package_name in self.json_data:
-            self._uninstall_package(package_name, self.json_data[package_name])
-            print(f"Package `{package_name}` uninstalled")
-        else:
-            print(f"Package `{package_name}` not found")
+    def search(self, pattern: str, limit: int | None = None) -> None:
+        engine = self.index.search_engine(self.packages)
+        with trace.span("query", pattern=pattern) as span:
+            matches = engine.search(pattern, limit)
+            span.set(matches=len(matches))
+        for name, term in matches:
+            record = self.packages[name]
+            provided = [binary for binary in record.bin.values() if binary.lower() == term]
+            suffix = f" (provides {', '.join(provided)})" if provided and term != name.lower() else ""
+            print(f"{name}: {record.version}{suffix}")
+
+    def provides(self, binary: str) -> int:
+        """Print the packages installing an executable named ``binary``.
+
+        Returns:
+            Process exit code, 0 if at least one package provides it
+        """
+        names = self.index.search_engine(self.packages).provides(binary)
+        for name in names:
+            print(f"{name}: {self.packages[name].version}")
+        if not names:
+            print(f"No package provides `{binary}`")
+        return 0 if names else 1
+
+    def install(self, package_names: list[str], jobs: int = DEFAULT_JOBS, stream: bool = False,
+                force: bool = False) -> int:
+        """Install packages concurrently, skipping the ones already up to date unless ``force`` is set.
+
+        Archives are downloaded by a pool of at most ``jobs`` workers. Each
+        finished download is handed to a single extraction worker, so that
+        extracting one package overlaps with the downloads still in flight.
+        With ``stream``, the download workers also extract tar archives while
+        they are being downloaded, and the extraction worker only moves the
+        staged trees into place.
+
+        Returns:
+            Process exit code, 0 if every package was installed
+        """
+        state = InstalledState()
+        results: dict[str, str | None] = {}
+        pending = []
+        for name in dict.fromkeys(package_names):
+            if name not in self.packages:
+                results[name] = NOT_FOUND
+            elif not force and state.is_current(name, self.packages[name]):
+                results[name] = UP_TO_DATE
+            else:
+                pending.append(name)
+        if pending:
+            results.update(self._install_packages(pending, jobs, stream))
+        return _report(package_names, results, "installed")
+
+    def uninstall(self, package_names: list[str]) -> int:
+        """Uninstall packages.
+
+        Returns:
+            Process exit code, 0 if every package was uninstalled
+        """
+        results: dict[str, str | None] = {}
+        with FileLock(DotFiles.get_lock_file()):
+            state = InstalledState()
+            for name in dict.fromkeys(package_names):
+                if name not in self.packages and state.get(name) is None:
+                    results[name] = NOT_FOUND
+                    continue
+                try:
+                    with trace.span("package", package=name):
+                        self._uninstall_package(name, state)
+                except Exception as e:
+                    results[name] = str(e) or type(e).__name__
+                else:
+                    results[name] = None
+            with trace.span("save state"):
+                state.save()
+            with trace.span("activate"):
+                self._update_activation({}, [name for name, error in results.items() if error is None])
+        return _report(package_names, results, "uninstalled")
+
+    def list_installed(self) -> None:
+        """Print the installed packages and their versions."""
+        for name, entry in sorted(InstalledState().packages.items()):
+            print(f"{name}: {entry['version']}")
+
+    def outdated(self, package_names: list[str] | None = None) -> dict[str, dict]:
+        """Return the installed packages whose manifest changed version or archive, keyed by name.
+
+        Args:
+            package_names: Packages to check, all installed packages if None
+        """
+        state = InstalledState()
+        result = {}
+        for name in sorted(state.packages) if package_names is None else package_names:
+            entry = state.get(name)
+            if entry is not None and name in self.packages and not state.is_current(name, self.packages[name]):
+                result[name] = entry
+        return result
 
-    def _install_package(self, name: str, package: dict) -> None:
-        arch = package["architecture"][self.arch]
-        url = arch["url"]
-        if "sha256" in arch:
-            sha256 = arch["sha256"]
+    def print_outdated(self) -> None:
+        for name, entry in self.outdated().items():
+            print(f"{name}: {entry['version']} -> {self.packages[name].version}")
+
+    def upgrade(self, package_names: list[str] | None = None, jobs: int = DEFAULT_JOBS, stream: bool = False) -> int:
+        """Reinstall the outdated packages among ``package_names``, or among all installed packages.
+
+        Only packages whose version or archive changed are downloaded and
+        extracted, so upgrading an up-to-date system does no network work.
+
+        Returns:
+            Process exit code, 0 if every outdated package was upgraded
+        """
+        state = InstalledState()
+        results: dict[str, str | None] = {}
+        if package_names:
+            for name in package_names:
+                if state.get(name) is None:
+                    results[name] = "not installed"
+            outdated = self.outdated([name for name in package_names if name not in results])
+            for name in package_names:
+                results.setdefault(name, None if name in outdated else UP_TO_DATE)
         else:
-            sha256 = None
-        symbol = package["bin"]
-        if not isinstance(url, str) or not isinstance(symbol, dict):
-            raise RuntimeError(f"Invalid package data: {package}")
-        QuickInstallPackage(url=url, name=name, sha256=sha256, symbol=symbol).install()
-
-    def _uninstall_package(self, name: str, package: dict) -> None:
-        bins = list(package["bin"].keys())
+            outdated = self.outdated()
+        if not outdated and not package_names:
+            print("All packages are up to date")
+            return 0
+        if outdated:
+            results.update(self._install_packages(list(outdated), jobs, stream))
+        return _report(list(results), results, "upgraded")
+
+    def lock(self, path: pathlib.Path) -> int:
+        """Write the installed packages to a lockfile for :meth:`sync`.
+
+        Each package is locked at its installed version, with the archive it
+        was installed from for this architecture. When that version is also
+        the one of the manifest, the archives of the other architectures the
+        manifest lists are locked too, so that one lockfile serves every host.
+
+        Returns:
+            Process exit code
+        """
+        from dotfiles.lockfile import write_lockfile
+
+        state = InstalledState()
+        manifests = self.index.load_all()
+        locked = {}
+        for name, entry in sorted(state.packages.items()):
+            architecture = {
+                arch: {"url": record.url, "sha256": record.sha256}
+                for arch, record in manifests.get(name, {}).items()
+                if record.version == entry["version"]
+            }
+            architecture[self.arch] = {"url": entry["url"], "sha256": entry["sha256"]}
+            locked[name] = {"version": entry["version"], "architecture": architecture}
+        write_lockfile(path, locked)
+        print(f"Locked {len(locked)} package(s) in {path}")
+        return 0
+
+    def sync(self, path: pathlib.Path, jobs: int = DEFAULT_JOBS, stream: bool = False, dry_run: bool = False) -> int:
+        """Converge the installed packages to a lockfile written by :meth:`lock`.
+
+        Packages missing or installed from another archive are installed,
+        packages that are not locked are uninstalled, and everything else is
+        left alone, so syncing a converged host only reads the lockfile and
+        the installed-state database. The downloads run concurrently, and the
+        removals run while they are in flight.
+
+        Returns:
+            Process exit code, 0 if every package is in sync
+        """
+        from dotfiles.lockfile import read_lockfile
+
+        try:
+            locked = read_lockfile(path)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read lockfile: {e}")
+            return 1
+        state = InstalledState()
+        results: dict[str, str | None] = {}
+        records: dict[str, PackageRecord] = {}
+        plan: dict[str, str] = {}
+        for name, entry in sorted(locked.items()):
+            target = entry["architecture"].get(self.arch)
+            if name not in self.packages:
+                results[name] = NOT_FOUND
+            elif target is None:
+                results[name] = f"no {self.arch} archive locked"
+            else:
+                record = dataclasses.replace(self.packages[name], version=entry["version"], url=target["url"],
+                                             sha256=target.get("sha256"))
+                if not self._is_synced(name, record, state):
+                    records[name] = record
+                    installed = state.get(name)
+                    if installed is None:
+                        plan[name] = f"install {entry['version']}"
+                    elif installed["version"] == entry["version"]:
+                        plan[name] = f"reinstall {entry['version']}"
+                    else:
+                        plan[name] = f"upgrade {installed['version']} -> {entry['version']}"
+        remove = sorted(name for name in state.packages if name not in locked)
+        plan.update((name, "remove") for name in remove)
+        if not plan and not results:
+            print("All packages are in sync")
+            return 0
+        for name, action in plan.items():
+            print(f"Package `{name}`: {action}")
+        if dry_run:
+            return _report(list(results), results, "synced") if results else 0
+        if records or remove:
+            results.update(self._install_packages(list(records), jobs, stream, records, remove))
+        return _report(list(results), results, "synced")
+
+    def bundle(self, path: pathlib.Path, package_names: list[str], architectures: list[str] | None = None,
+               jobs: int = DEFAULT_JOBS) -> int:
+        """Pack the verified archives of packages into a bundle, for a mirror or an offline host.
+
+        Archives are fetched concurrently through the archive cache, so they
+        are verified against their manifest hash as for an install, and
+        bundling packages that were just installed downloads nothing.
+
+        Args:
+            path: Bundle file to write, see :func:`dotfiles.mirror.write_bundle`
+            package_names: Packages to bundle
+            architectures: Architectures to bundle, this host's by default; ``all`` for every one
+
+        Returns:
+            Process exit code, 0 if every package was bundled
+        """
+        import concurrent.futures
+
+        from dotfiles.mirror import mirror_path, write_bundle
+
+        architectures = architectures or [self.arch]
+        manifests = self.index.load_all()
+        results: dict[str, str | None] = {}
+        fetching = {}
+        with FileLock(DotFiles.get_lock_file()), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as downloader:
+            for name in dict.fromkeys(package_names):
+                if name not in manifests:
+                    results[name] = NOT_FOUND
+                    continue
+                selected = {arch: record for arch, record in manifests[name].items()
+                            if "all" in architectures or arch in architectures}
+                if not selected:
+                    results[name] = f"no archive for {', '.join(architectures)}"
+                    continue
+                for arch, record in selected.items():
+                    try:
+                        package = self._make_install_package(name, record)
+                    except Exception as e:
+                        results[name] = str(e) or type(e).__name__
+                        break
+                    fetching[downloader.submit(trace.wrap(package.fetch))] = (name, arch, package)
+
+            packages: dict[str, dict] = {}
+            fetched: dict[str, pathlib.Path] = {}
+            for future in concurrent.futures.as_completed(fetching):
+                name, arch, package = fetching[future]
+                try:
+                    archive = future.result()
+                except Exception as e:
+                    results[name] = str(e) or type(e).__name__
+                    continue
+                member = mirror_path(package.url)
+                fetched[member] = archive
+                entry = packages.setdefault(name, {"version": package.version, "architecture": {}})
+                entry["architecture"][arch] = {"url": package.url, "sha256": package.digest, "path": member}
+            # A package is bundled for all of the selected architectures or not at all
+            packages = {name: entry for name, entry in packages.items() if results.get(name) is None}
+            archives = {info["path"]: fetched[info["path"]]
+                        for entry in packages.values() for info in entry["architecture"].values()}
+            for name in packages:
+                results[name] = None
+            with trace.span("write bundle"):
+                write_bundle(path, packages, archives)
+        code = _report(package_names, results, "bundled")
+        print(f"Wrote {len(packages)} package(s) to {path}")
+        return code
+
+    def rollback(self, name: str) -> int:
+        """Switch an installed package back to the version it had before its last install.
+
+        The previous version directory is still on disk, so this only swaps
+        symlinks and does no network or archive work. Rolling back twice
+        returns to the version rolled back from.
+
+        Returns:
+            Process exit code, 0 if the package was rolled back
+        """
+        from dotfiles.package import QuickInstallPackage
+
+        with FileLock(DotFiles.get_lock_file()):
+            state = InstalledState()
+            entry = state.get(name)
+            if entry is None:
+                print(f"Package `{name}` is not installed")
+                return 1
+            if not entry.get("history"):
+                print(f"Package `{name}` has no previous version to roll back to")
+                return 1
+            previous = entry["history"][-1]
+            version_dir = DotFiles.get_versions_dir() / name / previous["path"]
+            if not version_dir.is_dir():
+                print(f"Package `{name}` cannot be rolled back: {version_dir} is missing")
+                return 1
+            package = QuickInstallPackage(url=previous["url"], name=name, sha256=previous["sha256"],
+                                          symbol=previous["bin"], version=previous["version"])
+            package.switch(version_dir, stale_links=entry["symlinks"])
+            state.rollback(name)
+            with trace.span("save state"):
+                state.save()
+            # Versions installed before activation entries were recorded fall back to the current manifest
+            record = state.installed_record(name) or self.packages.get(name)
+            if record is not None:
+                with trace.span("activate"):
+                    self._update_activation({name: record}, [])
+        print(f"Package `{name}` rolled back to {previous['version']}")
+        return 0
+
+    def gc(self, keep: int | None = None) -> int:
+        """Remove the version directories that are neither installed nor among the ``keep`` previous versions.
+
+        Directories left behind by packages missing from the installed-state
+        database are removed too, and so are the store files no remaining
+        version links to.
+
+        Returns:
+            Process exit code
+        """
+        from dotfiles.cache import format_size
+        from dotfiles.store import FileStore
+
+        keep = _keep_versions() if keep is None else keep
+        with FileLock(DotFiles.get_lock_file()):
+            state = InstalledState()
+            versions_dir = DotFiles.get_versions_dir()
+            names = set(state.packages)
+            if versions_dir.is_dir():
+                names.update(path.name for path in versions_dir.iterdir() if path.is_dir())
+            with trace.span("retain versions"):
+                removed, freed = self._retain_versions(state, sorted(names), keep)
+            with trace.span("save state"):
+                state.save()
+            # The removed trees still hold links to the store objects until they are deleted
+            with trace.span("empty trash"):
+                Trash().empty(wait=True)
+            with trace.span("prune store"):
+                freed += FileStore().prune()[1]
+        print(f"Removed {removed} version(s), freed {format_size(freed)}")
+        return 0
+
+    def verify(self, package_names: list[str] | None = None, fast: bool = False, repair: bool = False,
+               jobs: int | None = None) -> int:
+        """Check installed packages against the file manifests written when they were installed.
+
+        Files are hashed on a pool of ``jobs`` threads shared by all packages.
+        The ``apps/<name>`` and binary links are checked too. Files that are
+        not in the manifest are reported but do not fail the check.
+
+        Args:
+            package_names: Packages to check, all installed packages if empty
+            fast: Only compare file sizes, modes and modification times
+            repair: Restore the damaged files from the package archive, taken
+                from the cache if possible, relink the package if needed, and
+                restore the other versions sharing a file modified in place
+
+        Returns:
+            Process exit code, 0 if no package is damaged
+        """
+        import concurrent.futures
+
+        from dotfiles.package import QuickInstallPackage
+        from dotfiles.store import FileStore
+        from dotfiles.verify import (DEFAULT_WORKERS, LINK_CHANGED, MODIFIED, UNEXPECTED, read_manifest, repair_files,
+                                     verify_tree)
+
+        results: dict[str, str | None] = {}
+        with FileLock(DotFiles.get_lock_file()):
+            state = InstalledState()
+            package_names = package_names or sorted(state.packages)
+            store = FileStore()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or DEFAULT_WORKERS,
+                                                       thread_name_prefix="verify") as executor:
+                for name in package_names:
+                    entry = state.get(name)
+                    if entry is None:
+                        results[name] = "not installed"
+                        continue
+                    try:
+                        files = (read_manifest(DotFiles.get_file_manifest(name, entry["path"]))
+                                 if entry.get("path") else None)
+                        if files is None:
+                            results[name] = "no file manifest, reinstall the package to create one"
+                            continue
+                        version_dir = DotFiles.get_versions_dir() / name / entry["path"]
+                        with trace.span("verify", package=name):
+                            problems = verify_tree(version_dir, files, executor, fast)
+                            broken_links = self._check_links(name, entry, version_dir)
+                        damaged = [relative for relative, problem in problems.items() if problem != UNEXPECTED]
+                        failed = damaged + broken_links
+                        if repair and failed:
+                            package = QuickInstallPackage(url=entry["url"], name=name, sha256=entry["sha256"],
+                                                          symbol=entry.get("bin") or {}, version=entry["version"])
+                            with trace.span("repair", package=name):
+                                failed = repair_files(version_dir, files, problems, package.fetch)
+                                # Files modified in place also modified the store objects they were linked to
+                                for relative in damaged:
+                                    if "sha256" in files[relative]:
+                                        store.evict(files[relative]["sha256"], files[relative]["mode"])
+                                store.dedupe(version_dir)
+                                if broken_links:
+                                    package.switch(version_dir)
+                                # ...and every other version linked to them, which the repaired files now replace
+                                copies = self._repair_copies(store, version_dir, {
+                                    (files[relative]["sha256"], files[relative]["mode"]): version_dir / relative
+                                    for relative in damaged if problems[relative] == MODIFIED and relative not in failed
+                                })
+                                for copy, repaired in copies.items():
+                                    print(f"Package `{name}`: {copy}: {MODIFIED}" + (", repaired" if repaired else ""))
+                                failed += [copy for copy, repaired in copies.items() if not repaired]
+                        for relative, problem in [*problems.items(), *((link, LINK_CHANGED) for link in broken_links)]:
+                            repaired = repair and problem != UNEXPECTED and relative not in failed
+                            print(f"Package `{name}`: {relative}: {problem}" + (", repaired" if repaired else ""))
+                        results[name] = f"{len(failed)} damaged file(s)" if failed else None
+                    except Exception as e:
+                        results[name] = str(e)
+        return _report(package_names, results, "repaired" if repair else "verified")
+
+    @staticmethod
+    def _check_links(name: str, entry: dict, version_dir: pathlib.Path) -> list[str]:
+        """Return the links of a package, ``apps/<name>`` and its binaries, that do not point into ``version_dir``."""
+        install_dir = DotFiles.get_app_dir() / name
+        bin_dir = DotFiles.get_bin_dir()
+        expected = {install_dir: version_dir}
+        expected.update({bin_dir / dst: version_dir / src for src, dst in (entry.get("bin") or {}).items()})
+        return [str(link) for link, target in expected.items()
+                if not link.is_symlink() or link.resolve() != target.resolve()]
+
+    @staticmethod
+    def _repair_copies(store: FileStore, version_dir: pathlib.Path,
+                       repaired: dict[tuple[str, int], pathlib.Path]) -> dict[str, bool]:
+        """Restore the files of the other versions that shared the inode of a file repaired in ``version_dir``.
+
+        A file modified in place is modified in every version hard-linked to
+        the same store object, in this package or in another one. The files
+        recorded with the digest and mode of a repaired file that no longer
+        match it are linked to the repaired store object again, or copied
+        from the repaired file if the store has no object for it.
+
+        Args:
+            repaired: Repaired files, keyed by their recorded SHA-256 and mode
+
+        Returns:
+            Whether each damaged copy was restored, keyed by ``<package>/<version>/<path>``
+        """
+        import shutil
+
+        from dotfiles.verify import MODIFIED, check_file, read_manifest
+
+        copies = {}
+        versions_dir = DotFiles.get_versions_dir()
+        if not repaired or not versions_dir.is_dir():
+            return copies
+        for other in sorted(path for path in versions_dir.glob("*/*") if path.is_dir()):
+            if other == version_dir:
+                continue
+            try:
+                files = read_manifest(DotFiles.get_file_manifest(other.parent.name, other.name))
+            except RuntimeError:
+                continue
+            for relative, expected in (files or {}).items():
+                source = repaired.get((expected.get("sha256"), expected.get("mode")))
+                if source is None or check_file(other / relative, expected) != MODIFIED:
+                    continue
+                path = other / relative
+                try:
+                    if not store.link(expected["sha256"], expected["mode"], path):
+                        temp = f"{path}.{os.getpid()}.tmp"
+                        shutil.copy2(source, temp)
+                        os.replace(temp, path)
+                    copies[f"{other.parent.name}/{other.name}/{relative}"] = True
+                except OSError:
+                    copies[f"{other.parent.name}/{other.name}/{relative}"] = False
+        return copies
+
+    @staticmethod
+    def _update_activation(installed: dict[str, PackageRecord], uninstalled: list[str]) -> None:
+        """Regenerate the shell activation fragments of the given packages, then the activation scripts.
+
+        Args:
+            installed: Manifest records of the packages installed, keyed by name
+            uninstalled: Names of the packages uninstalled
+        """
+        from dotfiles.activate import ActivationScripts
+
+        scripts = ActivationScripts()
+        for name, record in installed.items():
+            scripts.update(name, record)
+        for name in uninstalled:
+            scripts.remove(name)
+        scripts.write()
+
+    @staticmethod
+    def _is_synced(name: str, record: PackageRecord, state: InstalledState) -> bool:
+        """Return True if ``name`` is installed from the archive of ``record`` and all its binaries are linked."""
+        if not state.is_current(name, record):
+            return False
+        bin_dir = DotFiles.get_bin_dir()
+        return all((bin_dir / link).exists() for link in state.get(name)["symlinks"])
+
+    @staticmethod
+    def _retain_versions(state: InstalledState, package_names: list[str], keep: int) -> tuple[int, int]:
+        """Trim the history of packages to ``keep`` entries and remove the version directories no longer referenced.
+
+        The directory ``apps/<name>`` points at is never removed.
+
+        Returns:
+            The number of version directories removed and the bytes they held alone,
+            i.e. not counting files still linked from the store
+        """
+        removed = freed = 0
+        for name in package_names:
+            directory = DotFiles.get_versions_dir() / name
+            entry = state.get(name)
+            referenced = set()
+            if entry is not None:
+                state.trim_history(name, keep)
+                referenced = {entry.get("path"), *(old.get("path") for old in entry["history"])}
+            link = DotFiles.get_app_dir() / name
+            active = link.resolve() if link.is_symlink() else None
+            if not directory.is_dir():
+                continue
+            for version_dir in directory.iterdir():
+                if version_dir.name in referenced or version_dir.resolve() == active:
+                    continue
+                for root, _, filenames in os.walk(version_dir):
+                    for filename in filenames:
+                        st = os.lstat(os.path.join(root, filename))
+                        if st.st_nlink == 1:
+                            freed += st.st_size
+                Trash().discard(version_dir)
+                DotFiles.get_file_manifest(name, version_dir.name).unlink(missing_ok=True)
+                removed += 1
+            if not any(directory.iterdir()):
+                directory.rmdir()
+        return removed, freed
+
+    def _install_packages(self, package_names: list[str], jobs: int, stream: bool,
+                          records: dict[str, PackageRecord] | None = None,
+                          remove: list[str] = ()) -> dict[str, str | None]:
+        """Download and deploy packages, recording them in the installed-state database.
+
+        Args:
+            records: Manifest records to install from, keyed by package name,
+                instead of the current manifests
+            remove: Packages to uninstall while the downloads are in flight
+        """
+        import concurrent.futures
+
+        from dotfiles.cache import ArchiveCache
+
+        records = self.packages if records is None else records
+        results: dict[str, str | None] = {}
+        packages: dict[str, QuickInstallPackage] = {}
+        for name in package_names:
+            try:
+                packages[name] = self._make_install_package(name, records[name])
+            except Exception as e:
+                results[name] = str(e) or type(e).__name__
+
+        with FileLock(DotFiles.get_lock_file()):
+            state = InstalledState()
+            for name, package in packages.items():
+                entry = state.get(name)
+                if entry is not None:
+                    package.stale_links = entry["symlinks"]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as downloader, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=1) as extractor:
+                fetching = {
+                    downloader.submit(trace.wrap(package.stream if stream else package.fetch)): name
+                    for name, package in packages.items()
+                }
+                removed = []
+                for name in remove:
+                    try:
+                        with trace.span("package", package=name):
+                            self._uninstall_package(name, state)
+                    except Exception as e:
+                        results[name] = str(e) or type(e).__name__
+                    else:
+                        results[name] = None
+                        removed.append(name)
+                deploying = {}
+                installed = []
+                for future in concurrent.futures.as_completed(fetching):
+                    name = fetching[future]
+                    try:
+                        fetched = future.result()
+                    except Exception as e:
+                        results[name] = str(e) or type(e).__name__
+                        continue
+                    package = packages[name]
+                    deploy = trace.wrap(package.commit if stream else package.deploy)
+                    deploying[extractor.submit(deploy, fetched)] = name
+                for future in concurrent.futures.as_completed(deploying):
+                    name = deploying[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        results[name] = str(e) or type(e).__name__
+                        continue
+                    record = records[name]
+                    state.record(name, record.version, record.url, packages[name].digest,
+                                 symlinks=list(record.bin.values()), bin=dict(record.bin),
+                                 path=packages[name].version_dir.name, activation=record)
+                    results[name] = None
+                    installed.append(name)
+            with trace.span("retain versions"):
+                self._retain_versions(state, installed, _keep_versions())
+            with trace.span("save state"):
+                state.save()
+            with trace.span("activate"):
+                self._update_activation({name: records[name] for name in installed}, removed)
+            with trace.span("prune cache"):
+                ArchiveCache().prune()
+        return results
+
+    def _make_install_package(self, name: str, record: PackageRecord) -> QuickInstallPackage:
+        from dotfiles.activate import package_files
+        from dotfiles.package import QuickInstallPackage
+
+        return QuickInstallPackage(url=record.url, name=name, sha256=record.sha256, symbol=dict(record.bin),
+                                   version=record.version, extract=record.extract, files=package_files(record))
+
+    def _uninstall_package(self, name: str, state: InstalledState) -> None:
+        from dotfiles.package import QuickUninstallPackage
+
+        entry = state.get(name)
+        bins = entry["symlinks"] if entry is not None else list(self.packages[name].bin.values())
         QuickUninstallPackage(name=name, symbol=bins).uninstall()
-        pass
+        state.remove(name)
@@ -16,3 +16,68 @@ class DotFiles:
     def get_app_dir() -> pathlib.Path:
         """Return the absolute path to this project's apps directory."""
         return DotFiles.get_root_dir() / "apps"
+
+    @staticmethod
+    def get_lock_file() -> pathlib.Path:
+        """Return the path of the lock file guarding the apps and bin directories."""
+        return DotFiles.get_app_dir() / ".lock"
+
+    @staticmethod
+    def get_cache_dir() -> pathlib.Path:
+        """Return the absolute path to the downloaded archive cache directory."""
+        return DotFiles.get_app_dir() / ".cache"
+
+    @staticmethod
+    def get_package_dir() -> pathlib.Path:
+        """Return the absolute path to the directory holding the package manifests."""
+        return DotFiles.get_root_dir() / "dotfiles" / "package"
+
+    @staticmethod
+    def get_index_file() -> pathlib.Path:
+        """Return the path of the compiled package index."""
+        return DotFiles.get_app_dir() / ".index.json"
+
+    @staticmethod
+    def get_state_file() -> pathlib.Path:
+        """Return the path of the database recording the installed packages."""
+        return DotFiles.get_app_dir() / ".state.json"
+
+    @staticmethod
+    def get_versions_dir() -> pathlib.Path:
+        """Return the directory holding the extracted versions that ``apps/<name>`` links point to."""
+        return DotFiles.get_app_dir() / ".versions"
+
+    @staticmethod
+    def get_store_dir() -> pathlib.Path:
+        """Return the content-addressed store that the files of every installed version are hard links to."""
+        return DotFiles.get_app_dir() / ".store"
+
+    @staticmethod
+    def get_activate_dir() -> pathlib.Path:
+        """Return the directory holding the per-package parts of the shell activation scripts."""
+        return DotFiles.get_app_dir() / ".activate"
+
+    @staticmethod
+    def get_activate_script(shell: str) -> pathlib.Path:
+        """Return the activation script sourced by the shell profile, ``activate.sh`` or ``activate.zsh``."""
+        return DotFiles.get_app_dir() / f"activate.{shell}"
+
+    @staticmethod
+    def get_man_dir() -> pathlib.Path:
+        """Return the directory linking the man pages of every installed package, added to ``MANPATH``."""
+        return DotFiles.get_app_dir() / ".man"
+
+    @staticmethod
+    def get_trash_dir() -> pathlib.Path:
+        """Return the directory that removed trees are renamed into, to be deleted in the background."""
+        return DotFiles.get_app_dir() / ".trash"
+
+    @staticmethod
+    def get_verify_dir() -> pathlib.Path:
+        """Return the directory holding the file manifests that ``verify`` checks installed versions against."""
+        return DotFiles.get_app_dir() / ".verify"
+
+    @staticmethod
+    def get_file_manifest(name: str, version: str) -> pathlib.Path:
+        """Return the file manifest of the version directory ``version`` of package ``name``."""
+        return DotFiles.get_verify_dir() / name / f"{version}.json"
@@ -0,0 +1,136 @@
+import bisect
+import re
+
+from dotfiles.manifest import PackageInfo, PackageRecord
+
+# Score of each kind of match; a package is ranked by its best matching term.
+EXACT = 100
+PREFIX = 80
+SUBSTRING = 60
+FUZZY = 40
+MIN_SIMILARITY = 0.3
+
+# Relative weight of the field a term comes from.
+FIELD_WEIGHTS = {"name": 1.0, "bin": 0.9, "description": 0.5}
+
+
+def _trigrams(term: str) -> set[str]:
+    """Return the trigrams of ``term``, padded so that its first and last characters weigh more."""
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _tokens(text: str) -> list[str]:
+    return [token for token in re.split(r"[^0-9a-z]+", text.lower()) if len(token) > 1]
+
+
+def build_search_data(packages: dict[str, PackageInfo]) -> dict:
+    """Build the prebuilt search structures for the given packages.
+
+    Args:
+        packages: Package manifests keyed by package name
+
+    Returns:
+        A JSON-serializable dict with the searchable ``terms`` (term to
+        ``[package, field]`` pairs), the ``trigrams`` index (trigram to terms)
+        and the ``provides`` reverse index (binary name to packages).
+    """
+    terms: dict[str, list[list[str]]] = {}
+    provides: dict[str, list[str]] = {}
+
+    def add(term: str, name: str, field: str) -> None:
+        postings = terms.setdefault(term.lower(), [])
+        if [name, field] not in postings:
+            postings.append([name, field])
+
+    for name, package in sorted(packages.items()):
+        add(name, name, "name")
+        for binary in package.bin.values():
+            add(binary, name, "bin")
+            provides.setdefault(binary, []).append(name)
+        if package.description is not None:
+            for token in _tokens(package.description):
+                add(token, name, "description")
+
+    trigrams: dict[str, list[str]] = {}
+    for term in terms:
+        for trigram in _trigrams(term):
+            trigrams.setdefault(trigram, []).append(term)
+    return {"terms": terms, "trigrams": trigrams, "provides": provides}
+
+
+class SearchEngine:
+    """Ranked search over package names, provided binaries and descriptions.
+
+    Matches are ranked exact, then prefix, then substring, then fuzzy, where
+    fuzzy matching uses the trigram similarity of the query and a term.
+    Prefixes are found by binary search over the sorted terms and the trigram
+    index limits scoring to terms sharing a trigram with the query, so a query
+    does not scan the whole catalog. Queries shorter than a trigram, whose
+    padded trigrams only match the ends of terms, scan the terms instead.
+    """
+
+    def __init__(self, data: dict, records: dict[str, PackageRecord]):
+        self.terms: dict[str, list[list[str]]] = data.get("terms", {})
+        self.trigrams: dict[str, list[str]] = data.get("trigrams", {})
+        self.reverse: dict[str, list[str]] = data.get("provides", {})
+        self.records = records
+        self._sorted_terms: list[str] | None = None
+
+    def _sorted(self) -> list[str]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.terms)
+        return self._sorted_terms
+
+    def _prefixed(self, query: str) -> list[str]:
+        """Return the terms starting with ``query``, using binary search over the sorted terms."""
+        terms = self._sorted()
+        start = bisect.bisect_left(terms, query)
+        end = bisect.bisect_left(terms, query + "\uffff", start)
+        return terms[start:end]
+
+    def search(self, pattern: str, limit: int | None = None) -> list[tuple[str, str]]:
+        """Return ``(package, matched term)`` pairs, best match first.
+
+        Packages not available in ``records`` (e.g. for another architecture)
+        are skipped.
+        """
+        query = pattern.lower()
+        if not query:
+            return [(name, name) for name in self.records][:limit]
+
+        if len(query) < 3:
+            shared: dict[str, int] = dict.fromkeys((term for term in self._sorted() if query in term), 0)
+        else:
+            shared = dict.fromkeys(self._prefixed(query), 0)
+        query_trigrams = _trigrams(query)
+        for trigram in query_trigrams:
+            for term in self.trigrams.get(trigram, ()):
+                shared[term] = shared.get(term, 0) + 1
+
+        best: dict[str, tuple[float, str]] = {}
+        for term, count in shared.items():
+            if term == query:
+                score = EXACT
+            elif term.startswith(query):
+                score = PREFIX
+            elif query in term:
+                score = SUBSTRING
+            else:
+                similarity = count / (len(query_trigrams) + len(term) - count)
+                if similarity < MIN_SIMILARITY:
+                    continue
+                score = FUZZY * similarity
+            for name, field in self.terms[term]:
+                if name not in self.records:
+                    continue
+                weighted = score * FIELD_WEIGHTS[field]
+                if name not in best or weighted > best[name][0]:
+                    best[name] = (weighted, term)
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(name, term) for name, (_, term) in ranked[:limit]]
+
+    def provides(self, binary: str) -> list[str]:
+        """Return the available packages that install an executable named ``binary``."""
+        return [name for name in self.reverse.get(binary, ()) if name in self.records]
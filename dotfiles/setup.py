@@ -3,6 +3,8 @@ from pathlib import Path
 import os
 import sys
 
+from dotfiles.path import DotFiles
+
 MARK_START = "# >>> dotfiles PATH >>>"
 MARK_END = "# <<< dotfiles PATH <<<"
 
@@ -27,19 +29,32 @@ def _get_candidate_profile_files() -> List[Path]:
     return result
 
 
-def _build_export_block(bin_dir: Path) -> str:
+def _build_export_block(bin_dir: Path, activate_script: Path) -> str:
+    """Build the profile block adding ``bin_dir`` to PATH and sourcing the activation script.
+
+    The activation script is a static file written on every install, so that
+    the per-package environment, completions and man pages cost a new shell
+    one ``source`` and no process.
+    """
     bin_posix = bin_dir.as_posix()
+    activate_posix = activate_script.as_posix()
     lines = [
         "",
         MARK_START,
         f'# Added by "dotfiles" on install. Do not edit between markers.',
         f'export PATH="{bin_posix}:$PATH"',
+        f'[ -f "{activate_posix}" ] && . "{activate_posix}"',
         MARK_END,
         "",
     ]
     return "\n".join(lines)
 
 
+def _get_activate_script(profile: Path) -> Path:
+    """Return the activation script for the shell reading ``profile``."""
+    return DotFiles.get_activate_script("zsh" if profile.name == ".zshrc" else "sh")
+
+
 def _remove_marked_block(text: str) -> str:
     """Remove our managed PATH block from the given profile text, if present."""
     if MARK_START not in text:
@@ -62,11 +77,11 @@ def _remove_marked_block(text: str) -> str:
 def install_path(bin_dir: Path) -> None:
     """Install by adding the project's bin directory to PATH in shell profiles."""
 
-    block = _build_export_block(bin_dir)
     updated_any = False
     created_in: List[Path] = []
 
     for profile in _get_candidate_profile_files():
+        block = _build_export_block(bin_dir, _get_activate_script(profile))
         try:
             if profile.exists():
                 original = profile.read_text(encoding="utf-8")
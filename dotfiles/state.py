@@ -0,0 +1,152 @@
+import json
+import os
+import pathlib
+import time
+
+from dotfiles.manifest import PackageRecord
+from dotfiles.path import DotFiles
+
+
+class InstalledState:
+    """Database of the installed packages, stored as a JSON file in the apps directory.
+
+    Every entry records the installed ``version``, the ``url`` and ``sha256``
+    of the archive it came from, the ``installed_at`` time, and the ``files``
+    (relative to the package directory) and ``symlinks`` (relative to the bin
+    directory) that the install created. The ``path`` of the version directory
+    below ``apps/.versions/<name>/``, the ``bin`` mapping it was linked with
+    and the ``activation`` entries (``env``, ``completions`` and ``man``) of
+    its manifest are kept too, and when another version replaces it, the
+    entry (without ``files``) moves to the package's ``history``, newest
+    last, so that it can be rolled back to.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None):
+        self.path = DotFiles.get_state_file() if path is None else path
+        self.packages: dict[str, dict] = self._read()
+
+    def get(self, name: str) -> dict | None:
+        return self.packages.get(name)
+
+    def is_current(self, name: str, record: PackageRecord) -> bool:
+        """Return True if ``name`` is installed from the same version and archive as ``record``."""
+        entry = self.packages.get(name)
+        if entry is None or entry.get("version") != record.version or entry.get("url") != record.url:
+            return False
+        if record.sha256 and entry.get("sha256") != record.sha256:
+            return False
+        return (DotFiles.get_app_dir() / name).is_dir()
+
+    def record(self, name: str, version: str, url: str, sha256: str | None, symlinks: list[str],
+               bin: dict[str, str] | None = None, path: str | None = None,
+               activation: PackageRecord | None = None) -> None:
+        """Record a freshly installed package, listing the files found in its directory.
+
+        The entry it replaces is pushed to the history if it was installed in
+        another version directory.
+
+        Args:
+            activation: Manifest record the package was installed from, whose
+                activation entries are kept for :meth:`installed_record`
+        """
+        previous = self.packages.get(name)
+        history = previous.get("history", []) if previous is not None else []
+        if previous is not None and previous.get("path") and previous.get("path") != path:
+            history = [*history, _without(previous, "files", "history")]
+        self.packages[name] = {
+            "version": version,
+            "url": url,
+            "sha256": sha256,
+            "installed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "files": _list_files(DotFiles.get_app_dir() / name),
+            "symlinks": symlinks,
+            "bin": bin,
+            "path": path,
+            "activation": _activation(activation) if activation is not None else None,
+            "history": history,
+        }
+
+    def installed_record(self, name: str) -> PackageRecord | None:
+        """Return the record the current version of ``name`` was installed from.
+
+        Only the archive, binaries and activation entries are recorded, which
+        is what the activation scripts are generated from.
+
+        Returns:
+            None if ``name`` is not installed or was installed before activation entries were recorded
+        """
+        entry = self.packages.get(name)
+        if entry is None or not entry.get("activation"):
+            return None
+        data = {
+            "version": entry["version"],
+            "architecture": {"installed": {"url": entry["url"], "sha256": entry["sha256"]}},
+            "bin": entry.get("bin") or {},
+            **entry["activation"],
+        }
+        return PackageRecord.from_manifest(name, data, "installed")
+
+    def rollback(self, name: str) -> dict:
+        """Make the newest history entry of ``name`` current, and the current entry its newest history entry.
+
+        Returns:
+            The entry that was current before
+        """
+        current = self.packages[name]
+        history = current.get("history", [])
+        if not history:
+            raise ValueError(f"No previous version of package `{name}` is recorded")
+        previous = history[-1]
+        self.packages[name] = {
+            **previous,
+            "files": _list_files(DotFiles.get_app_dir() / name),
+            "history": [*history[:-1], _without(current, "files", "history")],
+        }
+        return current
+
+    def trim_history(self, name: str, keep: int) -> list[dict]:
+        """Drop all but the ``keep`` newest history entries of ``name``, and return the dropped ones."""
+        entry = self.packages[name]
+        history = entry.get("history", [])
+        cut = max(0, len(history) - keep)
+        entry["history"] = history[cut:]
+        return history[:cut]
+
+    def remove(self, name: str) -> None:
+        self.packages.pop(name, None)
+
+    def save(self) -> None:
+        temp_file = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file.write_text(json.dumps({"packages": self.packages}, indent=2, sort_keys=True))
+        os.replace(temp_file, self.path)
+
+    def _read(self) -> dict[str, dict]:
+        try:
+            data = json.loads(self.path.read_bytes())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            raise RuntimeError(f"Corrupted installed-state database {self.path}: {e}") from e
+        return data.get("packages", {}) if isinstance(data, dict) else {}
+
+
+def _list_files(directory: pathlib.Path) -> list[str]:
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(root, filename), directory))
+    return sorted(files)
+
+
+def _activation(record: PackageRecord) -> dict:
+    return {
+        "env": dict(record.env),
+        "completions": {shell: completion if isinstance(completion, str) else list(completion)
+                        for shell, completion in record.completions.items()},
+        "man": list(record.man),
+    }
+
+
+def _without(entry: dict, *keys: str) -> dict:
+    return {key: value for key, value in entry.items() if key not in keys}
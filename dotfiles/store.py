@@ -0,0 +1,126 @@
+import os
+import pathlib
+import stat
+
+from dotfiles.cache import file_sha256
+from dotfiles.path import DotFiles
+
+
+class FileStore:
+    """Content-addressed store of the files of every installed version.
+
+    Each distinct file is kept once as ``<sha256[:2]>/<sha256>-<mode>`` and
+    the extracted versions below ``apps/.versions`` hold hard links to it,
+    so files that did not change between two versions of a package, or that
+    several packages ship, take disk space only once. The mode is part of the
+    key because hard links share it. A store object whose link count dropped
+    to one is no longer used by any version, and :meth:`prune` removes it.
+
+    Files of a deduplicated version also share their modification time with
+    the store object, i.e. with the first version that stored that content.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None):
+        self.path = DotFiles.get_store_dir() if path is None else path
+
+    def dedupe(self, directory: pathlib.Path, digests: dict[str, str] | None = None) -> tuple[int, int]:
+        """Replace the regular files below ``directory`` with hard links into the store.
+
+        Files new to the store are added to it. Empty files and files that are
+        already hard links (e.g. hard links of the archive itself) are left
+        alone. If the filesystem refuses hard links, deduplication stops and
+        the remaining files are kept as they are.
+
+        Args:
+            directory: Directory to deduplicate
+            digests: Filled with the SHA-256 of every file hashed, keyed by path relative to ``directory``
+
+        Returns:
+            The number of files replaced by a link and the bytes saved
+        """
+        linked = saved = 0
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode) or st.st_size == 0 or st.st_nlink > 1:
+                    continue
+                digest = file_sha256(path)
+                if digests is not None:
+                    digests[os.path.relpath(path, directory)] = digest
+                obj = self._object(digest, stat.S_IMODE(st.st_mode))
+                temp = f"{path}.{os.getpid()}.link"
+                try:
+                    os.link(obj, temp)
+                except FileNotFoundError:
+                    obj.parent.mkdir(parents=True, exist_ok=True)
+                    try:
+                        os.link(path, obj)
+                    except OSError:
+                        return linked, saved
+                    continue
+                except OSError:
+                    return linked, saved
+                os.replace(temp, path)
+                linked += 1
+                saved += st.st_size
+        return linked, saved
+
+    def evict(self, digest: str, mode: int) -> bool:
+        """Remove the object for ``digest`` and ``mode`` if its content no longer matches the digest.
+
+        A file of an installed version modified in place modifies the store
+        object it is a hard link to, and the object must not be linked to again.
+        The other versions linked to it are modified too; once a good copy is
+        back in the store, :meth:`link` restores them.
+
+        Returns:
+            True if the object was corrupted and removed
+        """
+        obj = self._object(digest, mode)
+        try:
+            if file_sha256(obj) == digest:
+                return False
+        except FileNotFoundError:
+            return False
+        obj.unlink(missing_ok=True)
+        return True
+
+    def link(self, digest: str, mode: int, path: str | os.PathLike) -> bool:
+        """Replace ``path`` with a hard link to the object for ``digest`` and ``mode``.
+
+        Returns:
+            False if there is no such object or the filesystem refuses hard links
+        """
+        temp = f"{path}.{os.getpid()}.link"
+        try:
+            os.link(self._object(digest, mode), temp)
+        except OSError:
+            return False
+        os.replace(temp, path)
+        return True
+
+    def prune(self) -> tuple[int, int]:
+        """Remove the store objects that no version links to anymore.
+
+        Returns:
+            The number of objects removed and their total size
+        """
+        removed = freed = 0
+        if not self.path.is_dir():
+            return removed, freed
+        for bucket in self.path.iterdir():
+            if not bucket.is_dir():
+                continue
+            for obj in bucket.iterdir():
+                st = obj.lstat()
+                if st.st_nlink == 1:
+                    obj.unlink(missing_ok=True)
+                    removed += 1
+                    freed += st.st_size
+            if not any(bucket.iterdir()):
+                bucket.rmdir()
+        return removed, freed
+
+    def _object(self, digest: str, mode: int) -> pathlib.Path:
+        return self.path / digest[:2] / f"{digest}-{mode:o}"
@@ -0,0 +1,429 @@
+"""Benchmarks of the install, extract, search and update hot paths.
+
+Everything runs against a throw-away dotfiles root and a local HTTP server
+serving synthetic archives, so results do not depend on the network or on
+the packages installed on this machine. Results are written as JSON and can
+be compared against a baseline to flag regressions::
+
+    python dotfiles/tools/benchmark.py -o baseline.json
+    python dotfiles/tools/benchmark.py --compare baseline.json
+"""
+import contextlib
+import functools
+import hashlib
+import http.server
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import re
+import resource
+import statistics
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+if __package__ in (None, ""):
+    # Run as a script: make the dotfiles package importable
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+
+from dotfiles.path import DotFiles  # noqa: E402
+
+RESULTS_VERSION = 1
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_CATALOG_SIZE = 5000
+DEFAULT_UPDATE_PACKAGES = 20
+FORMATS = (".tar.gz", ".tar.xz", ".zip")
+# name -> (number of members, size of each member in bytes)
+SIZES = {
+    "small": (1, 512 * 1024),
+    "medium": (200, 32 * 1024),
+    "large": (2000, 16 * 1024),
+}
+DEFAULT_SIZES = ("small", "medium")
+SEARCH_QUERIES = ("rip", "ripgrep", "fd", "neovim", "grp", "json", "zzz")
+
+
+def _member_data(rng: random.Random, size: int) -> bytes:
+    """Return half random, half repetitive bytes, compressing roughly like a real binary."""
+    words = b"".join(rng.choice((b"main ", b"init ", b"error ", b"\x00\x00\x00\x00", b"libc.so.6 "))
+                     for _ in range(size // 16))
+    return (rng.randbytes(size // 2) + words)[:size].ljust(size, b"\x00")
+
+
+def _write_archive(path: pathlib.Path, name: str, members: int, size: int) -> None:
+    """Write a synthetic archive holding ``name/bin/name`` plus ``members - 1`` data files."""
+    rng = random.Random(f"{path.name}")
+    files = [(f"{name}/bin/{name}", 0o755)] + [(f"{name}/share/{i // 100:03d}/file{i}.dat", 0o644)
+                                               for i in range(1, members)]
+    if path.name.endswith(".zip"):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for member, mode in files:
+                info = zipfile.ZipInfo(member, date_time=(2024, 1, 1, 0, 0, 0))
+                info.external_attr = mode << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, _member_data(rng, size))
+        return
+    with tarfile.open(path, "w:gz" if path.name.endswith(".tar.gz") else "w:xz") as archive:
+        for member, mode in files:
+            data = _member_data(rng, size)
+            info = tarfile.TarInfo(member)
+            info.size, info.mode, info.mtime = len(data), mode, 1704067200
+            archive.addfile(info, io.BytesIO(data))
+
+
+def _file_sha256(path: pathlib.Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _write_manifest(package_dir: pathlib.Path, name: str, manifest: dict) -> pathlib.Path:
+    path = package_dir / f"{name}.json"
+    path.write_text(json.dumps(manifest, indent=2))
+    return path
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def _serve(directory: pathlib.Path):
+    """Serve ``directory`` over HTTP/1.1 on a free local port and yield its base URL."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_Handler, directory=directory))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def _root(root: pathlib.Path):
+    """Point every dotfiles path below ``root`` instead of this checkout."""
+    (root / "dotfiles" / "package").mkdir(parents=True, exist_ok=True)
+    (root / "apps").mkdir(exist_ok=True)
+    (root / "bin").mkdir(exist_ok=True)
+    original = DotFiles.__dict__["get_root_dir"]
+    DotFiles.get_root_dir = staticmethod(lambda: root)
+    try:
+        yield root
+    finally:
+        DotFiles.get_root_dir = original
+
+
+def _read_proc(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _io_counters() -> tuple[int, int] | None:
+    """Return the bytes read and written by this process so far, sockets included (Linux only)."""
+    content = _read_proc("/proc/self/io")
+    if content is None:
+        return None
+    fields = dict(line.split(": ") for line in content.splitlines())
+    return int(fields["rchar"]), int(fields["wchar"])
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak resident set size of this process, if the kernel allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    """Return the peak resident set size in bytes, since the last reset if it succeeded."""
+    match = re.search(r"VmHWM:\s+(\d+) kB", _read_proc("/proc/self/status") or "")
+    if match:
+        return int(match.group(1)) * 1024
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _measure(run, setup=None, repeat: int = DEFAULT_REPEAT) -> dict:
+    """Time ``run`` ``repeat`` times, calling ``setup`` untimed before each run.
+
+    Returns:
+        The median and minimum wall time in seconds, plus the bytes read and
+        written and the peak RSS of the slowest-memory run
+    """
+    walls, read, written, peak = [], [], [], 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        _reset_peak_rss()
+        before = _io_counters()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            run()
+            walls.append(time.perf_counter() - start)
+        after = _io_counters()
+        if before is not None and after is not None:
+            read.append(after[0] - before[0])
+            written.append(after[1] - before[1])
+        peak = max(peak, _peak_rss())
+    return {
+        "wall": statistics.median(walls),
+        "wall_min": min(walls),
+        "runs": repeat,
+        "read_bytes": int(statistics.median(read)) if read else None,
+        "write_bytes": int(statistics.median(written)) if written else None,
+        "peak_rss": peak,
+    }
+
+
+def _bench_install(root: pathlib.Path, base_url: str, www: pathlib.Path, sizes: list[str], repeat: int,
+                   results: dict) -> None:
+    """Benchmark full installs (download, verify, extract, link) from an empty cache."""
+    from dotfiles.cache import ArchiveCache
+    from dotfiles.package_manager import PackageManager
+
+    names = []
+    for size in sizes:
+        for ext in FORMATS:
+            name = f"bench-{size}-{ext.lstrip('.').replace('.', '')}"
+            archive = www / f"{name}{ext}"
+            _write_archive(archive, name, *SIZES[size])
+            _write_manifest(root / "dotfiles" / "package", name, {
+                "description": f"Synthetic {size} {ext} archive",
+                "version": "1.0",
+                "architecture": {"x86_64": {"url": f"{base_url}/{archive.name}", "sha256": _file_sha256(archive)},
+                                 "aarch64": {"url": f"{base_url}/{archive.name}", "sha256": _file_sha256(archive)}},
+                "bin": {f"bin/{name}": name},
+                "extract": "all",
+            })
+            names.append((name, size, ext))
+
+    manager = PackageManager()
+    for name, size, ext in names:
+        for stream in (False, True) if ext != ".zip" else (False,):
+            key = f"install{'-stream' if stream else ''}/{ext.lstrip('.')}/{size}"
+            print(f"Running {key}")
+            results[key] = _measure(
+                lambda: manager.install([name], jobs=1, stream=stream, force=True),
+                setup=lambda: ArchiveCache().clear(), repeat=repeat)
+    batch = [name for name, _, _ in names]
+    print("Running install-batch")
+    results["install-batch"] = _measure(lambda: manager.install(batch, force=True),
+                                        setup=lambda: ArchiveCache().clear(), repeat=repeat)
+
+
+def _bench_extract(work: pathlib.Path, www: pathlib.Path, sizes: list[str], repeat: int, results: dict) -> None:
+    """Benchmark ``QuickInstallPackage._uncompress`` on local archives."""
+    from dotfiles.package import QuickInstallPackage
+
+    out = work / "extract"
+    out.mkdir()
+    for size in sizes:
+        for ext in FORMATS:
+            name = f"bench-{size}-{ext.lstrip('.').replace('.', '')}"
+            archive = www / f"{name}{ext}"
+            if not archive.exists():
+                _write_archive(archive, name, *SIZES[size])
+            key = f"extract/{ext.lstrip('.')}/{size}"
+            print(f"Running {key}")
+            results[key] = _measure(lambda: QuickInstallPackage._uncompress(str(archive), out, name), repeat=repeat)
+
+
+def _bench_search(root: pathlib.Path, catalog_size: int, repeat: int, results: dict) -> None:
+    """Benchmark loading the package index and searching a generated catalog."""
+    from dotfiles.package_manager import PackageManager
+
+    package_dir = root / "dotfiles" / "package"
+    rng = random.Random("catalog")
+    syllables = ("rip", "grep", "fd", "bat", "neo", "vim", "json", "jq", "tui", "git", "sh", "ctl", "lint", "fmt")
+    for i in range(catalog_size):
+        name = "".join(rng.choice(syllables) for _ in range(rng.randint(1, 3))) + f"-{i}"
+        _write_manifest(package_dir, name, {
+            "description": " ".join(rng.choice(syllables) for _ in range(8)),
+            "version": f"{rng.randint(0, 9)}.{rng.randint(0, 99)}.0",
+            "architecture": {"x86_64": {"url": f"https://example.invalid/{name}.tar.gz", "sha256": "0" * 64}},
+            "bin": {name: name.split("-")[0]},
+        })
+
+    def search_all() -> None:
+        manager = PackageManager()
+        for query in SEARCH_QUERIES:
+            manager.search(query, 20)
+
+    print("Running search/cold-index")
+    results["search/cold-index"] = _measure(search_all, setup=lambda: DotFiles.get_index_file().unlink(
+        missing_ok=True), repeat=repeat)
+    print("Running search/warm-index")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        search_all()
+    results["search/warm-index"] = _measure(search_all, repeat=repeat)
+
+
+def _bench_update(root: pathlib.Path, base_url: str, www: pathlib.Path, count: int, repeat: int,
+                  results: dict) -> None:
+    """Benchmark the ``ci_check_update`` loop, hashing assets and reading published checksums."""
+    from dotfiles.tools import ci_check_update
+
+    update_dir = root / "update"
+    update_dir.mkdir()
+    (www / "latest").write_text(json.dumps({"tag_name": "v2.0"}))
+    sums = []
+    for i in range(count):
+        for arch in ("x86_64", "aarch64"):
+            asset = www / f"upd{i}-2.0-{arch}.tar.gz"
+            _write_archive(asset, f"upd{i}", 1, 256 * 1024)
+            sums.append(f"{_file_sha256(asset)}  {asset.name}")
+    (www / "SHA256SUMS").write_text("\n".join(sums) + "\n")
+
+    def manifests(checksum: bool) -> list[pathlib.Path]:
+        paths = []
+        for i in range(count):
+            update = {
+                "check": {"url": f"{base_url}/latest", "regex": r"v([\d.]+)"},
+                "architecture": {arch: {"url": f"{base_url}/upd{i}-{{version}}-{arch}.tar.gz"}
+                                 for arch in ("x86_64", "aarch64")},
+            }
+            if checksum:
+                update["checksum"] = {"url": f"{base_url}/SHA256SUMS", "format": "sha256sum"}
+            paths.append(_write_manifest(update_dir, f"upd{i}", {
+                "version": "1.0",
+                "architecture": {arch: {"url": f"{base_url}/upd{i}-1.0-{arch}.tar.gz"}
+                                 for arch in ("x86_64", "aarch64")},
+                "bin": {f"upd{i}": f"upd{i}"},
+                "update": update,
+            }))
+        return paths
+
+    for mode in ("hash", "checksum"):
+        # Every run starts again from version 1.0, so that every package is updated
+        paths = manifests(mode == "checksum")
+
+        def setup() -> None:
+            manifests(mode == "checksum")
+            ci_check_update._get_text.cache_clear()
+
+        print(f"Running update/{mode}")
+        results[f"update/{mode}"] = _measure(
+            lambda: ci_check_update._update_packages(paths, ci_check_update.DEFAULT_JOBS), setup=setup,
+            repeat=repeat)
+
+
+def run(benchmarks: list[str], sizes: list[str], repeat: int, catalog_size: int, update_packages: int) -> dict:
+    """Run the selected benchmarks in a temporary root and return the results document."""
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="dotfiles-bench-") as temp:
+        work = pathlib.Path(temp)
+        www = work / "www"
+        www.mkdir()
+        with _serve(www) as base_url, _root(work / "root") as root:
+            if "install" in benchmarks:
+                _bench_install(root, base_url, www, sizes, repeat, results)
+            if "extract" in benchmarks:
+                _bench_extract(work, www, sizes, repeat, results)
+            if "update" in benchmarks:
+                _bench_update(root, base_url, www, update_packages, repeat, results)
+            if "search" in benchmarks:
+                _bench_search(root, catalog_size, repeat, results)
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """Print the change of every benchmark against ``baseline`` and return the regressed ones.
+
+    A benchmark regresses if its median wall time or its peak RSS grew by
+    more than ``threshold`` (a fraction). Benchmarks missing from either
+    side are listed but never flagged.
+    """
+    regressions = []
+    old_results, new_results = baseline.get("results", {}), current.get("results", {})
+    print(f"{'benchmark':<32} {'baseline':>10} {'current':>10} {'change':>8}  {'peak RSS':>8}")
+    for key in sorted(old_results.keys() | new_results.keys()):
+        old, new = old_results.get(key), new_results.get(key)
+        if old is None or new is None:
+            print(f"{key:<32} {'-' if old is None else _format_time(old['wall']):>10} "
+                  f"{'-' if new is None else _format_time(new['wall']):>10}")
+            continue
+        wall = new["wall"] / old["wall"] - 1 if old["wall"] else 0.0
+        rss = new["peak_rss"] / old["peak_rss"] - 1 if old.get("peak_rss") else 0.0
+        flags = [label for label, change in (("time", wall), ("memory", rss)) if change > threshold]
+        if flags:
+            regressions.append(key)
+        print(f"{key:<32} {_format_time(old['wall']):>10} {_format_time(new['wall']):>10} {wall:>+8.1%}  "
+              f"{rss:>+8.1%}" + (f"  REGRESSION ({', '.join(flags)})" if flags else ""))
+    return regressions
+
+
+def _format_time(seconds: float) -> str:
+    return f"{seconds * 1000:.1f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    all_benchmarks = ("install", "extract", "update", "search")
+    parser = argparse.ArgumentParser(description="Benchmark the install, extract, search and update hot paths")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"benchmarks to run: {', '.join(all_benchmarks)} (default: all)")
+    parser.add_argument("-o", "--output", type=pathlib.Path, help="write the results as JSON to this file")
+    parser.add_argument("--compare", type=pathlib.Path, metavar="BASELINE",
+                        help="compare the results against a previous results file and fail on regressions")
+    parser.add_argument("--results", type=pathlib.Path,
+                        help="compare this results file instead of running the benchmarks (needs --compare)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"relative slowdown flagged as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"runs per benchmark, the median is reported (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES),
+                        help=f"comma-separated archive sizes among {', '.join(SIZES)} "
+                             f"(default: {','.join(DEFAULT_SIZES)})")
+    parser.add_argument("--catalog", type=int, default=DEFAULT_CATALOG_SIZE,
+                        help=f"number of generated manifests to search (default: {DEFAULT_CATALOG_SIZE})")
+    parser.add_argument("--update-packages", type=int, default=DEFAULT_UPDATE_PACKAGES,
+                        help=f"number of generated manifests to update (default: {DEFAULT_UPDATE_PACKAGES})")
+    args = parser.parse_args()
+
+    if unknown := [name for name in args.benchmarks if name not in all_benchmarks]:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    sizes = [size for size in args.sizes.split(",") if size]
+    if unknown := [size for size in sizes if size not in SIZES]:
+        parser.error(f"unknown size: {', '.join(unknown)}")
+    if args.results is not None:
+        if args.compare is None:
+            parser.error("--results needs --compare")
+        document = json.loads(args.results.read_text())
+    else:
+        document = run(args.benchmarks or list(all_benchmarks), sizes, max(1, args.repeat), args.catalog,
+                       args.update_packages)
+        if args.output is not None:
+            args.output.write_text(json.dumps(document, indent=2, sort_keys=True))
+            print(f"Results written to {args.output}")
+    if args.compare is not None:
+        regressions = compare(json.loads(args.compare.read_text()), document, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+    elif args.output is None:
+        for key, result in document["results"].items():
+            print(f"{key:<32} {_format_time(result['wall']):>10}  peak RSS {result['peak_rss'] / 2 ** 20:.1f} MiB")
@@ -1,18 +1,103 @@
+import concurrent.futures
+import contextlib
 import pathlib
 import json
 import re
-import urllib.request
+import threading
+import os
+import sys
+import urllib.parse
 import hashlib
 
+if __package__ in (None, ""):
+    # Run as a script: make the dotfiles package importable
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+
+from dotfiles import trace  # noqa: E402
+from dotfiles.manifest import Checksum, PackageInfo, UpdateInfo  # noqa: E402
+from dotfiles.transport import get_transport  # noqa: E402
+
 PACKAGE_PATH = pathlib.Path(__file__).resolve().parent.parent / "package"
+ARCHITECTURES = ("x86_64", "i686", "aarch64", "arm")
+DEFAULT_JOBS = 8
+DEFAULT_PER_HOST = 4
+DEFAULT_PROBE_CACHE = pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")) \
+    / "dotfiles" / "update-probes.json"
+
+_host_limit = DEFAULT_PER_HOST
+_host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _host_slot(url: str):
+    """Limit the number of concurrent requests sent to the host of ``url``."""
+    host = urllib.parse.urlsplit(url).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.setdefault(host, threading.BoundedSemaphore(_host_limit))
+    with semaphore:
+        yield
+
+
+class ProbeCache:
+    """Persistent cache of version probes, keyed by check URL.
+
+    Each entry keeps the ``ETag`` and ``Last-Modified`` validators of the last
+    response together with the version found in it, so that the next probe
+    can be a conditional request answered by ``304 Not Modified``.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.entries: dict[str, dict] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, url: str, pattern: str) -> dict | None:
+        with self._lock:
+            entry = self.entries.get(url)
+        return entry if entry is not None and entry.get("regex") == pattern else None
+
+    def put(self, url: str, pattern: str, headers, version: str) -> None:
+        with self._lock:
+            self.entries[url] = {
+                "regex": pattern,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "version": version,
+            }
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.path.write_text(json.dumps(self.entries, indent=2, sort_keys=True))
+
+
+_probe_cache: ProbeCache | None = None
+_verify_checksums = False
+_transport = get_transport()
+# Small text files fetched by this run, keyed by URL
+_texts: dict[str, concurrent.futures.Future] = {}
+_texts_lock = threading.Lock()
 
 
-def _get_version(url: str, pattern: str) -> str:
+def _get_version(url: str, pattern: str, mode: str = "body") -> str:
     """Get version from URL using regex pattern.
 
+    In ``body`` mode the regex is searched in the response body. If a probe
+    cache is enabled, the request is conditional on the validators of the
+    previous response, and a ``304 Not Modified`` answer returns the version
+    found last time without downloading anything. In ``redirect`` mode a
+    ``HEAD`` request is sent and the regex is searched in the ``Location``
+    header of the redirect, e.g. from ``/releases/latest`` to
+    ``/releases/tag/v1.2.3``.
+
     Args:
         url: URL to fetch content from
         pattern: Regex pattern with one capture group
+        mode: Either ``body`` or ``redirect``
 
     Returns:
         Captured version string
@@ -20,12 +105,35 @@ def _get_version(url: str, pattern: str) -> str:
     Raises:
         Exception: If regex pattern doesn't match or request fails
     """
-    with urllib.request.urlopen(url) as response:
-        content = response.read().decode('utf-8')
-        match = re.search(pattern, content)
-        if not match:
-            raise Exception(f"No version match found for pattern: {pattern}")
-        return match.group(1)
+    if mode == "redirect":
+        with _host_slot(url), _transport.open(url, method="HEAD", follow_redirects=False) as response:
+            if response.status not in (301, 302, 303, 307, 308):
+                raise Exception(f"No redirect returned by {url}")
+            content = response.headers.get("Location", "")
+    elif mode == "body":
+        headers = {}
+        cached = _probe_cache.get(url, pattern) if _probe_cache is not None else None
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        with _host_slot(url), _transport.open(url, headers) as response:
+            if response.status == 304 and cached is not None:
+                return cached["version"]
+            if response.status != 200:
+                raise Exception(f"Unexpected status {response.status} from {url}")
+            content = response.read().decode('utf-8')
+            response_headers = response.headers
+    else:
+        raise ValueError(f"Unknown version check mode: {mode}")
+
+    match = re.search(pattern, content)
+    if not match:
+        raise Exception(f"No version match found for pattern: {pattern}")
+    if mode == "body" and _probe_cache is not None:
+        _probe_cache.put(url, pattern, response_headers, match.group(1))
+    return match.group(1)
 
 
 def _get_hash256(url: str) -> str:
@@ -41,79 +149,186 @@ def _get_hash256(url: str) -> str:
         Exception: If download or hash calculation fails
     """
     sha256_hash = hashlib.sha256()
-    with urllib.request.urlopen(url) as response:
+    with trace.span("hash", url=url) as span, _host_slot(url), _transport.open(url) as response:
         while True:
             data = response.read(8192)  # Read in 8KB chunks
             if not data:
                 break
             sha256_hash.update(data)
+            span.add("hashed_bytes", len(data))
     return sha256_hash.hexdigest()
 
 
-def _check_architecture(config: dict, arch: str) -> bool:
-    if ("update" not in config) or not isinstance(config["update"], dict):
-        return False
-    if ("architecture" not in config["update"]) or not isinstance(config["update"]["architecture"], dict):
-        return False
-    if (arch not in config["update"]["architecture"]) or not isinstance(config["update"]["architecture"][arch], dict):
-        return False
-    return True
-
-def _update_new_url_sha256(config:dict, arch: str, version: str):
-    url = config["update"]["architecture"][arch]["url"].format(version=version)
-    print(f"Downloading {url} for {arch} architecture")
-    config["architecture"][arch]["url"] = url
-    sha256 = _get_hash256(url)
-    config["architecture"][arch]["sha256"] = sha256
+def _update_new_url_sha256(config: dict, update: UpdateInfo, arch: str, version: str, sha256: str):
+    url = update.architecture[arch].format(version=version)
+    archive = config["architecture"].setdefault(arch, {})
+    archive["url"] = url
+    archive["sha256"] = sha256
     print(f"sha256({url})={sha256}")
 
-def _update_package_config(path: pathlib.Path) -> bool:
-    # Load configuration
+
+def _get_text(url: str) -> str:
+    """Fetch a small text file once per run, so a checksum list shared by all architectures is fetched once.
+
+    Threads asking for a file that is being fetched wait for that request.
+    A failed request is not remembered, so a later call tries again.
+    """
+    with _texts_lock:
+        future = _texts.get(url)
+        owner = future is None
+        if owner:
+            future = _texts[url] = concurrent.futures.Future()
+    if owner:
+        try:
+            with _host_slot(url), _transport.open(url) as response:
+                future.set_result(response.read().decode('utf-8'))
+        except BaseException as e:
+            with _texts_lock:
+                del _texts[url]
+            future.set_exception(e)
+    return future.result()
+
+
+def _get_published_hash256(checksum: Checksum, url: str, version: str) -> str:
+    """Get the SHA-256 of the asset at ``url`` from a checksum file published upstream.
+
+    Args:
+        checksum: The ``update.checksum`` block of the manifest. Its ``url`` is a
+            template accepting ``{version}``, ``{url}`` (the asset URL) and
+            ``{filename}`` (the asset file name). Its ``format`` is
+            ``sha256sum`` (lines of ``<hash>  <file name>``, as in
+            ``SHA256SUMS`` or ``checksums.txt``), ``hex`` (the file holds
+            the hash of a single asset, as in ``<asset>.sha256``) or
+            ``github-release`` (a release from the GitHub API, whose assets
+            list their ``sha256:`` digest).
+        url: URL of the asset
+        version: Version being updated to
+
+    Raises:
+        Exception: If the checksum file cannot be fetched or does not list the asset
+    """
+    filename = url.rsplit("/", 1)[-1]
+    checksum_url = checksum.url.format(version=version, url=url, filename=filename)
+    with trace.span("checksum", url=checksum_url):
+        content = _get_text(checksum_url)
+    fmt = checksum.format
+    if fmt == "sha256sum":
+        for line in content.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1].lstrip("*").rsplit("/", 1)[-1] == filename:
+                return fields[0].lower()
+    elif fmt == "hex":
+        match = re.search(r"\b[0-9a-fA-F]{64}\b", content)
+        if match:
+            return match.group(0).lower()
+    elif fmt == "github-release":
+        for asset in json.loads(content).get("assets", []):
+            digest = asset.get("digest") or ""
+            if asset.get("name") == filename and digest.startswith("sha256:"):
+                return digest.removeprefix("sha256:").lower()
+    else:
+        raise ValueError(f"Unknown checksum format: {fmt}")
+    raise Exception(f"No checksum for {filename} found in {checksum_url}")
+
+
+def _download_hash256(update: UpdateInfo, arch: str, version: str) -> str:
+    """Get the SHA-256 of an architecture's asset, preferring the checksum published upstream.
+
+    The asset itself is downloaded only if the manifest has no usable
+    ``update.checksum`` block, or to confirm the published checksum when
+    ``--verify-checksums`` is given.
+    """
+    url = update.architecture[arch].format(version=version)
+    sha256 = None
+    if update.checksum is not None:
+        try:
+            sha256 = _get_published_hash256(update.checksum, url, version)
+        except Exception as e:
+            print(f"Cannot use published checksum for {url}: {e}")
+    if sha256 is None or _verify_checksums:
+        print(f"Downloading {url} for {arch} architecture")
+        computed = _get_hash256(url)
+        if sha256 is not None and computed != sha256:
+            raise Exception(f"Published checksum {sha256} does not match sha256({url})={computed}")
+        sha256 = computed
+    return sha256
+
+
+def _update_package_config(path: pathlib.Path, downloads: concurrent.futures.Executor) -> bool:
+    """Check one package for a new version and update its manifest.
+
+    The assets of every architecture are hashed concurrently on
+    ``downloads``, then applied in the fixed order of ``ARCHITECTURES``, so
+    the manifest written is the same as with a sequential run.
+
+    Raises:
+        ManifestError: If the manifest is invalid
+    """
+    # Load configuration; the raw data is kept so that the manifest is rewritten with its keys in order
     config = json.loads(path.read_text())
-    if config["update"] is None or config["update"]["check"] is None:
-        return False
-    if config["update"]["check"]["url"] is None or config["update"]["check"]["regex"] is None:
-        return False
-    if config["update"]["architecture"] is None:
+    update = PackageInfo.from_manifest(path.stem, config).update
+    if update is None:
         return False
     # Check for new version
     print(f"Checking for update for {path.stem}")
-    new_version = _get_version(config["update"]["check"]["url"], config["update"]["check"]["regex"])
+    with trace.span("probe", package=path.stem):
+        new_version = _get_version(update.check.url, update.check.regex, update.check.mode)
     if new_version == config["version"]:
         return False
     # Update configuration
     print(f"Updating {path.stem} to version {new_version}")
     config["version"] = new_version
-    if _check_architecture(config, "x86_64"):
-        _update_new_url_sha256(config, "x86_64", new_version)
-    if _check_architecture(config, "i686"):
-        _update_new_url_sha256(config, "i686", new_version)
-    if _check_architecture(config, "aarch64"):
-        _update_new_url_sha256(config, "aarch64", new_version)
-    if _check_architecture(config, "arm"):
-        _update_new_url_sha256(config, "arm", new_version)
+    hashes = {
+        arch: downloads.submit(trace.wrap(_download_hash256), update, arch, new_version)
+        for arch in ARCHITECTURES
+        if arch in update.architecture
+    }
+    for arch, future in hashes.items():
+        _update_new_url_sha256(config, update, arch, new_version, future.result())
     with open(path, 'w') as f:
         json.dump(config, f, indent=2)
     return True
 
 
-def update_all():
-    for json_file in PACKAGE_PATH.glob("*.json"):
-        if _update_package_config(json_file):
-            print(f"Updated {json_file}")
-        else:
-            print(f"No update needed for {json_file}")
+def _update_packages(paths: list[pathlib.Path], jobs: int) -> bool:
+    """Update the given manifests concurrently and report the results in path order.
+
+    Returns:
+        True if every package was checked successfully
+    """
+    ok = True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as probes, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as downloads:
+        futures = {path: probes.submit(trace.wrap(_update_package_config), path, downloads) for path in sorted(paths)}
+        for path, future in futures.items():
+            try:
+                updated = future.result()
+            except Exception as e:
+                ok = False
+                print(f"Failed to update {path}: {e}")
+                continue
+            if updated:
+                print(f"Updated {path}")
+            else:
+                print(f"No update needed for {path}")
+    return ok
+
 
+def update_all(jobs: int = DEFAULT_JOBS) -> bool:
+    return _update_packages(list(PACKAGE_PATH.glob("*.json")), jobs)
 
-def update_package(pattern: str):
+
+def _find_package(pattern: str) -> pathlib.Path | None:
     pattern_lower = pattern.lower()
-    for json_file in PACKAGE_PATH.glob("*.json"):
+    for json_file in sorted(PACKAGE_PATH.glob("*.json")):
         if pattern_lower in json_file.stem.lower():
-            if _update_package_config(json_file):
-                print(f"Updated {json_file}")
-            else:
-                print(f"No update needed for {json_file}")
-            return
+            return json_file
+    return None
+
+
+def update_package(pattern: str, jobs: int = DEFAULT_JOBS) -> bool:
+    json_file = _find_package(pattern)
+    return True if json_file is None else _update_packages([json_file], jobs)
 
 
 if __name__ == "__main__":
@@ -121,10 +336,36 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Update package versions')
     parser.add_argument('packages', nargs='*', help='package names to update (updates all if none specified)')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f'number of concurrent requests (default: {DEFAULT_JOBS})')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help=f'maximum concurrent requests to one host (default: {DEFAULT_PER_HOST})')
+    parser.add_argument('--probe-cache', type=pathlib.Path, default=DEFAULT_PROBE_CACHE,
+                        help=f'file caching version probe validators (default: {DEFAULT_PROBE_CACHE})')
+    parser.add_argument('--no-probe-cache', action='store_true', help='always fetch version probes in full')
+    parser.add_argument('--verify-checksums', action='store_true',
+                        help='also download assets with a published checksum to confirm it')
+    parser.add_argument('--trace', action='store_true', help='time every phase and print a summary to stderr')
+    parser.add_argument('--trace-format', choices=trace.FORMATS,
+                        help='trace output: human (default), chrome or jsonl; implies --trace')
+    parser.add_argument('--trace-file', help='write the trace to this file; implies --trace')
     args = parser.parse_args()
-
-    if not args.packages:
-        update_all()
+    if args.trace or args.trace_format or args.trace_file:
+        trace.enable(args.trace_format, args.trace_file)
     else:
-        for package in args.packages:
-            update_package(package)
+        trace.enable_from_env()
+    _verify_checksums = args.verify_checksums
+    _host_limit = max(1, args.per_host)
+    if not args.no_probe_cache:
+        _probe_cache = ProbeCache(args.probe_cache)
+
+    with trace.span("update"):
+        if not args.packages:
+            success = update_all(args.jobs)
+        else:
+            matches = [_find_package(package) for package in args.packages]
+            success = _update_packages(list(dict.fromkeys(path for path in matches if path is not None)), args.jobs)
+    trace.close()
+    if _probe_cache is not None:
+        _probe_cache.save()
+    sys.exit(0 if success else 1)
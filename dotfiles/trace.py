@@ -0,0 +1,271 @@
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+FORMATS = ("human", "chrome", "jsonl")
+DEFAULT_CHROME_FILE = "dotfiles-trace.json"
+# Values of DOTFILES_TRACE turning tracing on in the human format, or off
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("", "0", "false", "no", "off")
+
+_tracer: "Tracer | None" = None
+_local = threading.local()
+
+
+class Span:
+    """A timed phase of an operation, nested below the span active when it was entered.
+
+    Counters (e.g. bytes downloaded) are summed per span with :meth:`add`.
+    """
+
+    __slots__ = ("tracer", "name", "path", "attrs", "counters", "start", "end", "thread")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: "Span | None", attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.path = (*parent.path, name) if parent is not None else (name,)
+        self.attrs = attrs
+        self.counters: dict[str, int] = {}
+        self.start = self.end = 0
+        self.thread = 0
+
+    def add(self, counter: str, amount: int) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        _stack().append(self)
+        self.thread = threading.get_native_id()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.tracer.finish(self)
+
+
+class _NullSpan:
+    """The span returned while tracing is off: every operation is a no-op."""
+
+    __slots__ = ()
+
+    def add(self, counter: str, amount: int) -> None:
+        pass
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _stack() -> list[Span]:
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+class Tracer:
+    """Collects finished spans and writes them out.
+
+    ``jsonl`` writes one JSON object per span as soon as it ends, so a
+    trace survives a crash; ``human`` and ``chrome`` write everything at
+    :meth:`close`.
+
+    Args:
+        fmt: One of ``human``, ``chrome`` or ``jsonl``
+        path: File to write to; standard error if None, except for ``chrome``
+            which defaults to ``dotfiles-trace.json``
+    """
+
+    def __init__(self, fmt: str = "human", path: str | None = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown trace format: {fmt}")
+        self.format = fmt
+        self.path = DEFAULT_CHROME_FILE if path is None and fmt == "chrome" else path
+        self.origin = time.perf_counter_ns()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._out = None
+        if fmt == "jsonl":
+            self._out = open(self.path, "a", buffering=1) if self.path else sys.stderr
+
+    def finish(self, span: Span) -> None:
+        if self._out is not None:
+            line = self._jsonl(span)
+            with self._lock:
+                self._out.write(line + "\n")
+        else:
+            with self._lock:
+                self.spans.append(span)
+
+    def close(self) -> None:
+        if self.format == "human":
+            text = self._summary()
+            if self.path:
+                with open(self.path, "w") as f:
+                    f.write(text)
+            else:
+                sys.stderr.write(text)
+        elif self.format == "chrome":
+            self._write_chrome()
+        elif self._out is not sys.stderr:
+            self._out.close()
+
+    def _jsonl(self, span: Span) -> str:
+        import json
+
+        return json.dumps({
+            "name": span.name,
+            "path": "/".join(span.path),
+            "start": (span.start - self.origin) / 1e9,
+            "duration": (span.end - span.start) / 1e9,
+            "pid": os.getpid(),
+            "thread": span.thread,
+            "attrs": span.attrs,
+            "counters": span.counters,
+        }, default=str)
+
+    def _write_chrome(self) -> None:
+        import json
+
+        events = [{
+            "name": span.name,
+            "cat": span.path[0],
+            "ph": "X",
+            "ts": (span.start - self.origin) / 1000,
+            "dur": (span.end - span.start) / 1000,
+            "pid": os.getpid(),
+            "tid": span.thread,
+            "args": {**span.attrs, **span.counters},
+        } for span in self.spans]
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+        print(f"Trace written to {self.path}", file=sys.stderr)
+
+    def _summary(self) -> str:
+        """Aggregate the spans by path into an indented tree of call counts, durations and counters."""
+        from dotfiles.cache import format_size
+
+        totals: dict[tuple[str, ...], list] = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            entry = totals.setdefault(span.path, [0, 0, {}])
+            entry[0] += 1
+            entry[1] += span.end - span.start
+            for counter, amount in span.counters.items():
+                entry[2][counter] = entry[2].get(counter, 0) + amount
+        wall = max((span.end for span in self.spans), default=self.origin) - self.origin
+        lines = [f"Trace: {len(self.spans)} spans in {wall / 1e9:.3f} s"]
+        for path, (count, duration, counters) in totals.items():
+            label = "  " * len(path) + path[-1] + (f" x{count}" if count > 1 else "")
+            details = ", ".join(f"{format_size(amount) if counter.endswith('bytes') else amount} "
+                                f"{counter.removesuffix('_bytes').replace('_', ' ')}"
+                                for counter, amount in sorted(counters.items()))
+            lines.append(f"{label:<40} {duration / 1e9:9.3f} s" + (f"  {details}" if details else ""))
+        return "\n".join(lines) + "\n"
+
+
+def span(name: str, **attrs) -> Span | _NullSpan:
+    """Return a context manager timing the phase ``name``, nested below the current span."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, current(), attrs)
+
+
+def record(name: str, start: int, end: int, **attrs) -> None:
+    """Record a phase that already ended, with ``time.perf_counter_ns()`` bounds."""
+    if _tracer is None:
+        return
+    finished = Span(_tracer, name, current(), attrs)
+    finished.start, finished.end, finished.thread = start, end, threading.get_native_id()
+    _tracer.finish(finished)
+
+
+def add(counter: str, amount: int) -> None:
+    """Add ``amount`` to a counter of the current span."""
+    if _tracer is None:
+        return
+    active = current()
+    if active is not None:
+        active.add(counter, amount)
+
+
+def current() -> Span | None:
+    stack = _stack() if _tracer is not None else None
+    return stack[-1] if stack else None
+
+
+def wrap(function: Callable) -> Callable:
+    """Bind ``function`` to the current span, so that its spans nest there when run on a worker thread."""
+    parent = current()
+    if parent is None:
+        return function
+
+    def run(*args, **kwargs):
+        stack = _stack()
+        stack.append(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.remove(parent)
+
+    return run
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def enable(fmt: str | None = None, path: str | None = None) -> None:
+    """Start tracing, with settings defaulting to ``DOTFILES_TRACE`` and ``DOTFILES_TRACE_FILE``.
+
+    ``DOTFILES_TRACE`` is a format name, or ``1`` (or ``true``, ``yes``,
+    ``on``) for ``human``.
+    """
+    global _tracer
+    if fmt is None:
+        fmt = _env_format() or "human"
+    _tracer = Tracer(fmt, path or os.environ.get("DOTFILES_TRACE_FILE") or None)
+
+
+def enable_from_env() -> None:
+    """Start tracing if the ``DOTFILES_TRACE`` environment variable asks for it."""
+    if _env_format() is not None:
+        enable()
+
+
+def _env_format() -> str | None:
+    """Return the format ``DOTFILES_TRACE`` asks for, or None if it is unset, off or not understood."""
+    value = os.environ.get("DOTFILES_TRACE", "").strip()
+    if value in FORMATS:
+        return value
+    if value.lower() in _TRUE:
+        return "human"
+    if value.lower() not in _FALSE:
+        print(f"Ignoring DOTFILES_TRACE={value}: expected 1, 0 or one of {', '.join(FORMATS)}", file=sys.stderr)
+    return None
+
+
+def close() -> None:
+    """Stop tracing and write the trace out."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
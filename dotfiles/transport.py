@@ -0,0 +1,325 @@
+import base64
+import dataclasses
+import http.client
+import io
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections.abc import Callable
+
+from dotfiles import trace
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 8
+MAX_REDIRECTS = 10
+_DRAIN_LIMIT = 64 * 1024
+USER_AGENT = "dotfiles"
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+_RETRY_CODES = (429, 500, 502, 503, 504)
+_IDEMPOTENT_METHODS = ("GET", "HEAD")
+# Errors raised when a request is sent on a pooled connection the server has already closed
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                 http.client.BadStatusLine)
+
+
+@dataclasses.dataclass
+class RequestTiming:
+    """Timing of one request, from the first connection attempt to the end of the response body.
+
+    All durations are in seconds. ``connect`` is zero when every hop reused a
+    pooled connection.
+    """
+    method: str
+    url: str
+    status: int = 0
+    reused: bool = False
+    redirects: int = 0
+    retries: int = 0
+    connect: float = 0.0
+    wait: float = 0.0
+    total: float = 0.0
+    bytes: int = 0
+    started: float = dataclasses.field(default_factory=time.perf_counter, repr=False)
+
+
+def _proxy_for(scheme: str, host: str) -> str | None:
+    """Return the proxy URL to use for ``scheme://host``, from the ``*_proxy`` environment variables."""
+    proxies = urllib.request.getproxies()
+    # An http_proxy alone has always been used for HTTPS downloads too
+    proxy = proxies.get(scheme) or (proxies.get("http") if scheme == "https" else None)
+    if proxy is None or urllib.request.proxy_bypass(host):
+        return None
+    return proxy if "://" in proxy else f"http://{proxy}"
+
+
+def _traced_create_connection(address: tuple[str, int], timeout: float | None, source_address=None) -> socket.socket:
+    """``socket.create_connection`` with name resolution and the TCP connection traced separately."""
+    host, port = address
+    with trace.span("dns", host=host):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    with trace.span("connect", host=host):
+        error = None
+        for *_, sockaddr in addresses:
+            try:
+                return socket.create_connection(sockaddr[:2], timeout, source_address)
+            except OSError as e:
+                error = e
+        raise error or OSError(f"Cannot resolve {host}")
+
+
+class Response:
+    """A response whose connection goes back to the pool once the body has been read and closed.
+
+    It offers the subset of ``http.client.HTTPResponse`` used by the callers:
+    ``status``, ``headers``, ``read()``, ``geturl()`` and the context manager
+    protocol.
+    """
+
+    def __init__(self, transport: "Transport", key: tuple, connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse, url: str, timing: RequestTiming):
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.timing = timing
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._response.read(None if size is None or size < 0 else size)
+        self.timing.bytes += len(data)
+        return data
+
+    def geturl(self) -> str:
+        return self.url
+
+    def close(self) -> None:
+        if self._connection is None:
+            return
+        self._release()
+        self.timing.total = time.perf_counter() - self.timing.started
+        if trace.enabled():
+            trace.record("http", int(self.timing.started * 1e9), time.perf_counter_ns(), method=self.timing.method,
+                         url=self.timing.url, status=self.timing.status, reused=self.timing.reused,
+                         redirects=self.timing.redirects, bytes=self.timing.bytes)
+        self._transport._complete(self.timing)
+
+    def _release(self) -> None:
+        """Give the connection back to the pool if the whole body was read, or close it."""
+        if self._connection is None:
+            return
+        # A few bytes left, e.g. the empty body of a HEAD request, are worth reading to keep the connection
+        if not self._response.isclosed() and self._response.length is not None \
+                and self._response.length <= _DRAIN_LIMIT:
+            try:
+                self._response.read()
+            except (OSError, http.client.HTTPException):
+                pass
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._transport._release(self._key, self._connection, reusable)
+        self._connection = None
+
+    def __enter__(self) -> "Response":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class Transport:
+    """HTTP client keeping persistent connections per host, shared by the installer and the updater.
+
+    Idle keep-alive connections are pooled per scheme, host, port and proxy,
+    so consecutive requests to the same host (batch installs, the segments of
+    a download, update checks) skip the TCP and TLS handshakes. Redirects
+    are followed on pooled connections as well. The ``http_proxy``,
+    ``https_proxy`` and ``no_proxy`` environment variables are honored.
+
+    Idempotent requests are retried with exponential backoff when the
+    connection fails before a response arrives or the server answers with a
+    transient status (429, 5xx). A request failing on a connection that sat
+    idle in the pool is replayed on a fresh one immediately.
+
+    Statuses of 400 and above raise ``urllib.error.HTTPError``, as with
+    ``urllib.request.urlopen``; redirects that are not followed and
+    ``304 Not Modified`` are returned.
+
+    Args:
+        timeout: Socket timeout in seconds
+        retries: Number of retries after the first attempt
+        pool_size: Maximum number of idle connections kept per host
+        on_complete: Called with the :class:`RequestTiming` of every request
+            once its response is closed
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 pool_size: int = DEFAULT_POOL_SIZE, on_complete: Callable[[RequestTiming], None] | None = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.on_complete = on_complete
+        self._idle: dict[tuple, list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def open(self, url: str, headers: dict[str, str] | None = None, method: str = "GET",
+             timeout: float | None = None, follow_redirects: bool = True) -> Response:
+        """Send a request and return its response, following redirects unless told otherwise.
+
+        Raises:
+            urllib.error.HTTPError: If the final response has a status of 400 or above
+            urllib.error.URLError: If no connection can be established
+        """
+        timing = RequestTiming(method, url)
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._send(method, url, headers, timeout, timing)
+            timing.status = response.status
+            if response.status in _REDIRECT_CODES and follow_redirects and "Location" in response.headers:
+                url = urllib.parse.urljoin(url, response.headers["Location"])
+                if response.status == 303 or (response.status in (301, 302) and method not in _IDEMPOTENT_METHODS):
+                    method = "GET"
+                response._release()
+                timing.redirects += 1
+                continue
+            if response.status >= 400:
+                body = response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers,
+                                             io.BytesIO(body))
+            return response
+        raise urllib.error.URLError(f"Too many redirects from {timing.url}")
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _send(self, method: str, url: str, headers: dict[str, str], timeout: float | None,
+              timing: RequestTiming) -> Response:
+        """Send one request, retrying transient failures."""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise urllib.error.URLError(f"Unsupported URL scheme: {url}")
+        proxy = _proxy_for(parts.scheme, parts.hostname or "")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port, proxy)
+        target = url if proxy and parts.scheme == "http" else (parts.path or "/") + (
+            f"?{parts.query}" if parts.query else "")
+        headers = {"Host": parts.netloc.rpartition("@")[2], "User-Agent": USER_AGENT, **headers}
+        if proxy and parts.scheme == "http":
+            headers.update(self._proxy_headers(proxy))
+
+        attempt = 0
+        while True:
+            connection, reused = self._acquire(key, timeout)
+            timing.reused = reused and (timing.reused or not timing.redirects)
+            begin = time.perf_counter()
+            try:
+                if connection.sock is None:
+                    # DNS and TCP show up as nested spans; the rest of this one is the TLS handshake
+                    with trace.span("open connection", host=parts.hostname):
+                        connection.connect()
+                    timing.connect += time.perf_counter() - begin
+                connection.request(method, target, headers=headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused and isinstance(e, _STALE_ERRORS):
+                    continue
+                attempt += 1
+                if method not in _IDEMPOTENT_METHODS or attempt > self.retries:
+                    if isinstance(e, (TimeoutError, http.client.HTTPException)):
+                        raise
+                    raise urllib.error.URLError(e) from e
+                timing.retries += 1
+                time.sleep(self._backoff(attempt))
+                continue
+            timing.wait += time.perf_counter() - begin
+            wrapped = Response(self, key, connection, response, url, timing)
+            if response.status in _RETRY_CODES and method in _IDEMPOTENT_METHODS and attempt < self.retries:
+                attempt += 1
+                timing.retries += 1
+                wrapped._release()
+                time.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
+                continue
+            return wrapped
+
+    def _acquire(self, key: tuple, timeout: float | None) -> tuple[http.client.HTTPConnection, bool]:
+        """Take an idle connection to ``key`` from the pool, or create a new unconnected one."""
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            idle = self._idle.get(key)
+            connection = idle.pop() if idle else None
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+
+        scheme, host, port, proxy = key
+        if proxy is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connection = cls(host, port, timeout=timeout)
+        else:
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            proxy_port = proxy_parts.port or (443 if proxy_parts.scheme == "https" else 80)
+            if scheme == "http":
+                connection = http.client.HTTPConnection(proxy_parts.hostname, proxy_port, timeout=timeout)
+            else:
+                connection = http.client.HTTPSConnection(proxy_parts.hostname, proxy_port, timeout=timeout)
+                connection.set_tunnel(host, port, headers=self._proxy_headers(proxy))
+        if trace.enabled():
+            connection._create_connection = _traced_create_connection
+        return connection, False
+
+    def _release(self, key: tuple, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def _complete(self, timing: RequestTiming) -> None:
+        if self.on_complete is not None:
+            self.on_complete(timing)
+
+    @staticmethod
+    def _proxy_headers(proxy: str) -> dict[str, str]:
+        parts = urllib.parse.urlsplit(proxy)
+        if parts.username is None:
+            return {}
+        credentials = f"{urllib.parse.unquote(parts.username)}:{urllib.parse.unquote(parts.password or '')}"
+        return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode()).decode()}
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: str | None = None) -> float:
+        if retry_after is not None and retry_after.isdigit():
+            return min(int(retry_after), 30)
+        return min(2 ** (attempt - 1) * 0.5, 8)
+
+
+_default: Transport | None = None
+_default_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """Return the transport shared by every download of this process."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Transport(timeout=float(os.environ.get("DOTFILES_TIMEOUT", DEFAULT_TIMEOUT)))
+        return _default
@@ -0,0 +1,164 @@
+import errno
+import os
+import pathlib
+import sys
+
+from dotfiles.lock import FileLock
+from dotfiles.path import DotFiles
+
+# Unlinking is bound by filesystem latency rather than CPU, so more threads than CPUs pay off
+DEFAULT_WORKERS = min(16, (os.cpu_count() or 1) * 4)
+# Number of files unlinked by one task of the pool
+BATCH_SIZE = 256
+_LOCK_NAME = ".lock"
+# Run by the detached process, with the source directory and the trash directory as arguments
+_EMPTY_SCRIPT = ("import pathlib, sys; sys.path.insert(0, sys.argv[1]); "
+                 "from dotfiles.trash import Trash; Trash(pathlib.Path(sys.argv[2])).reclaim()")
+
+
+class Trash:
+    """Directory that removed trees are renamed into, so that removing them returns immediately.
+
+    :meth:`discard` is a single rename within the apps directory. The trees
+    are deleted later by :meth:`empty`, usually in a detached process started
+    by :meth:`empty_in_background` once the command is done, which then prunes
+    the store objects the deleted trees were the last links to. Deletion happens
+    in place inside the trash, so a run that gets interrupted leaves a
+    partial tree that the next run finishes, and a lock file makes a second
+    run skip rather than race with one in progress.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None):
+        self.path = DotFiles.get_trash_dir() if path is None else path
+
+    def discard(self, path: pathlib.Path) -> None:
+        """Move ``path`` into the trash; it no longer exists at its location when this returns."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(path, self.path / f"{path.name}-{os.urandom(4).hex()}")
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            import shutil
+
+            # Only a tree on another filesystem, e.g. a bind mount, cannot be renamed into the trash
+            shutil.rmtree(path)
+
+    def is_empty(self) -> bool:
+        try:
+            with os.scandir(self.path) as it:
+                return not any(entry.name != _LOCK_NAME for entry in it)
+        except FileNotFoundError:
+            return True
+
+    def empty(self, workers: int | None = None, wait: bool = False) -> int:
+        """Delete the trees in the trash, unlinking their files on a pool of threads.
+
+        Returns at once if another process is already emptying the trash,
+        unless ``wait`` is set. Trees discarded while it runs are deleted too.
+        A tree that cannot be deleted completely stays in the trash.
+
+        Args:
+            wait: Wait for another process emptying the trash, then delete what it left
+
+        Returns:
+            The number of trees deleted
+        """
+        import concurrent.futures
+
+        if self.is_empty():
+            return 0
+        lock = FileLock(self.path / _LOCK_NAME)
+        if wait:
+            lock.acquire()
+        elif not lock.try_acquire():
+            return 0
+        removed = 0
+        failed: set[str] = set()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers or DEFAULT_WORKERS,
+                                                       thread_name_prefix="trash") as pool:
+                while True:
+                    with os.scandir(self.path) as it:
+                        entries = [entry.path for entry in it
+                                   if entry.name != _LOCK_NAME and entry.path not in failed]
+                    if not entries:
+                        break
+                    for path in entries:
+                        try:
+                            _delete_tree(path, pool)
+                        except OSError:
+                            failed.add(path)
+                            continue
+                        removed += 1
+        finally:
+            lock.release()
+        return removed
+
+    def reclaim(self) -> None:
+        """Empty the trash, then prune the store objects that only the deleted trees linked to.
+
+        Files of a tree in the trash are still hard links to the store, so
+        the store can only be pruned once the trash is empty. Pruning takes
+        the apps lock and is left to the next run or ``gc`` if another
+        command holds it.
+        """
+        from dotfiles.store import FileStore
+
+        if not self.empty():
+            return
+        lock = FileLock(DotFiles.get_lock_file())
+        if not lock.try_acquire():
+            return
+        try:
+            FileStore().prune()
+        finally:
+            lock.release()
+
+    def empty_in_background(self) -> None:
+        """Start a detached process running :meth:`reclaim`, unless the trash is empty."""
+        if self.is_empty():
+            return
+        import subprocess
+
+        source_dir = pathlib.Path(__file__).resolve().parent.parent
+        subprocess.Popen([sys.executable, "-c", _EMPTY_SCRIPT, str(source_dir), str(self.path)],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+
+def _delete_tree(path: str, pool) -> None:
+    """Delete a tree, scanning it on this thread while ``pool`` unlinks its files in batches."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        _unlink([path])
+        return
+    directories = []
+    pending = []
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        if not os.access(directory, os.W_OK | os.X_OK):
+            os.chmod(directory, 0o700)
+        directories.append(directory)
+        files = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    files.append(entry.path)
+        for start in range(0, len(files), BATCH_SIZE):
+            pending.append(pool.submit(_unlink, files[start:start + BATCH_SIZE]))
+    for future in pending:
+        future.result()
+    # Every directory was listed after its parent, so this removes children first
+    for directory in reversed(directories):
+        os.rmdir(directory)
+
+
+def _unlink(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,191 @@
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import pathlib
+import shutil
+import stat
+import tempfile
+from collections.abc import Callable
+
+from dotfiles.path import DotFiles
+
+MANIFEST_VERSION = 1
+# hashlib releases the GIL while hashing, so threads hash files in parallel
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+MISSING = "missing"
+MODIFIED = "modified"
+MODE_CHANGED = "mode changed"
+LINK_CHANGED = "link changed"
+UNEXPECTED = "unexpected file"
+
+
+def hash_file(path: str | pathlib.Path) -> str:
+    """Return the SHA-256 hex digest of a file, hashing a memory map of it rather than copies of its blocks."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.sha256(data).hexdigest()
+
+
+def build_manifest(directory: pathlib.Path, digests: dict[str, str] | None = None,
+                   workers: int | None = None) -> dict[str, dict]:
+    """Record every file and symlink below ``directory``, keyed by path relative to it.
+
+    Regular files are recorded with their ``size``, ``mode``, ``mtime`` (in
+    nanoseconds) and ``sha256``, and symlinks with their ``link`` target.
+
+    Args:
+        digests: Digests already computed, e.g. by :meth:`dotfiles.store.FileStore.dedupe`,
+            keyed like the result; the other files are hashed on a pool of ``workers`` threads
+    """
+    digests = digests or {}
+    files: dict[str, dict] = {}
+    for root, dirnames, filenames in os.walk(directory):
+        # Symlinks to directories are listed with the directories, and not followed
+        for filename in filenames + [name for name in dirnames if os.path.islink(os.path.join(root, name))]:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, directory)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                files[relative] = {"link": os.readlink(path)}
+            elif stat.S_ISREG(st.st_mode):
+                files[relative] = {"size": st.st_size, "mode": stat.S_IMODE(st.st_mode), "mtime": st.st_mtime_ns,
+                                   "sha256": digests.get(relative)}
+    unhashed = [relative for relative, info in files.items() if "sha256" in info and info["sha256"] is None]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or DEFAULT_WORKERS) as executor:
+        for relative, digest in zip(unhashed, executor.map(hash_file, (directory / path for path in unhashed))):
+            files[relative]["sha256"] = digest
+    return files
+
+
+def write_manifest(path: pathlib.Path, files: dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_file.write_text(json.dumps({"version": MANIFEST_VERSION, "files": files}, sort_keys=True))
+    os.replace(temp_file, path)
+
+
+def read_manifest(path: pathlib.Path) -> dict[str, dict] | None:
+    """Return the files recorded in a file manifest, or None if there is none.
+
+    Raises:
+        RuntimeError: If the file manifest is corrupted
+    """
+    try:
+        data = json.loads(path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise RuntimeError(f"Corrupted file manifest {path}: {e}") from e
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION or not isinstance(data.get("files"), dict):
+        raise RuntimeError(f"Corrupted file manifest {path}")
+    return data["files"]
+
+
+def check_file(path: pathlib.Path, expected: dict, fast: bool = False) -> str | None:
+    """Compare a file with its manifest record and return what is wrong with it, or None.
+
+    With ``fast``, a regular file is only compared by mode, size and
+    modification time, so content changed in place without touching the
+    modification time goes unnoticed.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return MISSING
+    if "link" in expected:
+        return None if stat.S_ISLNK(st.st_mode) and os.readlink(path) == expected["link"] else LINK_CHANGED
+    if not stat.S_ISREG(st.st_mode) or st.st_size != expected["size"]:
+        return MODIFIED
+    if fast and st.st_mtime_ns != expected["mtime"]:
+        return MODIFIED
+    if not fast and hash_file(path) != expected["sha256"]:
+        return MODIFIED
+    if stat.S_IMODE(st.st_mode) != expected["mode"]:
+        return MODE_CHANGED
+    return None
+
+
+def verify_tree(directory: pathlib.Path, files: dict[str, dict], executor: concurrent.futures.Executor,
+                fast: bool = False) -> dict[str, str]:
+    """Check a version directory against its file manifest, hashing files on ``executor``.
+
+    Returns:
+        The problems found, keyed by path relative to ``directory``; files
+        that are not in the manifest are reported as unexpected
+    """
+    futures = {relative: executor.submit(check_file, directory / relative, expected, fast)
+               for relative, expected in files.items()}
+    problems = {}
+    for root, dirnames, filenames in os.walk(directory):
+        for filename in filenames + [name for name in dirnames if os.path.islink(os.path.join(root, name))]:
+            relative = os.path.relpath(os.path.join(root, filename), directory)
+            if relative not in files:
+                problems[relative] = UNEXPECTED
+    for relative, future in futures.items():
+        problem = future.result()
+        if problem is not None:
+            problems[relative] = problem
+    return dict(sorted(problems.items()))
+
+
+def repair_files(directory: pathlib.Path, files: dict[str, dict], problems: dict[str, str],
+                 fetch_archive: Callable[[], pathlib.Path]) -> list[str]:
+    """Restore the damaged files of a version directory.
+
+    Symlinks are recreated and modes reset in place. Files whose content
+    changed or that are missing are extracted again, alone, from the
+    package archive returned by ``fetch_archive``, which is only called if
+    needed, and checked against their recorded SHA-256 before they replace
+    the damaged ones. Unexpected files are left alone.
+
+    Returns:
+        The paths that could not be repaired
+    """
+    from dotfiles.extract import extract_archive
+
+    extract = {}
+    for relative, problem in problems.items():
+        expected, path = files.get(relative), directory / relative
+        if problem == UNEXPECTED:
+            continue
+        if "link" in expected:
+            path.unlink(missing_ok=True)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(expected["link"], path)
+        elif problem == MODE_CHANGED:
+            os.chmod(path, expected["mode"])
+        else:
+            extract[relative] = expected
+    if not extract:
+        return []
+
+    def select(name: str) -> bool:
+        name = name.removeprefix("./").strip("/")
+        return name in extract or ("/" in name and name.split("/", 1)[1] in extract)
+
+    staging_root = DotFiles.get_app_dir() / ".staging"
+    staging_root.mkdir(parents=True, exist_ok=True)
+    staging = pathlib.Path(tempfile.mkdtemp(prefix="repair-", dir=staging_root))
+    failed = []
+    try:
+        extract_archive(str(fetch_archive()), staging, select)
+        # The member may sit below the top-level directory of the archive; the recorded digest tells which is right
+        roots = [staging, *(path for path in staging.iterdir() if path.is_dir() and not path.is_symlink())]
+        for relative, expected in extract.items():
+            source = next((root / relative for root in roots if (root / relative).is_file()
+                           and not (root / relative).is_symlink() and hash_file(root / relative) == expected["sha256"]),
+                          None)
+            if source is None:
+                failed.append(relative)
+                continue
+            os.chmod(source, expected["mode"])
+            os.utime(source, ns=(expected["mtime"], expected["mtime"]))
+            (directory / relative).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, directory / relative)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return failed
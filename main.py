@@ -4,9 +4,13 @@ import argparse
 
 import sys
 from typing import Iterable
+from dotfiles import trace
 from dotfiles.path import DotFiles
-from dotfiles.package_manager import PackageManager
-from dotfiles.setup import install_path, uninstall_path
+
+# Only lightweight modules are imported at startup. Every command imports what
+# it needs in its handler, so that e.g. `search` never loads the network and
+# archive stacks. Use `--startup-profile` to check the import cost.
+STARTUP_PROFILE_LIMIT = 25
 
 
 def parse_args(argv: Iterable[str]) -> argparse.Namespace:
@@ -16,46 +20,318 @@ def parse_args(argv: Iterable[str]) -> argparse.Namespace:
     group.add_argument("--install", action="store_true", help="Install: add ./bin to PATH in your shell profile(s)")
     group.add_argument("--uninstall", action="store_true",
                        help="Uninstall: remove the PATH block from your shell profile(s)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Run the command and report the import time of every module")
+    parser.add_argument("--mirror", metavar="URL|DIR",
+                        help="Take archives from a mirror server, directory or bundle, falling back to their "
+                             "upstream URLs (also $DOTFILES_MIRROR)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Time every phase of the command and print a summary to stderr (also $DOTFILES_TRACE=1)")
+    parser.add_argument("--trace-format", choices=trace.FORMATS,
+                        help="Trace output: a summary (human, the default), a Chrome trace (chrome) or one JSON "
+                             "object per phase (jsonl); implies --trace (also $DOTFILES_TRACE=FORMAT)")
+    parser.add_argument("--trace-file", metavar="PATH",
+                        help="Write the trace to PATH instead of stderr (default for chrome: "
+                             f"{trace.DEFAULT_CHROME_FILE}); implies --trace (also $DOTFILES_TRACE_FILE)")
 
     # Subcommands
     subparsers = parser.add_subparsers(dest="command")
 
     # search subcommand
     search_parser = subparsers.add_parser("search", help="Search available packages")
-    search_parser.add_argument("pattern", metavar="PATTERN", help="Search available packages matching PATTERN")
+    search_parser.add_argument("pattern", metavar="PATTERN",
+                               help="Search package names, provided binaries and descriptions for PATTERN")
+    search_parser.add_argument("-n", "--limit", type=int, default=20,
+                               help="Maximum number of results, 0 for all (default: 20)")
+
+    # provides subcommand
+    provides_parser = subparsers.add_parser("provides", help="Find the packages providing an executable")
+    provides_parser.add_argument("binary", metavar="BINARY", help="Name of the executable, e.g. rg")
 
     # install subcommand
-    install_parser = subparsers.add_parser("install", help="Install a package by name")
-    install_parser.add_argument("package_name", metavar="NAME", help="Name of the package to install")
+    install_parser = subparsers.add_parser("install", help="Install packages by name")
+    install_parser.add_argument("package_names", metavar="NAME", nargs="*", help="Name of the package to install")
+    install_parser.add_argument("--all", action="store_true", help="Install every available package")
+    install_parser.add_argument("-j", "--jobs", type=int,
+                                help="Number of concurrent downloads (default: CPUs + 4, at most 8)")
+    install_parser.add_argument("--stream", action="store_true",
+                                help="Hash and extract tar archives while downloading them")
+    install_parser.add_argument("-f", "--force", action="store_true",
+                                help="Reinstall packages even if they are up to date")
 
     # uninstall subcommand
-    uninstall_parser = subparsers.add_parser("uninstall", help="Uninstall a package by name")
-    uninstall_parser.add_argument("package_name", metavar="NAME", help="Name of the package to uninstall")
+    uninstall_parser = subparsers.add_parser("uninstall", help="Uninstall packages by name")
+    uninstall_parser.add_argument("package_names", metavar="NAME", nargs="*", help="Name of the package to uninstall")
+    uninstall_parser.add_argument("--all", action="store_true", help="Uninstall every available package")
+
+    # list / outdated / upgrade subcommands
+    subparsers.add_parser("list", help="List installed packages")
+    subparsers.add_parser("outdated", help="List installed packages with a newer version available")
+    upgrade_parser = subparsers.add_parser("upgrade", help="Upgrade outdated packages")
+    upgrade_parser.add_argument("package_names", metavar="NAME", nargs="*",
+                                help="Name of the package to upgrade (default: all installed packages)")
+    upgrade_parser.add_argument("-j", "--jobs", type=int,
+                                help="Number of concurrent downloads (default: CPUs + 4, at most 8)")
+    upgrade_parser.add_argument("--stream", action="store_true",
+                                help="Hash and extract tar archives while downloading them")
+
+    # lock / sync subcommands
+    lock_parser = subparsers.add_parser("lock", help="Write the installed packages to a lockfile")
+    lock_parser.add_argument("file", metavar="FILE", nargs="?",
+                             help="Lockfile to write (default: dotfiles-lock.json)")
+    sync_parser = subparsers.add_parser("sync", help="Install, upgrade and remove packages to match a lockfile")
+    sync_parser.add_argument("file", metavar="FILE", nargs="?",
+                             help="Lockfile written by `dotfiles lock` (default: dotfiles-lock.json)")
+    sync_parser.add_argument("-j", "--jobs", type=int,
+                             help="Number of concurrent downloads (default: CPUs + 4, at most 8)")
+    sync_parser.add_argument("--stream", action="store_true",
+                             help="Hash and extract tar archives while downloading them")
+    sync_parser.add_argument("-n", "--dry-run", action="store_true", help="Only print what would change")
+
+    # bundle subcommand
+    bundle_parser = subparsers.add_parser("bundle", help="Pack package archives into one file for a mirror or "
+                                                         "an offline host")
+    bundle_parser.add_argument("package_names", metavar="NAME", nargs="*", help="Name of the package to bundle")
+    bundle_parser.add_argument("--all", action="store_true", help="Bundle every available package")
+    bundle_parser.add_argument("-o", "--output", metavar="FILE",
+                               help="Bundle file to write (default: dotfiles-bundle.tar)")
+    bundle_parser.add_argument("-a", "--arch", action="append", metavar="ARCH",
+                               help="Architecture to bundle, repeatable, or `all` (default: this host's)")
+    bundle_parser.add_argument("-j", "--jobs", type=int,
+                               help="Number of concurrent downloads (default: CPUs + 4, at most 8)")
+
+    # rollback / gc subcommands
+    rollback_parser = subparsers.add_parser("rollback", help="Switch a package back to its previous version")
+    rollback_parser.add_argument("name", metavar="NAME", help="Name of the package to roll back")
+    gc_parser = subparsers.add_parser("gc", help="Remove old package versions and unused store files")
+    gc_parser.add_argument("--keep", type=int, metavar="N",
+                           help="Previous versions to keep per package (default: $DOTFILES_KEEP_VERSIONS or 1)")
+
+    # verify subcommand
+    verify_parser = subparsers.add_parser("verify", help="Check installed packages against their file manifests")
+    verify_parser.add_argument("package_names", metavar="NAME", nargs="*",
+                               help="Name of the package to check (default: all installed packages)")
+    verify_parser.add_argument("--fast", action="store_true",
+                               help="Only compare file sizes, modes and modification times, without hashing")
+    verify_parser.add_argument("--repair", action="store_true",
+                               help="Restore damaged files from the cached package archive")
+    verify_parser.add_argument("-j", "--jobs", type=int,
+                               help="Number of files hashed concurrently (default: CPUs, at most 8)")
+
+    # cache subcommand
+    cache_parser = subparsers.add_parser("cache", help="Inspect or prune the downloaded archive cache")
+    cache_parser.add_argument("action", nargs="?", choices=("list", "prune", "clear"), default="list",
+                              help="list cached archives (default), prune them to the size limit, or clear them")
+    cache_parser.add_argument("--max-size", type=_parse_size, metavar="SIZE",
+                              help="Size limit used by prune, e.g. 512M (default: $DOTFILES_CACHE_SIZE or 1G)")
+
+    args = parser.parse_args(list(argv))
+    if args.command in ("install", "uninstall", "bundle") and not args.package_names and not args.all:
+        parser.error(f"{args.command}: at least one NAME or --all is required")
+    return args
+
+
+def _parse_size(text: str) -> int:
+    from dotfiles.cache import parse_size
+
+    return parse_size(text)
+
+
+def _search(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    PackageManager().search(args.pattern, args.limit or None)
+    return 0
+
+
+def _provides(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    return PackageManager().provides(args.binary)
+
+
+def _install(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import DEFAULT_JOBS, PackageManager
+
+    manager = PackageManager()
+    names = list(manager.packages) if args.all else args.package_names
+    return manager.install(names, jobs=args.jobs or DEFAULT_JOBS, stream=args.stream, force=args.force)
+
+
+def _uninstall(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    manager = PackageManager()
+    names = list(manager.packages) if args.all else args.package_names
+    return manager.uninstall(names)
+
+
+def _list(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    PackageManager().list_installed()
+    return 0
+
+
+def _outdated(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    PackageManager().print_outdated()
+    return 0
+
+
+def _upgrade(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import DEFAULT_JOBS, PackageManager
+
+    return PackageManager().upgrade(args.package_names, jobs=args.jobs or DEFAULT_JOBS, stream=args.stream)
+
 
-    return parser.parse_args(list(argv))
+def _lock(args: argparse.Namespace) -> int:
+    import pathlib
 
+    from dotfiles.lockfile import DEFAULT_LOCKFILE
+    from dotfiles.package_manager import PackageManager
 
-def main(argv: Iterable[str] | None = None) -> None:
-    args = parse_args(sys.argv[1:] if argv is None else argv)
+    return PackageManager().lock(pathlib.Path(args.file or DEFAULT_LOCKFILE))
+
+
+def _sync(args: argparse.Namespace) -> int:
+    import pathlib
+
+    from dotfiles.lockfile import DEFAULT_LOCKFILE
+    from dotfiles.package_manager import DEFAULT_JOBS, PackageManager
+
+    return PackageManager().sync(pathlib.Path(args.file or DEFAULT_LOCKFILE), jobs=args.jobs or DEFAULT_JOBS,
+                                 stream=args.stream, dry_run=args.dry_run)
+
+
+def _bundle(args: argparse.Namespace) -> int:
+    import pathlib
+
+    from dotfiles.mirror import DEFAULT_BUNDLE
+    from dotfiles.package_manager import DEFAULT_JOBS, PackageManager
+
+    manager = PackageManager()
+    names = list(manager.index.load_all()) if args.all else args.package_names
+    return manager.bundle(pathlib.Path(args.output or DEFAULT_BUNDLE), names, args.arch, jobs=args.jobs or DEFAULT_JOBS)
+
+
+def _rollback(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    return PackageManager().rollback(args.name)
+
+
+def _gc(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    return PackageManager().gc(args.keep)
+
+
+def _verify(args: argparse.Namespace) -> int:
+    from dotfiles.package_manager import PackageManager
+
+    return PackageManager().verify(args.package_names, fast=args.fast, repair=args.repair, jobs=args.jobs)
+
+
+def _cache(args: argparse.Namespace) -> int:
+    from dotfiles.cache import ArchiveCache, format_size
+    from dotfiles.lock import FileLock
+
+    cache = ArchiveCache(max_size=args.max_size)
+    if args.action == "list":
+        entries = cache.entries()
+        for entry in reversed(entries):
+            print(f"{entry.path.name}  {format_size(entry.size)}")
+        total = sum(entry.size for entry in entries)
+        print(f"{len(entries)} archive(s), {format_size(total)} of {format_size(cache.max_size)} in {cache.path}")
+        return 0
+    with FileLock(DotFiles.get_lock_file()):
+        removed = cache.clear() if args.action == "clear" else cache.prune()
+    print(f"Removed {len(removed)} archive(s), freed {format_size(sum(entry.size for entry in removed))}")
+    return 0
+
+
+COMMANDS = {
+    "search": _search,
+    "provides": _provides,
+    "install": _install,
+    "uninstall": _uninstall,
+    "list": _list,
+    "outdated": _outdated,
+    "upgrade": _upgrade,
+    "lock": _lock,
+    "sync": _sync,
+    "bundle": _bundle,
+    "rollback": _rollback,
+    "gc": _gc,
+    "verify": _verify,
+    "cache": _cache,
+}
+
+
+def _reclaim_trash() -> None:
+    """Delete the trees removed by this command, or left over by an interrupted one, in a detached process."""
+    from dotfiles.trash import Trash
+
+    Trash().empty_in_background()
+
+
+def _startup_profile(argv: list[str]) -> int:
+    """Re-run the command under ``python -X importtime`` and report the most expensive imports."""
+    import subprocess
+
+    result = subprocess.run([sys.executable, "-X", "importtime", __file__, *argv], stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            print(line, file=sys.stderr)
+        elif fields[0].strip().isdigit():
+            modules.append((int(fields[0]), int(fields[1]), fields[2].strip()))
+    modules.sort(reverse=True)
+    print(f"{'self [ms]':>10} {'cumulative [ms]':>16}  module", file=sys.stderr)
+    for self_us, cumulative_us, name in modules[:STARTUP_PROFILE_LIMIT]:
+        print(f"{self_us / 1000:10.2f} {cumulative_us / 1000:16.2f}  {name}", file=sys.stderr)
+    print(f"{len(modules)} modules imported in {sum(m[0] for m in modules) / 1000:.2f} ms", file=sys.stderr)
+    return result.returncode
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parse_args(argv)
+    if args.startup_profile:
+        return _startup_profile([arg for arg in argv if arg != "--startup-profile"])
     if args.install:
+        from dotfiles.setup import install_path
+
         install_path(DotFiles.get_bin_dir())
-        return
+        return 0
     if args.uninstall:
+        from dotfiles.setup import uninstall_path
+
         uninstall_path()
-        return
-    if getattr(args, "command", None) == "search":
-        PackageManager().search(args.pattern)
-        return
-    if getattr(args, "command", None) == "install":
-        PackageManager().install(args.package_name)
-        return
-    if getattr(args, "command", None) == "uninstall":
-        PackageManager().uninstall(args.package_name)
-        return
+        return 0
+    if args.mirror:
+        from dotfiles.mirror import set_mirror
+
+        set_mirror(args.mirror)
+    if getattr(args, "command", None) in COMMANDS:
+        if args.trace or args.trace_format or args.trace_file:
+            trace.enable(args.trace_format, args.trace_file)
+        else:
+            trace.enable_from_env()
+        try:
+            with trace.span(args.command):
+                return COMMANDS[args.command](args)
+        finally:
+            trace.close()
+            _reclaim_trash()
     # Default behavior
     print(
-        "Hello from dotfiles! Usage: dotfiles search PATTERN | install NAME | uninstall NAME | --install | --uninstall")
+        "Hello from dotfiles! Usage: dotfiles search PATTERN | provides BINARY | install NAME... | uninstall NAME... | list | outdated | upgrade | lock [FILE] | sync [FILE] | bundle NAME... | rollback NAME | gc | verify [NAME...] | cache | --install | --uninstall")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import functools
+import hashlib
+import http.server
+import io
+import json
+import pathlib
+import posixpath
+import tarfile
+import threading
+
+import pytest
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves a directory without logging every request to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def serve():
+    """Return a function serving a directory, or a handler class, on localhost and returning its base URL."""
+    servers = []
+
+    def start(directory=None, handler=QuietHandler):
+        if directory is not None:
+            handler = functools.partial(handler, directory=str(directory))
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class Repository:
+    """Package archives served over HTTP, with their manifests in the package directory of a dotfiles tree."""
+
+    def __init__(self, root: pathlib.Path, archives: pathlib.Path, url: str):
+        self.root = root
+        self.archives = archives
+        self.url = url
+
+    def publish(self, name: str, version: str, files: dict[str, bytes], bin: dict[str, str] | None = None,
+                **manifest) -> dict:
+        """Write a tar.gz of ``files`` below a ``<name>-<version>`` directory, as releases are, and its manifest.
+
+        Files linked by ``bin``, by default every file below ``bin/``, are executable.
+        """
+        from dotfiles.package_manager import _get_arch
+
+        bin = {path: posixpath.basename(path) for path in files if path.startswith("bin/")} if bin is None else bin
+        archive = self.archives / f"{name}-{version}.tar.gz"
+        with tarfile.open(archive, "w:gz") as tar:
+            for path, data in files.items():
+                info = tarfile.TarInfo(f"{name}-{version}/{path}")
+                info.size, info.mode = len(data), 0o755 if path in bin else 0o644
+                tar.addfile(info, io.BytesIO(data))
+        data = {
+            "version": version,
+            "architecture": {_get_arch(): {"url": f"{self.url}/{archive.name}",
+                                           "sha256": hashlib.sha256(archive.read_bytes()).hexdigest()}},
+            "bin": bin,
+            **manifest,
+        }
+        (self.root / "dotfiles" / "package" / f"{name}.json").write_text(json.dumps(data, indent=2))
+        return data
+
+
+@pytest.fixture
+def dotfiles_root(tmp_path, monkeypatch):
+    """Point the dotfiles paths at an empty tree in ``tmp_path``."""
+    from dotfiles import mirror
+    from dotfiles.path import DotFiles
+
+    root = tmp_path / "root"
+    (root / "dotfiles" / "package").mkdir(parents=True)
+    (root / "bin").mkdir()
+    monkeypatch.setattr(DotFiles, "get_root_dir", staticmethod(lambda: root))
+    for variable in ("DOTFILES_MIRROR", "DOTFILES_KEEP_VERSIONS", "DOTFILES_TRACE"):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setattr(mirror, "_default", None)
+    return root
+
+
+@pytest.fixture
+def repository(dotfiles_root, tmp_path, serve):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    return Repository(dotfiles_root, archives, serve(archives))
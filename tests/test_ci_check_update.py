@@ -0,0 +1,221 @@
+import http.server
+import json
+import threading
+import time
+import urllib.error
+
+import pytest
+
+from dotfiles.manifest import Checksum
+from dotfiles.tools import ci_check_update
+
+DIGEST = "ab" * 32
+OTHER = "cd" * 32
+
+
+class CountingServer:
+    """Text files served slowly, counting the requests received for each path."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.requests: dict[str, int] = {}
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+    def handler(self) -> type:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                time.sleep(server.delay)
+                data = server.files.get(self.path)
+                self.send_response(404 if data is None else 200)
+                self.send_header("Content-Length", str(len(data or b"")))
+                self.end_headers()
+                self.wfile.write(data or b"")
+
+        return Handler
+
+
+@pytest.fixture
+def server(serve, monkeypatch):
+    monkeypatch.setattr(ci_check_update, "_texts", {})
+    files = CountingServer()
+    files.url = serve(handler=files.handler())
+    return files
+
+
+def _published(server, checksum_file: str, content: bytes, fmt: str, asset: str = "tool-1.0-x86_64.tar.gz") -> str:
+    server.files[f"/{checksum_file}"] = content
+    checksum = Checksum(url=f"{server.url}/{checksum_file}", format=fmt)
+    return ci_check_update._get_published_hash256(checksum, f"{server.url}/download/{asset}", "1.0")
+
+
+def test_published_hash_sha256sum(server):
+    content = f"{OTHER}  tool-1.0-aarch64.tar.gz\n{DIGEST.upper()} *dist/tool-1.0-x86_64.tar.gz\n".encode()
+    assert _published(server, "SHA256SUMS", content, "sha256sum") == DIGEST
+
+
+def test_published_hash_hex(server):
+    content = f"{DIGEST}  tool-1.0-x86_64.tar.gz\n".encode()
+    assert _published(server, "tool-1.0-x86_64.tar.gz.sha256", content, "hex") == DIGEST
+
+
+def test_published_hash_github_release(server):
+    release = {"assets": [
+        {"name": "tool-1.0-aarch64.tar.gz", "digest": f"sha256:{OTHER}"},
+        {"name": "tool-1.0-x86_64.tar.gz", "digest": f"sha256:{DIGEST}"},
+    ]}
+    assert _published(server, "release.json", json.dumps(release).encode(), "github-release") == DIGEST
+
+
+@pytest.mark.parametrize("fmt, content", [
+    ("sha256sum", f"{DIGEST}  tool-1.0-aarch64.tar.gz\n"),
+    ("hex", "no hash here\n"),
+    ("github-release", json.dumps({"assets": [{"name": "tool-1.0-x86_64.tar.gz", "digest": None}]})),
+])
+def test_published_hash_missing_entry(server, fmt, content):
+    with pytest.raises(Exception, match=r"No checksum for tool-1\.0-x86_64\.tar\.gz found in http://.*/checksums"):
+        _published(server, "checksums", content.encode(), fmt)
+
+
+def test_checksum_file_fetched_once(server):
+    server.files["/SHA256SUMS"] = "".join(f"{DIGEST}  tool-{arch}.tar.gz\n" for arch in range(8)).encode()
+    server.delay = 0.2
+    checksum = Checksum(url=f"{server.url}/SHA256SUMS")
+    results = []
+    threads = [
+        threading.Thread(target=lambda arch=arch: results.append(
+            ci_check_update._get_published_hash256(checksum, f"{server.url}/tool-{arch}.tar.gz", "1.0")))
+        for arch in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [DIGEST] * 8
+    assert server.requests == {"/SHA256SUMS": 1}
+
+
+def test_failed_fetch_is_retried(server):
+    url = f"{server.url}/SHA256SUMS"
+    with pytest.raises(urllib.error.HTTPError):
+        ci_check_update._get_text(url)
+    server.files["/SHA256SUMS"] = b"published later\n"
+    assert ci_check_update._get_text(url) == "published later\n"
+    assert server.requests == {"/SHA256SUMS": 2}
+
+
+class ReleaseServer:
+    """A release page answering conditional requests on its ETag, recording the status of every response."""
+
+    def __init__(self):
+        self.body = b""
+        self.etag = '"v1"'
+        self.statuses: list[int] = []
+        self.conditions: list[str | None] = []
+
+    def handler(self) -> type:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                condition = self.headers.get("If-None-Match")
+                server.conditions.append(condition)
+                if condition == server.etag:
+                    server.statuses.append(304)
+                    self.send_response(304)
+                    self.send_header("ETag", server.etag)
+                    self.end_headers()
+                    return
+                server.statuses.append(200)
+                self.send_response(200)
+                self.send_header("ETag", server.etag)
+                self.send_header("Last-Modified", "Sat, 17 Oct 2026 00:00:00 GMT")
+                self.send_header("Content-Length", str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+        return Handler
+
+
+PATTERN = r"tool-(\d+\.\d+)\.tar\.gz"
+
+
+@pytest.fixture
+def release(serve):
+    page = ReleaseServer()
+    page.body = b'<a href="tool-1.0.tar.gz">'
+    page.url = serve(handler=page.handler()) + "/releases"
+    return page
+
+
+@pytest.fixture
+def probe_cache(tmp_path, monkeypatch):
+    cache = ci_check_update.ProbeCache(tmp_path / "update-probes.json")
+    monkeypatch.setattr(ci_check_update, "_probe_cache", cache)
+    return cache
+
+
+def test_unchanged_page_answered_from_cache(release, probe_cache):
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.0"
+    # The body is no longer read, so a version found only in it would not be seen
+    release.body = b"moved"
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.0"
+    assert release.statuses == [200, 304]
+    assert release.conditions == [None, '"v1"']
+
+
+def test_probe_cache_persists(release, probe_cache, monkeypatch):
+    ci_check_update._get_version(release.url, PATTERN)
+    probe_cache.save()
+    entry = json.loads(probe_cache.path.read_text())[release.url]
+    assert entry == {
+        "regex": PATTERN,
+        "etag": '"v1"',
+        "last_modified": "Sat, 17 Oct 2026 00:00:00 GMT",
+        "version": "1.0",
+    }
+
+    # A later run loads the validators and sends a conditional request
+    monkeypatch.setattr(ci_check_update, "_probe_cache", ci_check_update.ProbeCache(probe_cache.path))
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.0"
+    assert release.statuses == [200, 304]
+
+
+def test_changed_page_invalidates_probe(release, probe_cache):
+    ci_check_update._get_version(release.url, PATTERN)
+    release.body, release.etag = b'<a href="tool-1.1.tar.gz">', '"v2"'
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.1"
+    assert release.statuses == [200, 200]
+    assert probe_cache.get(release.url, PATTERN)["etag"] == '"v2"'
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.1"
+    assert release.statuses == [200, 200, 304]
+
+
+def test_changed_pattern_invalidates_probe(release, probe_cache):
+    ci_check_update._get_version(release.url, PATTERN)
+    # The cached version was found by another regex, so the page is fetched unconditionally
+    assert ci_check_update._get_version(release.url, r"tool-(\d+)\.") == "1"
+    assert release.conditions == [None, None]
+    assert release.statuses == [200, 200]
+
+
+def test_corrupted_probe_cache_is_ignored(release, tmp_path, monkeypatch):
+    path = tmp_path / "update-probes.json"
+    path.write_text("{not json")
+    monkeypatch.setattr(ci_check_update, "_probe_cache", ci_check_update.ProbeCache(path))
+    assert ci_check_update._get_version(release.url, PATTERN) == "1.0"
+    assert release.statuses == [200]
@@ -0,0 +1,151 @@
+import http.server
+import json
+import os
+import re
+import threading
+
+import pytest
+
+from dotfiles import download
+from dotfiles.download import Downloader, meta_path
+from dotfiles.transport import Transport
+
+
+class RangeServer:
+    """Files served with ETags and byte ranges, whose connections can be dropped midway."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.etags: dict[str, str] = {}
+        # Number of responses still to cut after a third of their body
+        self.drops = 0
+        self.ranges: list[str | None] = []
+        self.lock = threading.Lock()
+
+    def put(self, path: str, data: bytes, etag: str) -> None:
+        self.files[path], self.etags[path] = data, f'"{etag}"'
+
+    def handler(self) -> type:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                data, etag = server.files.get(self.path), server.etags.get(self.path)
+                if data is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                start, end, status = 0, len(data) - 1, 200
+                match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if match and self.headers.get("If-Range") in (None, etag):
+                    start, status = int(match.group(1)), 206
+                    end = int(match.group(2)) if match.group(2) else end
+                with server.lock:
+                    server.ranges.append(self.headers.get("Range"))
+                    drop = server.drops > 0
+                    server.drops -= drop
+                body = data[start:end + 1]
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                self.end_headers()
+                if drop:
+                    self.wfile.write(body[:len(body) // 3])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
+
+
+@pytest.fixture
+def server(serve):
+    files = RangeServer()
+    files.url = serve(handler=files.handler())
+    return files
+
+
+def _downloader(segments: int = 1, retries: int = 3) -> Downloader:
+    return Downloader(Transport(retries=0), segments=segments, retries=retries)
+
+
+def test_resume_after_disconnect(tmp_path, server):
+    data = os.urandom(300_000)
+    server.put("/tool.tar.gz", data, "v1")
+    server.drops = 1
+    part = tmp_path / "tool.part"
+    _downloader().download(f"{server.url}/tool.tar.gz", part)
+    assert part.read_bytes() == data
+    assert not meta_path(part).exists()
+    # The second request continues from what the first one wrote
+    assert server.ranges == [None, f"bytes={len(data) // 3}-"]
+
+
+def test_resume_across_invocations(tmp_path, server):
+    data = os.urandom(300_000)
+    server.put("/tool.tar.gz", data, "v1")
+    server.drops = 1
+    part = tmp_path / "tool.part"
+    with pytest.raises(OSError):
+        _downloader(retries=0).download(f"{server.url}/tool.tar.gz", part)
+    assert part.stat().st_size == len(data) // 3
+    assert json.loads(meta_path(part).read_text())["validator"] == '"v1"'
+
+    _downloader().download(f"{server.url}/tool.tar.gz", part)
+    assert part.read_bytes() == data
+    assert server.ranges[-1] == f"bytes={len(data) // 3}-"
+
+
+def test_changed_file_restarts_download(tmp_path, server):
+    server.put("/tool.tar.gz", os.urandom(300_000), "v1")
+    server.drops = 1
+    part = tmp_path / "tool.part"
+    with pytest.raises(OSError):
+        _downloader(retries=0).download(f"{server.url}/tool.tar.gz", part)
+
+    # The If-Range validator of the partial download no longer matches, so the server sends the whole new file
+    data = os.urandom(200_000)
+    server.put("/tool.tar.gz", data, "v2")
+    _downloader().download(f"{server.url}/tool.tar.gz", part)
+    assert part.read_bytes() == data
+    assert not meta_path(part).exists()
+
+
+def test_segmented_download(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(download, "MIN_SEGMENT_SIZE", 100_000)
+    data = os.urandom(1_000_000)
+    server.put("/tool.tar.gz", data, "v1")
+    # Cut the initial response, which carries the first segment, and one of the ranged requests
+    server.drops = 2
+    part = tmp_path / "tool.part"
+    _downloader(segments=4).download(f"{server.url}/tool.tar.gz", part)
+    assert part.read_bytes() == data
+    ranges = [r for r in server.ranges if r is not None]
+    assert {"bytes=250000-499999", "bytes=500000-749999", "bytes=750000-999999"} <= set(ranges)
+    # Cut segments are resumed from where they stopped, not refetched
+    assert any(int(r.split("=")[1].split("-")[0]) % 250_000 for r in ranges)
+
+
+def test_segmented_download_restarts_when_file_changes(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(download, "MIN_SEGMENT_SIZE", 100_000)
+    server.put("/tool.tar.gz", os.urandom(1_000_000), "v1")
+    server.drops = 4
+    part = tmp_path / "tool.part"
+    with pytest.raises(OSError):
+        _downloader(segments=4, retries=0).download(f"{server.url}/tool.tar.gz", part)
+    assert json.loads(meta_path(part).read_text())["segments"]
+
+    data = os.urandom(600_000)
+    server.put("/tool.tar.gz", data, "v2")
+    _downloader(segments=4).download(f"{server.url}/tool.tar.gz", part)
+    assert part.read_bytes() == data
@@ -0,0 +1,167 @@
+import io
+import os
+import pathlib
+import tarfile
+import zipfile
+
+import pytest
+
+from dotfiles import extract
+from dotfiles.extract import extract_archive
+
+MTIME = 1_700_000_000
+
+
+def _members() -> list[tuple[tarfile.TarInfo, bytes | None]]:
+    """Members covering files, nested directories, links, a replaced file and a large file."""
+    members = []
+
+    def add(name: str, kind: bytes = tarfile.REGTYPE, data: bytes | None = None, mode: int = 0o644,
+            linkname: str = "") -> None:
+        info = tarfile.TarInfo(name)
+        info.type, info.mode, info.mtime, info.linkname = kind, mode, MTIME + len(members), linkname
+        info.size = len(data) if data is not None else 0
+        members.append((info, data))
+
+    add("tool-1.0", tarfile.DIRTYPE, mode=0o755)
+    add("tool-1.0/bin", tarfile.DIRTYPE, mode=0o755)
+    add("tool-1.0/lib", tarfile.DIRTYPE, mode=0o755)
+    add("tool-1.0/share/doc", tarfile.DIRTYPE, mode=0o755)
+    add("tool-1.0/bin/tool", data=b"#!/bin/sh\necho tool\n", mode=0o755)
+    add("tool-1.0/share/doc/README", data=b"read me\n")
+    add("tool-1.0/share/large.bin", data=os.urandom(300_000))
+    for i in range(40):
+        add(f"tool-1.0/lib/module{i}.py", data=os.urandom(1000 + i))
+    add("tool-1.0/bin/alias", tarfile.SYMTYPE, mode=0o777, linkname="tool")
+    add("tool-1.0/bin/hard", tarfile.LNKTYPE, mode=0o755, linkname="tool-1.0/bin/tool")
+    # A later member with the same path replaces the earlier one
+    add("tool-1.0/share/doc/README", data=b"read me again\n", mode=0o600)
+    add("tool-1.0/share", tarfile.DIRTYPE, mode=0o750)
+    return members
+
+
+def _write_tar(path: pathlib.Path, mode: str, members) -> None:
+    with tarfile.open(path, mode) as tar:
+        for info, data in members:
+            tar.addfile(info, io.BytesIO(data) if data is not None else None)
+
+
+def _write_zip(path: pathlib.Path, members) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for info, data in members:
+            if info.isdir():
+                zip_file.writestr(info.name + "/", b"")
+            elif info.isfile() and data is not None:
+                zip_file.writestr(info.name, data)
+
+
+def _snapshot(root: pathlib.Path) -> dict[str, tuple]:
+    tree = {}
+    for path in sorted(root.rglob("*")):
+        st = path.lstat()
+        relative = path.relative_to(root).as_posix()
+        if path.is_symlink():
+            tree[relative] = ("link", os.readlink(path))
+        elif path.is_dir():
+            tree[relative] = ("dir", st.st_mode, st.st_mtime_ns)
+        else:
+            tree[relative] = ("file", path.read_bytes(), st.st_mode, st.st_mtime_ns)
+    return tree
+
+
+def _extract(archive: pathlib.Path, out: pathlib.Path, workers: int) -> dict[str, tuple]:
+    out.mkdir()
+    extract_archive(str(archive), out, workers=workers)
+    return _snapshot(out)
+
+
+@pytest.fixture(autouse=True)
+def small_limits(monkeypatch):
+    # Exercise the streamed large members and the writer back-pressure with small archives
+    monkeypatch.setattr(extract, "LARGE_MEMBER_SIZE", 100_000)
+    monkeypatch.setattr(extract, "MAX_PENDING_BYTES", 16_000)
+
+
+@pytest.mark.parametrize("suffix, mode", [(".tar.gz", "w:gz"), (".tar.xz", "w:xz")])
+def test_pipelined_tar_matches_sequential(tmp_path, suffix, mode):
+    archive = tmp_path / f"tool-1.0{suffix}"
+    _write_tar(archive, mode, _members())
+    sequential = _extract(archive, tmp_path / "sequential", workers=1)
+    assert _extract(archive, tmp_path / "pipelined", workers=4) == sequential
+    assert sequential["tool-1.0/share/doc/README"][1] == b"read me again\n"
+    assert sequential["tool-1.0/bin/alias"] == ("link", "tool")
+    assert len(sequential) == 50
+
+
+def test_pipelined_zip_matches_sequential(tmp_path):
+    archive = tmp_path / "tool-1.0.zip"
+    _write_zip(archive, [(info, data) for info, data in _members() if info.name != "tool-1.0/share/doc/README"])
+    sequential = _extract(archive, tmp_path / "sequential", workers=1)
+    pipelined = _extract(archive, tmp_path / "pipelined", workers=4)
+    # zipfile sets neither modes nor modification times, so only the contents are compared
+    assert {name: entry[:2] for name, entry in pipelined.items() if entry[0] == "file"} == \
+        {name: entry[:2] for name, entry in sequential.items() if entry[0] == "file"}
+    assert pipelined.keys() == sequential.keys()
+    assert len([entry for entry in sequential.values() if entry[0] == "file"]) == 42
+
+
+def test_select_skips_members(tmp_path):
+    archive = tmp_path / "tool-1.0.tar.gz"
+    _write_tar(archive, "w:gz", _members())
+    out = tmp_path / "out"
+    out.mkdir()
+    extract_archive(str(archive), out, select=lambda name: not name.startswith("tool-1.0/lib"), workers=4)
+    assert not (out / "tool-1.0" / "lib").exists()
+    assert (out / "tool-1.0" / "bin" / "tool").read_bytes() == b"#!/bin/sh\necho tool\n"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("name, linkname, kind", [
+    ("../escape", "", tarfile.REGTYPE),
+    ("tool-1.0/../../escape", "", tarfile.REGTYPE),
+    ("tool-1.0/escape", "../../escape", tarfile.SYMTYPE),
+    ("tool-1.0/escape", "/etc/passwd", tarfile.SYMTYPE),
+])
+def test_tar_rejects_unsafe_members(tmp_path, workers, name, linkname, kind):
+    info = tarfile.TarInfo(name)
+    info.type, info.linkname, info.size = kind, linkname, 4 if kind == tarfile.REGTYPE else 0
+    members = [(info, b"evil" if kind == tarfile.REGTYPE else None)]
+    archive = tmp_path / "evil.tar.gz"
+    _write_tar(archive, "w:gz", members)
+    out = tmp_path / "deep" / "out"
+    out.mkdir(parents=True)
+    with pytest.raises(tarfile.FilterError):
+        extract_archive(str(archive), out, workers=workers)
+    assert not (tmp_path / "deep" / "escape").exists()
+    assert not (tmp_path / "escape").exists()
+    assert not os.path.lexists(out / "tool-1.0" / "escape")
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_tar_strips_absolute_paths(tmp_path, workers):
+    info = tarfile.TarInfo("/tmp/escape")
+    info.size = 4
+    archive = tmp_path / "evil.tar.gz"
+    _write_tar(archive, "w:gz", [(info, b"evil")])
+    out = tmp_path / "out"
+    out.mkdir()
+    extract_archive(str(archive), out, workers=workers)
+    # As with TarFile.extractall(filter="data"), the leading slash is dropped
+    assert (out / "tmp" / "escape").read_bytes() == b"evil"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_zip_keeps_unsafe_members_inside(tmp_path, workers):
+    archive = tmp_path / "evil.zip"
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("../escape", b"evil")
+        zip_file.writestr("tool-1.0/../../escape2", b"evil")
+        zip_file.writestr("/tmp/escape3", b"evil")
+    out = tmp_path / "deep" / "out"
+    out.mkdir(parents=True)
+    extract_archive(str(archive), out, workers=workers)
+    # As with ZipFile.extractall, ".." components and leading slashes are dropped
+    assert {path.relative_to(out).as_posix() for path in out.rglob("*") if path.is_file()} == \
+        {"escape", "tool-1.0/escape2", "tmp/escape3"}
+    assert not (tmp_path / "deep" / "escape").exists()
+    assert not (tmp_path / "escape2").exists()
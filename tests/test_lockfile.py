@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from dotfiles.lockfile import read_lockfile, write_lockfile
+from dotfiles.package_manager import PackageManager, _get_arch
+from dotfiles.path import DotFiles
+from dotfiles.state import InstalledState
+
+
+def _installed() -> dict[str, str]:
+    return {name: entry["version"] for name, entry in InstalledState().packages.items()}
+
+
+def test_lockfile_round_trip(tmp_path):
+    packages = {"tool": {"version": "1.0", "architecture": {"x86_64": {"url": "https://example.com/tool.tar.gz",
+                                                                         "sha256": "ab" * 32}}}}
+    path = tmp_path / "dotfiles-lock.json"
+    write_lockfile(path, packages)
+    assert read_lockfile(path) == packages
+    assert json.loads(path.read_text())["version"] == 1
+
+
+@pytest.mark.parametrize("content, message", [
+    ("{", "Invalid lockfile .*: Expecting"),
+    ('{"version": 2, "packages": {}}', "expected version 1 with a packages map"),
+    ('{"version": 1, "packages": {"tool": {"version": "1.0"}}}', "bad entry for package `tool`"),
+    ('{"version": 1, "packages": {"tool": {"version": "1.0", "architecture": {"x86_64": {}}}}}',
+     "bad entry for package `tool`"),
+])
+def test_invalid_lockfile(tmp_path, content, message):
+    path = tmp_path / "dotfiles-lock.json"
+    path.write_text(content)
+    with pytest.raises(ValueError, match=message):
+        read_lockfile(path)
+
+
+def test_lock_and_sync(repository, tmp_path, capsys):
+    alpha = repository.publish("alpha", "1.0", {"bin/alpha": b"#!/bin/sh\n"})
+    repository.publish("beta", "1.0", {"bin/beta": b"#!/bin/sh\n"})
+    repository.publish("gamma", "1.0", {"bin/gamma": b"#!/bin/sh\n"})
+    assert PackageManager().install(["alpha", "beta"]) == 0
+    lockfile = tmp_path / "dotfiles-lock.json"
+    assert PackageManager().lock(lockfile) == 0
+    assert read_lockfile(lockfile)["alpha"] == {"version": "1.0", "architecture": alpha["architecture"]}
+
+    # A converged host needs neither the network nor the archives
+    for archive in repository.archives.iterdir():
+        archive.rename(tmp_path / archive.name)
+    capsys.readouterr()
+    assert PackageManager().sync(lockfile) == 0
+    assert capsys.readouterr().out == "All packages are in sync\n"
+    for archive in tmp_path.glob("*.tar.gz"):
+        archive.rename(repository.archives / archive.name)
+
+    # Another host: alpha upgraded past the lock, beta missing and gamma not locked
+    repository.publish("alpha", "2.0", {"bin/alpha": b"#!/bin/sh\necho 2\n"})
+    assert PackageManager().upgrade(["alpha"]) == 0
+    assert PackageManager().uninstall(["beta"]) == 0
+    assert PackageManager().install(["gamma"]) == 0
+    capsys.readouterr()
+    assert PackageManager().sync(lockfile, dry_run=True) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "Package `alpha`: upgrade 2.0 -> 1.0",
+        "Package `beta`: install 1.0",
+        "Package `gamma`: remove",
+    ]
+    assert _installed() == {"alpha": "2.0", "gamma": "1.0"}
+
+    assert PackageManager().sync(lockfile) == 0
+    assert _installed() == {"alpha": "1.0", "beta": "1.0"}
+    assert (DotFiles.get_bin_dir() / "alpha").read_bytes() == b"#!/bin/sh\n"
+    assert not (DotFiles.get_bin_dir() / "gamma").exists()
+    assert PackageManager().sync(lockfile) == 0
+    assert capsys.readouterr().out.endswith("All packages are in sync\n")
+
+
+def test_sync_refuses_drifted_archive(repository, tmp_path, capsys):
+    repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\n"})
+    lockfile = tmp_path / "dotfiles-lock.json"
+    write_lockfile(lockfile, {"tool": {"version": "1.0", "architecture": {
+        _get_arch(): repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\n"})["architecture"][_get_arch()]}}})
+    # The archive is republished under the same name with other contents
+    repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\necho tampered\n"})
+    assert PackageManager().sync(lockfile) == 1
+    assert _installed() == {}
+    assert not (DotFiles.get_bin_dir() / "tool").exists()
+
+    # An installed package is kept when the archive it should be replaced with drifted
+    assert PackageManager().install(["tool"]) == 0
+    capsys.readouterr()
+    assert PackageManager().sync(lockfile) == 1
+    assert "Package `tool`: reinstall 1.0" in capsys.readouterr().out
+    assert (DotFiles.get_bin_dir() / "tool").read_bytes() == b"#!/bin/sh\necho tampered\n"
+
+
+def test_sync_reports_unknown_packages(repository, tmp_path, capsys):
+    lockfile = tmp_path / "dotfiles-lock.json"
+    write_lockfile(lockfile, {"missing": {"version": "1.0", "architecture": {}}})
+    assert PackageManager().sync(lockfile) == 1
+    assert "Package `missing` not found" in capsys.readouterr().out
+    (tmp_path / "broken.json").write_text("[]")
+    assert PackageManager().sync(tmp_path / "broken.json") == 1
+    assert capsys.readouterr().out.startswith("Cannot read lockfile: Invalid lockfile")
@@ -0,0 +1,108 @@
+import copy
+import json
+import re
+
+import pytest
+
+from dotfiles.index import PackageIndex
+from dotfiles.manifest import ManifestError, PackageInfo
+from dotfiles.path import DotFiles
+
+SHA256 = "ab" * 32
+VALID = {
+    "version": "1.0",
+    "architecture": {"x86_64": {"url": "https://example.com/tool-1.0.tar.gz", "sha256": SHA256}},
+    "bin": {"bin/tool": "tool"},
+    "update": {
+        "check": {"url": "https://example.com/releases", "regex": r"tool-(\d+\.\d+)"},
+        "architecture": {"x86_64": {"url": "https://example.com/tool-{version}.tar.gz"}},
+        "checksum": {"url": "https://example.com/SHA256SUMS"},
+    },
+}
+
+
+def _set(data: dict, key: str, value) -> None:
+    *parents, last = key.split(".")
+    for parent in parents:
+        data = data[parent]
+    if value is KeyError:
+        del data[last]
+    else:
+        data[last] = value
+
+
+@pytest.mark.parametrize("key, value, message", [
+    ("version", KeyError, "missing key 'version'"),
+    ("version", 1.0, "version: expected a string, got float"),
+    ("homepage", "https://example.com", "unknown key 'homepage'"),
+    ("architecture.x86_64.url", KeyError, "architecture.x86_64: missing key 'url'"),
+    ("architecture.x86_64.url", "", "architecture.x86_64.url: expected a non-empty string"),
+    ("architecture.x86_64.url", ["https://example.com"], "architecture.x86_64.url: expected a string, got list"),
+    ("architecture.x86_64.sha256", "abc", "architecture.x86_64.sha256: expected 64 hexadecimal digits, got 'abc'"),
+    ("architecture.x86_64", "https://example.com/tool.tar.gz", "architecture.x86_64: expected an object, got str"),
+    ("architecture.x86_64.mirror", "https://example.org", "architecture.x86_64: unknown key 'mirror'"),
+    ("architecture", {}, "architecture: expected at least one entry"),
+    ("architecture", ["x86_64"], "architecture: expected an object, got list"),
+    ("bin", {}, "bin: expected at least one entry"),
+    ("bin", {"bin/tool": "bin/tool"}, "bin.bin/tool: expected a file name, got 'bin/tool'"),
+    ("bin", {"bin/tool": True}, "bin.bin/tool: expected a string, got bool"),
+    ("extract", "some", "extract: expected \"all\", \"bin\" or an include/exclude object, got 'some'"),
+    ("extract", {"include": "bin/*"}, "extract.include: expected a list of strings, got str"),
+    ("env", {"1PATH": "x"}, "env: invalid environment variable name '1PATH'"),
+    ("completions", {"fish": "tool.fish"}, "completions: unknown key 'fish'"),
+    ("completions", {"zsh": []}, "completions.zsh: expected at least one string"),
+    ("man", ["man/tool.1", 1], "man[1]: expected a string, got int"),
+    ("update.check.regex", "tool-", "update.check.regex: expected a capture group for the version"),
+    ("update.check.regex", "tool-(", "update.check.regex: missing ), unterminated subpattern at position 5"),
+    ("update.check.mode", "head", "update.check.mode: expected one of body, redirect, got 'head'"),
+    ("update.architecture.x86_64", {}, "update.architecture.x86_64: missing key 'url'"),
+    ("update.checksum.format", "md5", "update.checksum.format: expected one of sha256sum, hex, github-release, "
+                                      "got 'md5'"),
+])
+def test_invalid_manifest(key, value, message):
+    data = copy.deepcopy(VALID)
+    _set(data, key, value)
+    with pytest.raises(ManifestError) as info:
+        PackageInfo.from_manifest("tool", data)
+    assert str(info.value) == f"Invalid package manifest `tool`: {message}"
+
+
+def test_manifest_not_an_object():
+    with pytest.raises(ManifestError, match=r"^Invalid package manifest `tool`: expected an object, got list$"):
+        PackageInfo.from_manifest("tool", [VALID])
+
+
+def test_manifest_not_json(tmp_path):
+    path = tmp_path / "tool.json"
+    path.write_text('{"version": "1.0",')
+    with pytest.raises(ManifestError, match=rf"^Invalid package manifest {re.escape(str(path))}: Expecting"):
+        PackageInfo.load(path)
+
+
+def test_valid_manifest_round_trip():
+    data = copy.deepcopy(VALID)
+    data["architecture"]["x86_64"]["sha256"] = SHA256.upper()
+    package = PackageInfo.from_manifest("tool", data)
+    assert package.architecture["x86_64"].sha256 == SHA256
+    assert package.update.checksum.format == "sha256sum"
+    assert PackageInfo.from_manifest("tool", package.to_manifest()) == package
+
+
+def test_shipped_manifests_are_valid():
+    for path in sorted(DotFiles.get_package_dir().glob("*.json")):
+        PackageInfo.load(path)
+
+
+def test_index_skips_invalid_manifest(tmp_path, capsys):
+    package_dir = tmp_path / "package"
+    package_dir.mkdir()
+    (package_dir / "tool.json").write_text(json.dumps(VALID))
+    broken = copy.deepcopy(VALID)
+    del broken["architecture"]["x86_64"]["url"]
+    (package_dir / "broken.json").write_text(json.dumps(broken))
+    index = PackageIndex(package_dir, tmp_path / "index.json")
+    assert list(index.load("x86_64")) == ["tool"]
+    assert "Invalid package manifest `broken`: architecture.x86_64: missing key 'url'" in capsys.readouterr().err
+    # The error is cached with the manifest, and reported again by a later run
+    assert list(PackageIndex(package_dir, tmp_path / "index.json").load("x86_64")) == ["tool"]
+    assert "broken" in capsys.readouterr().err
@@ -0,0 +1,46 @@
+import socket
+import time
+
+from dotfiles.mirror import PROBE_TIMEOUT, Mirror, mirror_path
+
+URL = "https://github.com/example/tool/releases/download/v1.0/tool-1.0.tar.gz"
+
+
+def _unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_fetch_from_http_mirror(tmp_path, serve):
+    archive = tmp_path / "mirror" / mirror_path(URL)
+    archive.parent.mkdir(parents=True)
+    archive.write_bytes(b"archive" * 1000)
+    mirror = Mirror(serve(tmp_path / "mirror"))
+    part = tmp_path / "tool.part"
+    assert mirror.fetch(URL, part)
+    assert part.read_bytes() == archive.read_bytes()
+
+
+def test_missing_archive_falls_back(tmp_path, serve):
+    (tmp_path / "mirror").mkdir()
+    mirror = Mirror(serve(tmp_path / "mirror"))
+    part = tmp_path / "tool.part"
+    start = time.monotonic()
+    assert not mirror.fetch(URL, part)
+    # A 404 is not retried
+    assert time.monotonic() - start < 1
+    assert not part.exists()
+    # The server is still asked for other archives
+    assert not mirror._unreachable
+
+
+def test_unreachable_mirror_falls_back(tmp_path):
+    mirror = Mirror(f"http://127.0.0.1:{_unused_port()}")
+    part = tmp_path / "tool.part"
+    start = time.monotonic()
+    assert not mirror.fetch(URL, part)
+    assert not mirror.fetch(URL.replace("1.0", "1.1"), part)
+    assert time.monotonic() - start < PROBE_TIMEOUT
+    assert not part.exists()
+    assert mirror._unreachable
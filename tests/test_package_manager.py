@@ -0,0 +1,93 @@
+import os
+
+from dotfiles.package_manager import PackageManager
+from dotfiles.path import DotFiles
+from dotfiles.state import InstalledState
+
+
+def test_upgrade_removes_links_of_dropped_binaries(repository, capsys):
+    repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\n", "bin/tool-old": b"#!/bin/sh\n"})
+    assert PackageManager().install(["tool"]) == 0
+    bin_dir = DotFiles.get_bin_dir()
+    assert (bin_dir / "tool-old").is_file()
+
+    repository.publish("tool", "2.0", {"bin/tool": b"#!/bin/sh\necho 2\n"})
+    assert PackageManager().upgrade() == 0
+    assert (bin_dir / "tool").read_bytes() == b"#!/bin/sh\necho 2\n"
+    assert not os.path.lexists(bin_dir / "tool-old")
+    assert InstalledState().get("tool")["symlinks"] == ["tool"]
+
+    # Rolling back brings the dropped binary back, and uninstalling removes every link
+    assert PackageManager().rollback("tool") == 0
+    assert (bin_dir / "tool-old").is_file()
+    assert PackageManager().uninstall(["tool"]) == 0
+    assert not any(os.path.lexists(bin_dir / link) for link in ("tool", "tool-old"))
+
+
+def test_list_outdated_and_upgrade(repository, capsys):
+    repository.publish("alpha", "1.0", {"bin/alpha": b"#!/bin/sh\n"})
+    repository.publish("beta", "1.0", {"bin/beta": b"#!/bin/sh\n"})
+    assert PackageManager().install(["alpha", "beta"]) == 0
+    assert PackageManager().install(["alpha"]) == 0
+    assert "Package `alpha` is up to date" in capsys.readouterr().out
+
+    PackageManager().list_installed()
+    assert capsys.readouterr().out == "alpha: 1.0\nbeta: 1.0\n"
+    assert PackageManager().upgrade() == 0
+    assert capsys.readouterr().out == "All packages are up to date\n"
+
+    repository.publish("beta", "1.1", {"bin/beta": b"#!/bin/sh\necho 1.1\n"})
+    manager = PackageManager()
+    manager.print_outdated()
+    assert capsys.readouterr().out == "beta: 1.0 -> 1.1\n"
+    assert manager.upgrade(["alpha", "beta", "gamma"]) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "Package `gamma` failed: not installed",
+        "Package `alpha` is up to date",
+        "Package `beta` upgraded",
+        "1 upgraded, 1 up to date, 1 failed",
+    ]
+    assert (DotFiles.get_bin_dir() / "beta").read_bytes() == b"#!/bin/sh\necho 1.1\n"
+    assert PackageManager().outdated() == {}
+    entry = InstalledState().get("beta")
+    assert entry["version"] == "1.1"
+    assert [old["version"] for old in entry["history"]] == ["1.0"]
+
+
+def test_failed_download_keeps_installed_version(repository, capsys):
+    repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\n"})
+    assert PackageManager().install(["tool"]) == 0
+    repository.publish("tool", "2.0", {"bin/tool": b"#!/bin/sh\necho 2\n"})
+    (repository.archives / "tool-2.0.tar.gz").unlink()
+    assert PackageManager().upgrade() == 1
+    assert InstalledState().get("tool")["version"] == "1.0"
+    assert (DotFiles.get_bin_dir() / "tool").read_bytes() == b"#!/bin/sh\n"
+
+
+def test_repair_restores_versions_sharing_a_modified_file(repository, capsys):
+    data = b"shared data\n" * 100
+    repository.publish("tool", "1.0", {"bin/tool": b"#!/bin/sh\n", "share/data": data})
+    repository.publish("other", "1.0", {"bin/other": b"#!/bin/sh\n", "share/data": data})
+    assert PackageManager().install(["tool", "other"]) == 0
+    repository.publish("tool", "2.0", {"bin/tool": b"#!/bin/sh\necho 2\n", "share/data": data})
+    assert PackageManager().upgrade() == 0
+    versions = sorted((DotFiles.get_versions_dir() / "tool").iterdir(), key=lambda path: path.name)
+    current = DotFiles.get_app_dir() / "tool" / "share" / "data"
+    # Every copy is a hard link to one store object, so writing to one of them changes them all
+    assert current.stat().st_nlink == 4
+    with open(current, "r+b") as f:
+        f.write(b"tampered")
+    assert (versions[0] / "share" / "data").read_bytes() != data
+
+    capsys.readouterr()
+    assert PackageManager().verify(["tool"], repair=True) == 0
+    out = capsys.readouterr().out
+    assert "Package `tool`: share/data: modified, repaired" in out
+    assert f"Package `tool`: tool/{versions[0].name}/share/data: modified, repaired" in out
+    assert "Package `tool`: other/" in out
+    for path in [current, versions[0] / "share" / "data", DotFiles.get_app_dir() / "other" / "share" / "data"]:
+        assert path.read_bytes() == data
+    assert current.stat().st_nlink == 4
+    assert PackageManager().verify() == 0
+    assert PackageManager().rollback("tool") == 0
+    assert PackageManager().verify(["tool"]) == 0
@@ -0,0 +1,66 @@
+from dotfiles.manifest import PackageInfo
+from dotfiles.search import SearchEngine, build_search_data
+
+
+def _package(name: str, bin: dict[str, str], description: str) -> PackageInfo:
+    return PackageInfo.from_manifest(name, {
+        "version": "1.0",
+        "architecture": {"x86_64": {"url": f"https://example.com/{name}.tar.gz"}},
+        "bin": bin,
+        "description": description,
+    })
+
+
+PACKAGES = {
+    "ripgrep": _package("ripgrep", {"rg": "rg"}, "Recursively search directories for a regex pattern"),
+    "dufs": _package("dufs", {"dufs": "dufs"}, "A file server"),
+    "neovim": _package("neovim", {"bin/nvim": "nvim"}, "Hyperextensible Vim-based text editor"),
+    "fzf": _package("fzf", {"fzf": "fzf"}, "A general-purpose command-line fuzzy finder"),
+}
+
+
+def _engine() -> SearchEngine:
+    return SearchEngine(build_search_data(PACKAGES), {name: info.resolve("x86_64") for name, info in PACKAGES.items()})
+
+
+def _names(results: list[tuple[str, str]]) -> list[str]:
+    return [name for name, _ in results]
+
+
+def test_exact_match_ranks_first():
+    assert _names(_engine().search("fzf"))[0] == "fzf"
+
+
+def test_prefix_and_binary_match():
+    assert _names(_engine().search("neo")) == ["neovim"]
+    assert _names(_engine().search("nvim"))[0] == "neovim"
+
+
+def test_short_query_matches_inside_terms():
+    engine = _engine()
+    assert _names(engine.search("uf")) == ["dufs"]
+    assert _names(engine.search("ip")) == ["ripgrep"]
+    assert "neovim" in _names(engine.search("ov"))
+
+
+def test_fuzzy_match():
+    assert _names(_engine().search("ripgrap"))[0] == "ripgrep"
+
+
+def test_limit_and_missing_records():
+    engine = SearchEngine(build_search_data(PACKAGES), {"fzf": PACKAGES["fzf"].resolve("x86_64")})
+    assert _names(engine.search("e")) == ["fzf"]
+    assert len(_engine().search("e", limit=2)) == 2
+
+
+def test_provides():
+    assert _engine().provides("rg") == ["ripgrep"]
+    assert _engine().provides("grep") == []
+
+
+def test_search_without_manifests(tmp_path):
+    from dotfiles.index import PackageIndex
+
+    (tmp_path / "package").mkdir()
+    index = PackageIndex(tmp_path / "package", tmp_path / "index.json")
+    assert index.search_engine(index.load("x86_64")).search("rg") == []
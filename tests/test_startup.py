@@ -0,0 +1,31 @@
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+# Modules of the network and archive stacks that read-only commands must not import
+HEAVY_MODULES = ("tarfile", "zipfile", "urllib.request", "http.client", "ssl", "hashlib", "subprocess",
+                 "concurrent.futures", "mmap")
+# Runs main.py and prints the names of the modules it imported
+_SCRIPT = ("import json, runpy, sys; sys.argv = sys.argv[1:]\n"
+           "try:\n    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+           "except SystemExit:\n    pass\n"
+           "print(json.dumps(sorted(sys.modules)))")
+
+
+def _imported_modules(root: pathlib.Path, *argv: str) -> set[str]:
+    result = subprocess.run([sys.executable, "-c", _SCRIPT, str(root / "main.py"), *argv],
+                            capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def test_search_does_not_import_network_or_archive_modules(tmp_path):
+    # A copy of the tree, so that the index and trash are created outside the checkout
+    shutil.copy(ROOT / "main.py", tmp_path)
+    shutil.copytree(ROOT / "dotfiles", tmp_path / "dotfiles", ignore=shutil.ignore_patterns("__pycache__"))
+    # The first run builds the index, the second one reads it
+    for _ in range(2):
+        imported = _imported_modules(tmp_path, "search", "x")
+        assert not imported.intersection(HEAVY_MODULES), sorted(imported.intersection(HEAVY_MODULES))
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from dotfiles.manifest import PackageInfo
+from dotfiles.state import InstalledState
+
+
+def _record(version: str, url: str, sha256: str | None = None):
+    return PackageInfo.from_manifest("tool", {
+        "version": version,
+        "architecture": {"x86_64": {"url": url, **({"sha256": sha256} if sha256 else {})}},
+        "bin": {"tool": "tool"},
+        "env": {"TOOL_HOME": "{dir}"},
+    }).resolve("x86_64")
+
+
+def test_record_save_and_read(dotfiles_root, tmp_path):
+    path = tmp_path / "state.json"
+    state = InstalledState(path)
+    state.record("tool", "1.0", "https://example.com/tool-1.0.tar.gz", "ab" * 32, ["tool"], bin={"tool": "tool"},
+                 path="1.0-aaaa", activation=_record("1.0", "https://example.com/tool-1.0.tar.gz"))
+    state.save()
+    entry = InstalledState(path).get("tool")
+    assert entry["version"] == "1.0"
+    assert entry["symlinks"] == ["tool"]
+    assert entry["history"] == []
+    assert InstalledState(path).installed_record("tool").env == {"TOOL_HOME": "{dir}"}
+
+
+def test_history_and_rollback(dotfiles_root, tmp_path):
+    state = InstalledState(tmp_path / "state.json")
+    state.record("tool", "1.0", "https://example.com/1", None, ["tool"], path="1.0-aaaa")
+    # Reinstalling into the same version directory does not grow the history
+    state.record("tool", "1.0", "https://example.com/1", None, ["tool"], path="1.0-aaaa")
+    state.record("tool", "2.0", "https://example.com/2", None, ["tool"], path="2.0-bbbb")
+    state.record("tool", "3.0", "https://example.com/3", None, ["tool"], path="3.0-cccc")
+    assert [old["version"] for old in state.get("tool")["history"]] == ["1.0", "2.0"]
+
+    state.rollback("tool")
+    assert state.get("tool")["version"] == "2.0"
+    assert [old["version"] for old in state.get("tool")["history"]] == ["1.0", "3.0"]
+
+    assert [old["version"] for old in state.trim_history("tool", 1)] == ["1.0"]
+    assert [old["version"] for old in state.get("tool")["history"]] == ["3.0"]
+    state.trim_history("tool", 0)
+    with pytest.raises(ValueError):
+        state.rollback("tool")
+
+
+def test_is_current(dotfiles_root, tmp_path):
+    state = InstalledState(tmp_path / "state.json")
+    state.record("tool", "1.0", "https://example.com/1", "ab" * 32, ["tool"])
+    (dotfiles_root / "apps" / "tool").mkdir(parents=True)
+    assert state.is_current("tool", _record("1.0", "https://example.com/1", "ab" * 32))
+    assert state.is_current("tool", _record("1.0", "https://example.com/1"))
+    assert not state.is_current("tool", _record("1.1", "https://example.com/1"))
+    assert not state.is_current("tool", _record("1.0", "https://example.com/2"))
+    assert not state.is_current("tool", _record("1.0", "https://example.com/1", "cd" * 32))
+
+
+def test_corrupted_database(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{")
+    with pytest.raises(RuntimeError, match="Corrupted installed-state database"):
+        InstalledState(path)
+    path.write_text(json.dumps([]))
+    assert InstalledState(path).packages == {}
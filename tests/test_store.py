@@ -0,0 +1,126 @@
+import os
+
+from dotfiles.cache import format_size
+from dotfiles.package_manager import PackageManager
+from dotfiles.path import DotFiles
+from dotfiles.state import InstalledState
+from dotfiles.store import FileStore
+
+
+def _write(path, data: bytes, mode: int = 0o644):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.chmod(path, mode)
+    return path
+
+
+def test_dedupe_links_identical_files(tmp_path):
+    store = FileStore(tmp_path / "store")
+    first, second = tmp_path / "1.0", tmp_path / "2.0"
+    _write(first / "bin" / "tool", b"#!/bin/sh\n", 0o755)
+    _write(first / "share" / "data", b"data")
+    _write(second / "bin" / "tool", b"#!/bin/sh\n", 0o755)
+    _write(second / "share" / "data", b"data")
+    # Same content with another mode is another object, as hard links share their mode
+    _write(second / "share" / "script", b"#!/bin/sh\n")
+    _write(second / "empty", b"")
+
+    digests = {}
+    assert store.dedupe(first, digests) == (0, 0)
+    assert set(digests) == {os.path.join("bin", "tool"), os.path.join("share", "data")}
+    assert store.dedupe(second) == (2, len(b"#!/bin/sh\n") + len(b"data"))
+    assert os.path.samefile(first / "bin" / "tool", second / "bin" / "tool")
+    assert os.path.samefile(first / "share" / "data", second / "share" / "data")
+    assert not os.path.samefile(second / "bin" / "tool", second / "share" / "script")
+    assert (second / "empty").stat().st_nlink == 1
+    assert (second / "bin" / "tool").stat().st_mode & 0o777 == 0o755
+    # Deduplicating again finds nothing left to link
+    assert store.dedupe(second) == (0, 0)
+
+
+def test_evict_and_link(tmp_path):
+    store = FileStore(tmp_path / "store")
+    first, second = tmp_path / "1.0", tmp_path / "2.0"
+    _write(first / "data", b"data")
+    _write(second / "data", b"data")
+    digests = {}
+    store.dedupe(first, digests)
+    store.dedupe(second)
+    digest = digests["data"]
+    assert not store.evict(digest, 0o644)
+
+    (second / "data").write_bytes(b"evil")
+    assert (first / "data").read_bytes() == b"evil"
+    assert store.evict(digest, 0o644)
+    assert not store.evict(digest, 0o644)
+    assert not store.link(digest, 0o644, first / "data")
+
+    # The repaired file is a new inode, which becomes the object
+    (second / "data").unlink()
+    _write(second / "data", b"data")
+    store.dedupe(second)
+    assert store.link(digest, 0o644, first / "data")
+    assert (first / "data").read_bytes() == b"data"
+    assert os.path.samefile(first / "data", second / "data")
+
+
+def test_prune_removes_unused_objects(tmp_path):
+    store = FileStore(tmp_path / "store")
+    first, second = tmp_path / "1.0", tmp_path / "2.0"
+    _write(first / "data", b"old data")
+    _write(first / "shared", b"shared")
+    _write(second / "shared", b"shared")
+    store.dedupe(first)
+    store.dedupe(second)
+    assert store.prune() == (0, 0)
+
+    for path in first.iterdir():
+        path.unlink()
+    assert store.prune() == (1, len(b"old data"))
+    assert (second / "shared").stat().st_nlink == 2
+    assert [path.name for path in store.path.iterdir()] == [next(store.path.iterdir()).name]
+    (second / "shared").unlink()
+    assert store.prune() == (1, len(b"shared"))
+    assert list(store.path.iterdir()) == []
+
+
+def _version_dirs(name: str) -> list[str]:
+    directory = DotFiles.get_versions_dir() / name
+    return sorted(path.name.split("-")[0] for path in directory.iterdir()) if directory.is_dir() else []
+
+
+def test_retention_rollback_and_gc(repository, capsys, monkeypatch):
+    shared = b"unchanged between versions\n" * 1000
+    for version in ("1.0", "2.0", "3.0"):
+        repository.publish("tool", version, {"bin/tool": f"#!/bin/sh\necho {version}\n".encode(), "share/data": shared})
+        assert PackageManager().install(["tool"]) == 0
+    # One previous version is kept by default
+    assert _version_dirs("tool") == ["2.0", "3.0"]
+
+    assert PackageManager().rollback("tool") == 0
+    assert (DotFiles.get_bin_dir() / "tool").read_bytes() == b"#!/bin/sh\necho 2.0\n"
+    assert InstalledState().get("tool")["version"] == "2.0"
+    assert PackageManager().rollback("tool") == 0
+    assert InstalledState().get("tool")["version"] == "3.0"
+
+    monkeypatch.setenv("DOTFILES_KEEP_VERSIONS", "2")
+    repository.publish("tool", "4.0", {"bin/tool": b"#!/bin/sh\necho 4.0\n", "share/data": shared})
+    assert PackageManager().install(["tool"]) == 0
+    assert _version_dirs("tool") == ["2.0", "3.0", "4.0"]
+
+    capsys.readouterr()
+    assert PackageManager().gc(keep=0) == 0
+    # Only the scripts of the removed versions, and of 1.0 that install left in the store, are freed;
+    # the installed version still uses the shared data
+    freed = format_size(3 * len(b"#!/bin/sh\necho 2.0\n"))
+    assert capsys.readouterr().out == f"Removed 2 version(s), freed {freed}\n"
+    assert _version_dirs("tool") == ["4.0"]
+    assert InstalledState().get("tool")["history"] == []
+    # The removed trees were deleted, leaving the installed version and the store object
+    assert (DotFiles.get_app_dir() / "tool" / "share" / "data").stat().st_nlink == 2
+    assert PackageManager().rollback("tool") == 1
+
+    assert PackageManager().uninstall(["tool"]) == 0
+    assert PackageManager().gc() == 0
+    assert not (DotFiles.get_versions_dir() / "tool").exists()
+    assert list(DotFiles.get_store_dir().iterdir()) == []